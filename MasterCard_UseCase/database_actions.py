@@ -1,596 +1,1343 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, ASCENDING, IndexModel, UpdateOne
+from bson.decimal128 import Decimal128
+from decimal import Decimal, InvalidOperation
+from collections import OrderedDict
+from functools import wraps
+import argparse
+import logging
+import math
+import os
+import threading
+import time
 import toml
 import pandas as pd
+import dataclasses
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-import streamlit as st
 
-# Load MongoDB connection parameters from secrets.toml
-secrets = toml.load(".streamlit/secrets.toml")
-mongo_url = secrets["mongo"]["url"]
+# The module is shared by the Streamlit pages and the command lines (reconciliation_engine,
+# spool_watcher): it does not use Streamlit, the errors are logged
+logger = logging.getLogger(__name__)
+
+# MongoDB connection parameters are read from secrets.toml, at the first database access
+mongo_secrets_path = os.environ.get('MONGO_SECRETS_PATH', '.streamlit/secrets.toml')
 mongo_database = "Results"
 
+# Options of the MongoClient, each one can be overridden in the [mongo] section of secrets.toml
+mongo_client_options = {
+    'maxPoolSize': 20,
+    'minPoolSize': 0,
+    'maxIdleTimeMS': 300000,
+    'connectTimeoutMS': 5000,
+    'serverSelectionTimeoutMS': 5000,
+    'socketTimeoutMS': 60000,
+    'retryReads': True,
+    'retryWrites': True,
+}
+
+
+# Process-wide client and indexes, created once and shared by all sessions and threads
+mongo_client = None
+mongo_client_lock = threading.Lock()
+indexes_created = None
+indexes_lock = threading.Lock()
+# After a failed index creation, seconds before the next database access tries again
+indexes_retry_seconds = 60
+indexes_failed_at = None
+
+
+def get_client():
+    """
+    Process-wide MongoClient, created at the first database access and shared by all sessions.
+    pymongo connects in the background, so creating it does not block on the network.
+
+    The first access of the process also creates the indexes (see ensure_indexes), whichever
+    page, command line or worker makes it. A failure is logged and retried later, so that the
+    database stays usable without them.
+
+    Returns:
+    MongoClient: The pooled client.
+    """
+    global mongo_client
+    with mongo_client_lock:
+        if mongo_client is None:
+            mongo_secrets = dict(toml.load(mongo_secrets_path)["mongo"])
+            mongo_url = mongo_secrets.pop("url")
+            options = {**mongo_client_options, **mongo_secrets}
+            mongo_client = MongoClient(mongo_url, **options)
+        client = mongo_client
+    if indexes_created is None and (indexes_failed_at is None
+                                    or time.monotonic() - indexes_failed_at >= indexes_retry_seconds):
+        try:
+            ensure_indexes(client)
+        except Exception as e:
+            logger.error(f'Error creating the indexes of the Results collections: {str(e)}')
+    return client
+
+
+def get_database():
+    return get_client()[mongo_database]
+
+
+class LazyCollection:
+    """
+    Collection of the Results database, resolved through get_client at its first use.
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def __getattr__(self, attribute):
+        return getattr(get_database()[self.name], attribute)
+
 
-# Connect to MongoDB
-client = MongoClient(mongo_url)
-db = client[mongo_database]
-collection_recon_results = db['Reconciliation_results']
-collection_results_summary = db['Reconciliation_summary']
-collection_results_rejects = db['Reconciliation_rejects']
+collection_recon_results = LazyCollection('Reconciliation_results')
+collection_results_summary = LazyCollection('Reconciliation_summary')
+collection_results_rejects = LazyCollection('Reconciliation_rejects')
+collection_daily_rollups = LazyCollection('Daily_rollups')
 
-def insert_reconciliated_data(df_result):
+# Amounts are stored as Decimal128 rounded to the cent
+cents = Decimal('0.01')
+
+
+def to_decimal128(value):
     """
-    Insert reconciliated DataFrame data into MongoDB.
+    Convert an amount to Decimal128 for storage.
 
     Parameters:
-    df (pd.DataFrame): DataFrame containing the reconciliated data.
+    value: Number, or string such as '1,234.56' or '*1,234.56' as found in the TT140 report.
+
+    Returns:
+    Decimal128: The amount rounded to the cent, or None if it is missing or not a number.
+    """
+    if value is None or value == '':
+        return None
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    try:
+        if isinstance(value, str):
+            amount = Decimal(value.strip().lstrip('*').replace(',', ''))
+        else:
+            amount = Decimal(str(value))
+    except InvalidOperation:
+        return None
+    return Decimal128(amount.quantize(cents))
+
+
+def from_decimal128(value):
+    """
+    Convert a stored Decimal128 amount back to a float for display and computations.
     """
-    data_to_insert = df_result.to_dict("records")
-    collection_recon_results.insert_many(data_to_insert)
-    return 'Reconciliated data archived in database'
+    if isinstance(value, Decimal128):
+        return float(value.to_decimal())
+    return value
 
 
-def insert_rejection_summary(df_summary):
+def amounts_to_decimal128(df):
+    """
+    Copy of a DataFrame with its 'Montant' columns converted to Decimal128 for insertion.
+    """
+    df = df.copy()
+    for col in df.columns:
+        if 'Montant' in col:
+            df[col] = df[col].map(to_decimal128).astype(object)
+    return df
+
+
+def amounts_from_decimal128(df):
+    """
+    Convert the Decimal128 'Montant' columns of a query result to floats, in place.
+    """
+    for col in df.columns:
+        if 'Montant' in col:
+            df[col] = df[col].map(from_decimal128)
+    return df
+
+
+def migrate_amounts_to_decimal128():
+    """
+    Convert the amounts archived as formatted strings ('1,234.56') to Decimal128.
+    Empty or invalid strings become null. Documents already migrated are left untouched.
+
+    Returns:
+    dict: Number of modified documents per collection and field.
+    """
+    fields_by_collection = {
+        collection_recon_results: ['Montant Total de Transactions', 'Montant de Rejets',
+                                   'Montant de Transactions (Couverture)'],
+        collection_results_summary: ['Montant de Rejets'],
+        collection_results_rejects: ['Montant'],
+    }
+    modified = {}
+    for collection, fields in fields_by_collection.items():
+        for field in fields:
+            result = collection.update_many(
+                {field: {"$type": "string"}},
+                [{
+                    "$set": {
+                        field: {
+                            "$convert": {
+                                "input": {
+                                    "$replaceAll": {
+                                        "input": {"$trim": {"input": f"${field}", "chars": " *"}},
+                                        "find": ",",
+                                        "replacement": ""
+                                    }
+                                },
+                                "to": "decimal",
+                                "onError": None,
+                                "onNull": None
+                            }
+                        }
+                    }
+                }]
+            )
+            modified[f"{collection.name}.{field}"] = result.modified_count
+    invalidate_aggregation_cache()
+    return modified
+
+
+# Indexes of each collection, created at the first database access by ensure_indexes.
+# The natural key of each archived collection (results_key_fields, rejects_key_fields,
+# summary_key_fields) has a unique index, so that a concurrent upsert cannot duplicate a row.
+# The results key index, led by (Date, FILIALE, Réseau), also serves the queries on Date alone.
+indexes_by_collection = {
+    'Reconciliation_results': [
+        IndexModel([('Date', ASCENDING), ('FILIALE', ASCENDING), ('Réseau', ASCENDING), ('Type', ASCENDING),
+                    ('Devise', ASCENDING)], name='Date_FILIALE_Reseau_Type_Devise', unique=True),
+        IndexModel([('FILIALE', ASCENDING)], name='FILIALE'),
+        IndexModel([('Rapprochement', ASCENDING)], name='Rapprochement'),
+    ],
+    'Reconciliation_rejects': [
+        IndexModel([('rejected_date', ASCENDING), ('FILIALE', ASCENDING)], name='rejected_date_FILIALE'),
+        IndexModel([('ARN', ASCENDING), ('Autorisation', ASCENDING), ('rejected_date', ASCENDING)],
+                   name='ARN_Autorisation_rejected_date', unique=True),
+        IndexModel([('FILIALE', ASCENDING)], name='FILIALE'),
+    ],
+    'Reconciliation_summary': [
+        IndexModel([('rejected_date', ASCENDING), ('FILIALE', ASCENDING), ('RESEAU', ASCENDING)],
+                   name='rejected_date_FILIALE_RESEAU', unique=True),
+        IndexModel([('FILIALE', ASCENDING)], name='FILIALE'),
+    ],
+    'Daily_rollups': [
+        IndexModel([('Date', ASCENDING), ('FILIALE', ASCENDING), ('Réseau', ASCENDING), ('Devise', ASCENDING)],
+                   name='Date_FILIALE_Reseau_Devise', unique=True),
+        IndexModel([('FILIALE', ASCENDING)], name='FILIALE'),
+    ],
+}
+
+
+def ensure_indexes(client=None):
+    """
+    Create the indexes of the Results collections. Idempotent: existing indexes are kept,
+    and they are only created once per process, by a single thread; get_client calls it at
+    the first database access. An existing index of the same name whose unique option
+    differs (created by a previous version) is dropped and recreated.
+
+    Parameters:
+    client (MongoClient): Client to use, get_client() if None.
+
+    Returns:
+    dict: Names of the indexes of each collection.
+    """
+    global indexes_created, indexes_failed_at
+    if indexes_created is not None:
+        return indexes_created
+    client = client or get_client()
+    with indexes_lock:
+        if indexes_created is None:
+            try:
+                created = {}
+                for collection_name, indexes in indexes_by_collection.items():
+                    collection = client[mongo_database][collection_name]
+                    existing = collection.index_information()
+                    for index in indexes:
+                        name = index.document['name']
+                        unique = index.document.get('unique', False)
+                        if name in existing and existing[name].get('unique', False) != unique:
+                            collection.drop_index(name)
+                    created[collection_name] = collection.create_indexes(indexes)
+            except Exception:
+                indexes_failed_at = time.monotonic()
+                raise
+            indexes_created = created
+            indexes_failed_at = None
+    return indexes_created
+
+
+def summarize_explain(explain_doc):
     """
-    Insert summary DataFrame data into MongoDB.
+    Summarize the output of explain(): stages of the winning plans and indexes they use.
+
+    Parameters:
+    explain_doc (dict): Output of Cursor.explain() or of the explain command.
+
+    Returns:
+    dict: 'stages', 'indexes', and 'collection_scan' (True if a plan scans the whole collection).
+    """
+    stages = []
+    indexes = []
+
+    def walk_plan(plan):
+        if isinstance(plan, dict):
+            if 'stage' in plan:
+                stages.append(plan['stage'])
+            if 'indexName' in plan:
+                indexes.append(plan['indexName'])
+            for key in ('inputStage', 'inputStages', 'queryPlan'):
+                if key in plan:
+                    walk_plan(plan[key])
+        elif isinstance(plan, list):
+            for item in plan:
+                walk_plan(item)
+
+    def find_winning_plans(doc):
+        if isinstance(doc, dict):
+            for key, value in doc.items():
+                if key == 'winningPlan':
+                    walk_plan(value)
+                else:
+                    find_winning_plans(value)
+        elif isinstance(doc, list):
+            for item in doc:
+                find_winning_plans(item)
+
+    find_winning_plans(explain_doc)
+    return {'stages': stages, 'indexes': indexes, 'collection_scan': 'COLLSCAN' in stages}
+
+
+def explain_aggregate(collection, pipeline):
+    """
+    explain() summary of an aggregation pipeline, see summarize_explain.
+    """
+    explain_doc = get_database().command('explain', {'aggregate': collection.name, 'pipeline': pipeline, 'cursor': {}},
+                                         verbosity='queryPlanner')
+    return summarize_explain(explain_doc)
+
+
+# Results of the dashboard aggregations, keyed by function and parameters.
+# Entries expire after aggregation_cache_ttl seconds, the least recently used ones are
+# evicted past aggregation_cache_size, and the inserts clear the cache.
+# The cache lives in the Streamlit process: the inserts of another process, such as the
+# reconciliation_engine command line or the spool_watcher workers, do not clear it, so the
+# dashboard may show data up to aggregation_cache_ttl seconds older than the database.
+aggregation_cache = OrderedDict()
+aggregation_cache_ttl = 300
+aggregation_cache_size = 64
+aggregation_cache_lock = threading.Lock()
+# Incremented by every invalidation, so that a result computed before a write is not cached after it
+aggregation_cache_generation = 0
+
+
+def copy_cached_result(result):
+    """
+    Copy of a cached result, since callers format the columns of the frames in place.
+    """
+    if isinstance(result, pd.DataFrame):
+        return result.copy()
+    if dataclasses.is_dataclass(result):
+        return dataclasses.replace(result, **{field.name: copy_cached_result(getattr(result, field.name))
+                                              for field in dataclasses.fields(result)})
+    return result
+
+
+def cached_aggregation(error_message, error_result=pd.DataFrame):
+    """
+    Cache the DataFrames returned by an aggregation function in aggregation_cache.
+    Calls with explain=True are not cached.
+
+    The aggregation functions raise on failure: the wrapper then reports the error and returns
+    error_result without caching it, so that the next call queries the database again.
+
+    Parameters:
+    error_message (str): Message written before the exception when the aggregation fails.
+    error_result: Value returned on failure, called if it is callable (default an empty DataFrame).
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                if kwargs.get('explain'):
+                    return func(*args, **kwargs)
+                key = (func.__name__, args, tuple(sorted(kwargs.items())))
+                now = time.monotonic()
+                with aggregation_cache_lock:
+                    generation = aggregation_cache_generation
+                    entry = aggregation_cache.get(key)
+                    if entry is not None and now - entry[0] < aggregation_cache_ttl:
+                        aggregation_cache.move_to_end(key)
+                        return copy_cached_result(entry[1])
+
+                result = func(*args, **kwargs)
+            except Exception as e:
+                logger.error(f'{error_message}: {str(e)}')
+                return error_result() if callable(error_result) else error_result
+
+            with aggregation_cache_lock:
+                if generation != aggregation_cache_generation:
+                    return result
+                aggregation_cache[key] = (now, result)
+                aggregation_cache.move_to_end(key)
+                while len(aggregation_cache) > aggregation_cache_size:
+                    aggregation_cache.popitem(last=False)
+            return copy_cached_result(result)
+
+        return wrapper
+
+    return decorator
+
+
+def invalidate_aggregation_cache():
+    """
+    Drop every cached aggregation result, after new data has been written.
+    """
+    global aggregation_cache_generation
+    with aggregation_cache_lock:
+        aggregation_cache_generation += 1
+        aggregation_cache.clear()
+
+
+# The Daily_rollups collection holds one document per (Date, FILIALE, Réseau, Devise) with the
+# counters the dashboard needs. The inserts keep it up to date with $inc upserts, and
+# backfill_daily_rollups rebuilds it from the archived results and rejects.
+def rollup_value(value):
+    """
+    Key or counter value of a rollup, with the missing values as None and numpy scalars as Python ones.
+    """
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    return value.item() if hasattr(value, 'item') else value
+
+
+def rollup_date(value):
+    """
+    Date of a rollup in %Y-%m-%d format, from a results Date or a rejects rejected_date (%y-%m-%d).
+    """
+    if isinstance(value, str) and len(value) == 8:
+        return datetime.strptime(value, '%y-%m-%d').strftime('%Y-%m-%d')
+    return value
+
+
+def add_rollup_amount(increment, field, value):
+    amount = to_decimal128(value) if not isinstance(value, Decimal128) else value
+    if amount is not None:
+        increment[field] = increment.get(field, Decimal(0)) + amount.to_decimal()
+
+
+def results_rollup_increments(records, increments=None):
+    """
+    Add the counters of reconciliation results to the rollup increments.
+
+    Parameters:
+    records (iterable of dict): Reconciliation results, as inserted in Reconciliation_results.
+    increments (dict): Increments to add to, by rollup key. A new dict is created if None.
+
+    Returns:
+    dict: Increments by rollup key (Date, FILIALE, Réseau, Devise).
+    """
+    increments = {} if increments is None else increments
+    for record in records:
+        key = (rollup_date(record.get('Date')), rollup_value(record.get('FILIALE')),
+               rollup_value(record.get('Réseau')), rollup_value(record.get('Devise')))
+        increment = increments.setdefault(key, {})
+        increment['Nbre de Résultats'] = increment.get('Nbre de Résultats', 0) + 1
+        # Results without a Rapprochement state are only counted in 'Nbre de Résultats'
+        rapprochement = rollup_value(record.get('Rapprochement'))
+        if rapprochement:
+            state_field = f'Rapprochement.{str(rapprochement).upper()}'
+            increment[state_field] = increment.get(state_field, 0) + 1
+        nbr_transactions = rollup_value(record.get('Nbre Total De Transactions'))
+        if isinstance(nbr_transactions, (int, float)):
+            increment['Nbre Total De Transactions'] = increment.get('Nbre Total De Transactions', 0) + nbr_transactions
+        add_rollup_amount(increment, 'Montant de Transactions (Couverture)',
+                          record.get('Montant de Transactions (Couverture)'))
+    return increments
+
+
+def rejects_rollup_increments(records, increments=None):
+    """
+    Add the counters of rejected transactions to the rollup increments.
+
+    Parameters:
+    records (iterable of dict): Rejected transactions, as inserted in Reconciliation_rejects.
+    increments (dict): Increments to add to, by rollup key. A new dict is created if None.
+
+    Returns:
+    dict: Increments by rollup key (Date, FILIALE, Réseau, Devise).
+    """
+    increments = {} if increments is None else increments
+    for record in records:
+        key = (rollup_date(record.get('rejected_date')), rollup_value(record.get('FILIALE')),
+               rollup_value(record.get('RESEAU')), rollup_value(record.get('Devise')))
+        increment = increments.setdefault(key, {})
+        increment['Nbre de Rejets'] = increment.get('Nbre de Rejets', 0) + 1
+        add_rollup_amount(increment, 'Montant de Rejets', record.get('Montant'))
+    return increments
+
+
+def apply_rollup_increments(increments):
+    """
+    Apply the rollup increments to the Daily_rollups collection with $inc upserts.
+
+    Parameters:
+    increments (dict): Increments by rollup key, see results_rollup_increments.
+
+    Returns:
+    int: Number of rollup documents updated or created.
+    """
+    operations = []
+    for (date, filiale, reseau, devise), increment in increments.items():
+        inc = {field: Decimal128(value) if isinstance(value, Decimal) else value
+               for field, value in increment.items()}
+        operations.append(UpdateOne({'Date': date, 'FILIALE': filiale, 'Réseau': reseau, 'Devise': devise},
+                                    {'$inc': inc}, upsert=True))
+    if not operations:
+        return 0
+    result = collection_daily_rollups.bulk_write(operations, ordered=False)
+    return result.modified_count + result.upserted_count
+
+
+def backfill_daily_rollups(batch_size=10000, dates=None):
+    """
+    Rebuild the Daily_rollups collection from the Reconciliation_results and
+    Reconciliation_rejects history.
+
+    Parameters:
+    batch_size (int): Number of documents fetched per round trip.
+    dates (list of str): Dates to rebuild, in %Y-%m-%d format. The whole history if None.
+
+    Returns:
+    int: Number of rollup documents created.
+    """
+    results_fields = {'_id': 0, 'Date': 1, 'FILIALE': 1, 'Réseau': 1, 'Devise': 1, 'Rapprochement': 1,
+                      'Nbre Total De Transactions': 1, 'Montant de Transactions (Couverture)': 1}
+    rejects_fields = {'_id': 0, 'rejected_date': 1, 'FILIALE': 1, 'RESEAU': 1, 'Devise': 1, 'Montant': 1}
+
+    results_query, rejects_query, rollups_query = {}, {}, {}
+    if dates is not None:
+        dates = sorted(set(dates))
+        results_query = {'Date': {'$in': dates}}
+        # The rejects are dated in %y-%m-%d format
+        rejects_query = {'rejected_date': {'$in': [date[2:] for date in dates]}}
+        rollups_query = {'Date': {'$in': dates}}
+
+    increments = results_rollup_increments(
+        collection_recon_results.find(results_query, results_fields, batch_size=batch_size))
+    rejects_rollup_increments(
+        collection_results_rejects.find(rejects_query, rejects_fields, batch_size=batch_size), increments)
+
+    collection_daily_rollups.delete_many(rollups_query)
+    created = apply_rollup_increments(increments)
+    invalidate_aggregation_cache()
+    return created
+
+
+# Number of upserts sent per bulk_write by bulk_upsert
+upsert_batch_size = 1000
+
+# Natural keys of the archived documents: reprocessing a day updates its documents instead of duplicating them
+results_key_fields = ['Date', 'FILIALE', 'Réseau', 'Type', 'Devise']
+rejects_key_fields = ['ARN', 'Autorisation', 'rejected_date']
+summary_key_fields = ['rejected_date', 'FILIALE', 'RESEAU']
+
+
+@dataclass
+class UpsertCounts:
+    """
+    Outcome of bulk_upsert. Skipped documents were already archived with the same values.
+    """
+    inserted: int = 0
+    updated: int = 0
+    skipped: int = 0
+    inserted_records: list = dataclasses.field(default_factory=list, repr=False)
+
+
+def bulk_upsert(collection, records, key_fields, batch_size=None):
+    """
+    Write records with unordered bulk_write batches of UpdateOne upserts on their natural key.
+
+    Parameters:
+    collection: MongoDB collection to write to.
+    records (list of dict): Documents to write.
+    key_fields (list of str): Fields identifying a document.
+    batch_size (int): Number of upserts per bulk_write, upsert_batch_size if None.
+
+    Returns:
+    UpsertCounts: Number of inserted, updated and skipped documents, and the inserted records.
+    """
+    batch_size = batch_size or upsert_batch_size
+    counts = UpsertCounts()
+    for start in range(0, len(records), batch_size):
+        batch = records[start:start + batch_size]
+        operations = []
+        for record in batch:
+            document = {field: value for field, value in record.items() if field != '_id'}
+            # Missing key values are stored as null, so that the next upsert matches them
+            key = {field: rollup_value(document.get(field)) for field in key_fields}
+            document.update(key)
+            operations.append(UpdateOne(key, {'$set': document}, upsert=True))
+        result = collection.bulk_write(operations, ordered=False)
+
+        counts.inserted += result.upserted_count
+        counts.updated += result.modified_count
+        counts.skipped += result.matched_count - result.modified_count
+        counts.inserted_records.extend(batch[index] for index in result.upserted_ids)
+    return counts
+
+
+def refresh_daily_rollups(counts, increments_function, dates):
+    """
+    Bring Daily_rollups up to date after a bulk_upsert: $inc the inserted records, or rebuild
+    the dates written if some documents were updated in place.
+    """
+    if counts.updated:
+        backfill_daily_rollups(dates=dates)
+    elif counts.inserted:
+        apply_rollup_increments(increments_function(counts.inserted_records))
+    if counts.inserted or counts.updated:
+        invalidate_aggregation_cache()
+
+
+def insert_reconciliated_data(df_result, batch_size=None):
+    """
+    Archive reconciliated DataFrame data into MongoDB, upserted on (Date, FILIALE, Réseau, Type, Devise).
 
     Parameters:
     df (pd.DataFrame): DataFrame containing the reconciliated data.
+    batch_size (int): Number of upserts per round trip, upsert_batch_size if None.
+    """
+    data_to_insert = amounts_to_decimal128(df_result).to_dict("records")
+    counts = bulk_upsert(collection_recon_results, data_to_insert, results_key_fields, batch_size)
+    refresh_daily_rollups(counts, results_rollup_increments,
+                          [rollup_date(record.get('Date')) for record in data_to_insert])
+    return (f'Reconciliated data archived in database: {counts.inserted} inserted, '
+            f'{counts.updated} updated, {counts.skipped} unchanged')
+
+
+def insert_rejection_summary(df_summary, run_date, reseau='MASTERCARD INTERNATIONAL', batch_size=None):
+    """
+    Archive the rejection summary DataFrame into MongoDB, upserted on (rejected_date, FILIALE, RESEAU),
+    so that storing the summary of a day again updates it instead of duplicating it.
+
+    Parameters:
+    df_summary (pd.DataFrame): Rejections grouped by FILIALE.
+    run_date (str): The date to be used as the rejection date.
+    reseau (str): Network of the summary, when it has no RESEAU column.
+    batch_size (int): Number of upserts per round trip, upsert_batch_size if None.
     """
-    data_to_insert = df_summary.to_dict("records")
-    collection_results_summary.insert_many(data_to_insert)
-    return 'Reconciliation summary archived in database'
+    df_summary = df_summary.copy()
+    df_summary['rejected_date'] = run_date
+    if 'RESEAU' not in df_summary.columns:
+        df_summary['RESEAU'] = reseau
+    data_to_insert = amounts_to_decimal128(df_summary).to_dict("records")
+    counts = bulk_upsert(collection_results_summary, data_to_insert, summary_key_fields, batch_size)
+    return (f'Reconciliation summary archived in database: {counts.inserted} inserted, '
+            f'{counts.updated} updated, {counts.skipped} unchanged')
 
 
 
-def insert_rejected_transactions(df_rejects, run_date):
+def insert_rejected_transactions(df_rejects, run_date, batch_size=None):
     """
-    Insert rejected transactions DataFrame data into MongoDB and add a rejection date.
+    Archive rejected transactions DataFrame data into MongoDB and add a rejection date.
+    The rejects are upserted on (ARN, Autorisation, rejected_date).
 
     Parameters:
     df_rejects (pd.DataFrame): DataFrame containing the rejected transactions data.
     run_date (str): The date to be used as the rejection date.
+    batch_size (int): Number of upserts per round trip, upsert_batch_size if None.
     """
     try:
         # Add the rejected_date column with the values of run_date
         df_rejects['rejected_date'] = run_date
 
         # Convert DataFrame to dictionary records for MongoDB insertion
-        data_to_insert = df_rejects.to_dict("records")
+        data_to_insert = amounts_to_decimal128(df_rejects).to_dict("records")
 
-        # Insert data into MongoDB collection
-        collection_results_rejects.insert_many(data_to_insert)
+        # Upsert data into MongoDB collection
+        counts = bulk_upsert(collection_results_rejects, data_to_insert, rejects_key_fields, batch_size)
+        refresh_daily_rollups(counts, rejects_rollup_increments, [rollup_date(run_date)])
         #print(run_date)
 
         # Return success message
-        return 'Rejected transactions archived in database successfully'
+        return (f'Rejected transactions archived in database successfully: {counts.inserted} inserted, '
+                f'{counts.updated} updated, {counts.skipped} unchanged')
     except Exception as e:
         # Return error message if insertion fails
         return f'Error archiving rejected transactions in database: {str(e)}'
 
 
-def search_results_by_transaction_date(run_date):
+def search_results_by_transaction_date(run_date, explain=False):
     """
     Search for records in the Reconciliation_results collection by Transaction_Date.
 
     Parameters:
     transaction_date (str): The Transaction_Date to search for in %Y-%m-%d format.
+    explain (bool): If True, return the explain() summary of the query instead of its results.
 
     Returns:
     pd.DataFrame: DataFrame containing the search results.
     """
     try:
         # Query the MongoDB collection for records with the specified Transaction_Date
+        if explain:
+            return summarize_explain(collection_recon_results.find({'Date': run_date}).explain())
         results_recon = collection_recon_results.find({'Date': run_date})
 
         # Convert the results to a DataFrame
-        df_results_recon = pd.DataFrame(list(results_recon))
+        df_results_recon = amounts_from_decimal128(pd.DataFrame(list(results_recon)))
 
         return df_results_recon
     except Exception as e:
         # Return an empty DataFrame if the search fails
-        st.write(f'Error searching for records by Transaction_Date: {str(e)}')
+        logger.error(f'Error searching for records by Transaction_Date: {str(e)}')
+
+
+def reseaux_by_date_range(start_date, end_date, explain=False):
+    """
+    Distinct (Date, Réseau) pairs of the Reconciliation_results collection over a date range,
+    in a single aggregation.
 
+    Parameters:
+    start_date (str): First date of the range in %Y-%m-%d format (included).
+    end_date (str): Last date of the range in %Y-%m-%d format (excluded).
+    explain (bool): If True, return the explain() summary of the query instead of its results.
 
-def search_rejects_by_transaction_date(run_date):
+    Returns:
+    pd.DataFrame: DataFrame with the columns Date and Réseau, sorted by date.
+    """
+    try:
+        # Dates are stored as %Y-%m-%d strings, so the range can be matched lexicographically
+        pipeline = [
+            {"$match": {"Date": {"$gte": start_date, "$lt": end_date}}},
+            {"$project": {"_id": 0, "Date": 1, "Réseau": 1}},
+            {"$group": {"_id": {"Date": "$Date", "Réseau": "$Réseau"}}},
+            {"$sort": {"_id.Date": 1, "_id.Réseau": 1}}
+        ]
+        if explain:
+            return explain_aggregate(collection_recon_results, pipeline)
+        results = collection_recon_results.aggregate(pipeline)
+
+        df_reseaux = pd.DataFrame([result["_id"] for result in results], columns=["Date", "Réseau"])
+
+        return df_reseaux
+    except Exception as e:
+        logger.error(f'Error searching for Réseaux by date range: {str(e)}')
+        return pd.DataFrame(columns=["Date", "Réseau"])
+
+
+# Number of documents per page of the history search, and per chunk of its exports
+history_page_size = 200
+history_chunk_size = 5000
+
+# Fields returned by the history search of the rejects: rejected_date is the searched date
+history_rejects_projection = {'rejected_date': 0}
+
+
+def find_page(collection, query, projection=None, page_size=history_page_size, after_id=None):
+    """
+    Fetch one page of a query, with keyset pagination on _id.
+
+    Parameters:
+    collection: MongoDB collection to search.
+    query (dict): Query filter.
+    projection (dict): Fields to return or to exclude, all of them if None. _id is always returned.
+    page_size (int): Number of documents per page.
+    after_id: _id of the last document of the previous page, None for the first page.
+
+    Returns:
+    tuple: DataFrame of the page without _id, and the _id to pass as after_id to get
+    the next page (None on the last page).
+    """
+    if after_id is not None:
+        query = {**query, '_id': {'$gt': after_id}}
+    # Fetch one document more than the page to know whether there is a next page
+    cursor = collection.find(query, projection).sort('_id', ASCENDING).limit(page_size + 1)
+    documents = list(cursor)
+
+    next_id = None
+    if len(documents) > page_size:
+        documents = documents[:page_size]
+        next_id = documents[-1]['_id']
+
+    df_page = amounts_from_decimal128(pd.DataFrame(documents))
+    if '_id' in df_page.columns:
+        df_page.drop(columns=['_id'], inplace=True)
+    return df_page, next_id
+
+
+def iter_query_chunks(collection, query, projection=None, chunk_size=history_chunk_size):
+    """
+    Stream the results of a query as DataFrames of chunk_size documents, without _id.
+    Only one chunk is held in memory at a time.
+    """
+    projection = {**(projection or {}), '_id': 0}
+    cursor = collection.find(query, projection, batch_size=chunk_size).sort('_id', ASCENDING)
+    documents = []
+    for document in cursor:
+        documents.append(document)
+        if len(documents) == chunk_size:
+            yield amounts_from_decimal128(pd.DataFrame(documents))
+            documents = []
+    if documents:
+        yield amounts_from_decimal128(pd.DataFrame(documents))
+
+
+def search_results_page(run_date, page_size=history_page_size, after_id=None):
+    """
+    One page of the Reconciliation_results records of a date, see find_page.
+
+    Parameters:
+    run_date (str): Date of the records in %Y-%m-%d format.
+    """
+    return find_page(collection_recon_results, {'Date': run_date}, page_size=page_size, after_id=after_id)
+
+
+def search_rejects_page(run_date, page_size=history_page_size, after_id=None):
+    """
+    One page of the Reconciliation_rejects records of a date, see find_page.
+
+    Parameters:
+    run_date (str): Rejection date of the records in %y-%m-%d format.
+    """
+    return find_page(collection_results_rejects, {'rejected_date': run_date}, history_rejects_projection,
+                     page_size=page_size, after_id=after_id)
+
+
+def count_results_by_date(run_date):
+    """
+    Number of Reconciliation_results records of a date, counted on the Date index.
+    """
+    return collection_recon_results.count_documents({'Date': run_date})
+
+
+def count_rejects_by_date(run_date):
+    """
+    Number of Reconciliation_rejects records of a date, counted on the rejected_date index.
+    """
+    return collection_results_rejects.count_documents({'rejected_date': run_date})
+
+
+def iter_results_by_date(run_date, chunk_size=history_chunk_size):
+    return iter_query_chunks(collection_recon_results, {'Date': run_date}, chunk_size=chunk_size)
+
+
+def iter_rejects_by_date(run_date, chunk_size=history_chunk_size):
+    return iter_query_chunks(collection_results_rejects, {'rejected_date': run_date}, history_rejects_projection,
+                             chunk_size=chunk_size)
+
+
+def search_rejects_by_transaction_date(run_date, explain=False):
     """
     Search for records in the Reconciliation_results collection by Transaction_Date.
 
     Parameters:
     transaction_date (str): The Transaction_Date to search for in %Y-%m-%d format.
+    explain (bool): If True, return the explain() summary of the query instead of its results.
 
     Returns:
     pd.DataFrame: DataFrame containing the search results.
     """
     try:
         # Query the MongoDB collection for records with the specified Transaction_Date
+        if explain:
+            return summarize_explain(collection_results_rejects.find({'rejected_date': run_date}).explain())
         rejects_recon = collection_results_rejects.find({'rejected_date': run_date})
 
         # Convert the results to a DataFrame
-        df_rejects_recon = pd.DataFrame(list(rejects_recon))
+        df_rejects_recon = amounts_from_decimal128(pd.DataFrame(list(rejects_recon)))
 
         return df_rejects_recon
     except Exception as e:
         # Return an empty DataFrame if the search fails
-        st.write(f'Error searching for records by Transaction_Date: {str(e)}')
+        logger.error(f'Error searching for records by Transaction_Date: {str(e)}')
 
-def search_by_rapprochement(rapprochment):
+def search_by_rapprochement(rapprochment, explain=False):
     """
     Search for records in the Reconciliation_results collection by etat rapporchement.
 
     Parameters:
     rapprochement
+    explain (bool): If True, return the explain() summary of the query instead of its results.
 
     Returns:
     pd.DataFrame: DataFrame containing the search results.
     """
     try:
         # Query the MongoDB collection for records with the specified Transaction_Date
+        if explain:
+            return summarize_explain(collection_recon_results.find({'Rapprochement': rapprochment}).explain())
         results = collection_recon_results.find({'Rapprochement': rapprochment})
 
         # Convert the results to a DataFrame
-        df_results = pd.DataFrame(list(results))
+        df_results = amounts_from_decimal128(pd.DataFrame(list(results)))
 
         return df_results
     except Exception as e:
         # Return an empty DataFrame if the search fails
-        st.write(f'Error searching for records by Etat de rapprochement: {str(e)}')
+        logger.error(f'Error searching for records by Etat de rapprochement: {str(e)}')
 
-def count_rapprochement():
+def last_30_days_match():
     """
-    Count the number of records in the Reconciliation_results collection grouped by etat de rapprochement.
+    $match condition on the rollups of the last 30 days, the rollups being dated in %Y-%m-%d format.
+    """
+    thirty_days_ago = datetime.now() - timedelta(days=30)
+    return {"Date": {"$gte": thirty_days_ago.strftime('%Y-%m-%d')}}
 
-    Returns:
-    pd.DataFrame: DataFrame containing the count of records for each rapprochement value.
+
+def rapprochement_counts_stages():
     """
-    try:
-        # Use MongoDB aggregation framework to count the number of records grouped by the normalized Rapprochement field
-        pipeline = [
-            {
-                "$project": {
-                    "Rapprochement": {"$toUpper": "$Rapprochement"}
-                }
-            },
-            {
-                "$group": {
-                    "_id": "$Rapprochement",
-                    "count": {"$sum": 1}
-                }
+    Aggregation stages counting the reconciliation results by etat de rapprochement.
+    """
+    # Sum the counters of the rollups, which are kept by upper-cased Rapprochement state
+    return [
+        {
+            "$project": {
+                "Rapprochement": {"$objectToArray": "$Rapprochement"}
             }
-        ]
-        results = collection_recon_results.aggregate(pipeline)
+        },
+        {
+            "$unwind": "$Rapprochement"
+        },
+        {
+            "$group": {
+                "_id": "$Rapprochement.k",
+                "count": {"$sum": "$Rapprochement.v"}
+            }
+        }
+    ]
 
-        # Convert the aggregation results to a DataFrame
-        df_counts = pd.DataFrame(list(results))
 
-        # Rename the columns for clarity
-        df_counts.rename(columns={"_id": "Rapprochement", "count": "Count"}, inplace=True)
+def rapprochement_counts_frame(results):
+    df_counts = pd.DataFrame(list(results))
 
-        return df_counts
-    except Exception as e:
-        # Print error message if the count fails
-        st.write(f'Error counting records by Etat de rapprochement: {str(e)}')
-        return pd.DataFrame()
+    # Rename the columns for clarity
+    df_counts.rename(columns={"_id": "Rapprochement", "count": "Count"}, inplace=True)
+    return df_counts
 
-def count_rapprochement_by_filiale():
-    """
-    Count the number of Rapprochement states grouped by Filiale.
 
-    Returns:
-    pd.DataFrame: DataFrame containing the count of Rapprochement states for each Filiale.
+def rapprochement_by_filiale_stages():
     """
-    try:
-        pipeline = [
-            {
-                "$project": {
-                    "FILIALE": 1,
-                    "Rapprochement": {"$toUpper": "$Rapprochement"}  # Convert to uppercase to avoid case sensitivity issues
-                }
-            },
-            {
-                "$group": {
-                    "_id": {
-                        "FILIALE": "$FILIALE",
-                        "Rapprochement": {"$toUpper": "$Rapprochement"}
-                    },
-                    "count": {"$sum": 1}
-                }
-            },
-            {
-                "$sort": {"_id.FILIALE": 1, "_id.Rapprochement": 1}  # Sort by Filiale and then Rapprochement
+    Aggregation stages counting the Rapprochement states by Filiale.
+    """
+    return [
+        {
+            "$project": {
+                "FILIALE": 1,
+                "Rapprochement": {"$objectToArray": "$Rapprochement"}  # States are upper-cased in the rollups
             }
-        ]
-        results = collection_recon_results.aggregate(pipeline)
-        df_counts = pd.DataFrame(list(results))
+        },
+        {
+            "$unwind": "$Rapprochement"
+        },
+        {
+            "$group": {
+                "_id": {
+                    "FILIALE": "$FILIALE",
+                    "Rapprochement": "$Rapprochement.k"
+                },
+                "count": {"$sum": "$Rapprochement.v"}
+            }
+        },
+        {
+            "$sort": {"_id.FILIALE": 1, "_id.Rapprochement": 1}  # Sort by Filiale and then Rapprochement
+        }
+    ]
 
-        # Flatten the DataFrame for easier plotting
-        df_counts['FILIALE'] = df_counts['_id'].apply(lambda x: x['FILIALE'])
-        df_counts['Rapprochement'] = df_counts['_id'].apply(lambda x: x['Rapprochement'])
-        df_counts.drop(columns=['_id'], inplace=True)
 
+def rapprochement_by_filiale_frame(results):
+    df_counts = pd.DataFrame(list(results))
+    if df_counts.empty:
         return df_counts
-    except Exception as e:
-        st.write(f'Error counting records by Rapprochement and Filiale: {str(e)}')
-        return pd.DataFrame()
 
-def sum_montants_by_filiale(filter_last_30_days=False):
+    # Flatten the DataFrame for easier plotting
+    df_counts['FILIALE'] = df_counts['_id'].apply(lambda x: x['FILIALE'])
+    df_counts['Rapprochement'] = df_counts['_id'].apply(lambda x: x['Rapprochement'])
+    df_counts.drop(columns=['_id'], inplace=True)
+    return df_counts
+
+
+def montants_by_filiale_stages(filter_last_30_days=False):
     """
-    Calculate the sum of Montant Total de Transactions for each Filiale and concatenate it with Devise.
-    Optionally filter transactions to include only those from the last 30 days.
+    Aggregation stages summing the Montant de Transactions (Couverture) by Filiale, with its Devise.
+    """
+    # Only the rollups of reconciliation results
+    match = {"Nbre de Résultats": {"$gt": 0}}
+    if filter_last_30_days:
+        match.update(last_30_days_match())
+
+    return [
+        {"$match": match},
+        {
+            "$group": {
+                "_id": "$FILIALE",
+                "total_montant": { "$sum": "$Montant de Transactions (Couverture)" },  # Sum up the Decimal128 montants
+                "Devise": { "$first": "$Devise" }  # Get the Devise for each Filiale
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "FILIALE": "$_id",
+                "Montant de Transactions (Couverture)": "$total_montant",
+                "Devise": "$Devise"
+            }
+        },
+        {
+            "$sort": { "Montant de Transactions (Couverture)": -1 }  # Sort by total montant in descending order
+        }
+    ]
 
-    Args:
-    filter_last_30_days (bool): If True, filter transactions to include only those from the last 30 days.
 
-    Returns:
-    pd.DataFrame: DataFrame containing the sum of Montant Total de Transactions for each Filiale, concatenated with Devise.
+def rejects_by_filiale_stages(last_30_days=False):
     """
-    try:
-        pipeline = []
-
-        if filter_last_30_days:
-            # Calculate the date 30 days ago from today
-            thirty_days_ago = datetime.now() - timedelta(days=30)
-            thirty_days_ago_str = thirty_days_ago.strftime('%Y-%m-%d')
-            pipeline.append({
-                "$match": {
-                    "Date": { "$gte": thirty_days_ago_str }
-                }
-            })
-
-        pipeline.extend([
-            {
-                "$project": {
-                    "FILIALE": 1,
-                    "Montant de Transactions (Couverture)": {
-                        "$replaceAll": {  # Remove commas from the montant string
-                            "input": "$Montant de Transactions (Couverture)",
-                            "find": ",",
-                            "replacement": ""
-                        }
-                    },
-                    "Devise": 1  # Include Devise field
-                }
-            },
-            {
-                "$project": {
-                    "FILIALE": 1,
-                    "Montant de Transactions (Couverture)": {
-                        "$trim": {  # Remove any extra spaces from the montant string
-                            "input": "$Montant de Transactions (Couverture)"
-                        }
-                    },
-                    "Devise": 1  # Pass Devise field to the next stage
-                }
-            },
-            {
-                "$project": {
-                    "FILIALE": 1,
-                    "Montant de Transactions (Couverture)": {
-                        "$substrCP": [  # Extract numeric part of the montant string
-                            "$Montant de Transactions (Couverture)",
-                            0,
-                            { "$subtract": [ { "$strLenCP": "$Montant de Transactions (Couverture)" }, 3 ] }  # Remove the last three characters (e.g., ".00")
-                        ]
-                    },
-                    "Devise": 1  # Pass Devise field to the next stage
-                }
-            },
-            {
-                "$project": {
-                    "FILIALE": 1,
-                    "Montant de Transactions (Couverture)": {  # Convert string to float
-                        "$toDouble": "$Montant de Transactions (Couverture)"
-                    },
-                    "Devise": 1  # Pass Devise field to the next stage
-                }
-            },
-            {
-                "$group": {
-                    "_id": "$FILIALE",
-                    "total_montant": { "$sum": "$Montant de Transactions (Couverture)" },  # Sum up the montants
-                    "Devise": { "$first": "$Devise" }  # Get the Devise for each Filiale
-                }
-            },
-            {
-                "$project": {
-                    "_id": 0,
-                    "FILIALE": "$_id",
-                    "Montant de Transactions (Couverture)": "$total_montant",
-                    "Devise": "$Devise"
-                }
-            },
-            {
-                "$sort": { "Montant de Transactions (Couverture)": -1 }  # Sort by total montant in descending order
+    Aggregation stages counting the rejected transactions by Filiale, as 'rejected_count'.
+    """
+    # Only the rollups of rejected transactions
+    match = {"Nbre de Rejets": {"$gt": 0}}
+    if last_30_days:
+        match.update(last_30_days_match())
+
+    return [
+        {"$match": match},
+        {
+            "$group": {
+                "_id": "$FILIALE",
+                "rejected_count": { "$sum": "$Nbre de Rejets" }  # Count the number of rejected transactions
             }
-        ])
+        },
+        {
+            "$sort": { "rejected_count": -1 }  # Sort by the number of rejected transactions in descending order
+        }
+    ]
 
-        results = collection_recon_results.aggregate(pipeline)
-        df_montants = pd.DataFrame(list(results))
 
-        return df_montants
+def total_transactions_stages():
+    """
+    Aggregation stages summing the Nbre Total De Transactions by Filiale.
+    """
+    return [
+        {
+            "$match": {"Nbre de Résultats": {"$gt": 0}}
+        },
+        {
+            "$group": {
+                "_id": "$FILIALE",
+                "total_transactions_count": { "$sum": "$Nbre Total De Transactions" }  # Sum of Nbre Total De Transactions
+            }
+        },
+        {
+            "$sort": { "total_transactions_count": -1 }  # Sort by the total number of transactions in descending order
+        }
+    ]
 
-    except Exception as e:
-        st.write(f'Error calculating sum of Montant Total de Transactions by Filiale: {str(e)}')
-        return pd.DataFrame()
 
+def montants_rejetes_stages(filter_last_30_days=False):
+    """
+    Aggregation stages summing the rejected montants by Filiale, with its Devise.
+    """
+    # Only the rollups of rejected transactions
+    match = {"Nbre de Rejets": {"$gt": 0}}
+    if filter_last_30_days:
+        match.update(last_30_days_match())
+
+    return [
+        {"$match": match},
+        {
+            "$group": {
+                "_id": "$FILIALE",
+                "Montant": { "$sum": "$Montant de Rejets" },  # Sum up the montants
+                "Devise": { "$first": "$Devise" }  # Get the Devise for each Filiale
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "FILIALE": "$_id",
+                "Montant": "$Montant",
+                "Devise": "$Devise"
+            }
+        },
+        {
+            "$sort": { "Montant": -1 }  # Sort by total montant in descending order
+        }
+    ]
 
 
-def count_rejected_by_filiale(last_30_days=False):
+@cached_aggregation('Error counting records by Etat de rapprochement')
+def count_rapprochement(explain=False):
     """
-    Count the number of rejected transactions grouped by Filiale.
+    Count the number of reconciliation results grouped by etat de rapprochement, from the Daily_rollups collection.
 
     Parameters:
-    last_30_days (bool): If True, counts the number of rejected transactions in the last 30 days.
+    explain (bool): If True, return the explain() summary of the query instead of its results.
 
     Returns:
-    pd.DataFrame: DataFrame containing the count of rejected transactions for each Filiale.
+    pd.DataFrame: DataFrame containing the count of records for each rapprochement value.
     """
-    try:
-        pipeline = []
-
-        if last_30_days:
-            # Calculate the date 30 days ago from today
-            thirty_days_ago = datetime.now() - timedelta(days=30)
-            thirty_days_ago_str = thirty_days_ago.strftime('%y-%m-%d')
-            #print("30 jours")
-            #print(thirty_days_ago_str)
-            pipeline.append({
-                "$match": {
-                    "rejected_date": {"$gte": thirty_days_ago_str}
-                }
-            })
-
-        pipeline.extend([
-            {
-                "$group": {
-                    "_id": "$FILIALE",
-                    "Rejected Count": {"$sum": 1}  # Count the number of rejected transactions
-                }
-            },
-            {
-                "$sort": {"Rejected Count": -1}  # Sort by the number of rejected transactions in descending order
-            }
-        ])
+    pipeline = rapprochement_counts_stages()
+    if explain:
+        return explain_aggregate(collection_daily_rollups, pipeline)
+    results = collection_daily_rollups.aggregate(pipeline)
 
-        results = collection_results_rejects.aggregate(pipeline)
-        df_rejected_counts = pd.DataFrame(list(results))
-        df_rejected_counts.rename(columns={'_id': 'FILIALE', 'Rejected Count': 'Nombre de Rejets'}, inplace=True)
+    return rapprochement_counts_frame(results)
 
-        return df_rejected_counts
-    except Exception as e:
-        st.write(f'Error counting rejected transactions by Filiale: {str(e)}')
-        return pd.DataFrame()
+@cached_aggregation('Error counting records by Rapprochement and Filiale')
+def count_rapprochement_by_filiale(explain=False):
+    """
+    Count the number of Rapprochement states grouped by Filiale, from the Daily_rollups collection.
+
+    Parameters:
+    explain (bool): If True, return the explain() summary of the query instead of its results.
 
-def total_transactions_by_filiale():
+    Returns:
+    pd.DataFrame: DataFrame containing the count of Rapprochement states for each Filiale.
+    """
+    pipeline = rapprochement_by_filiale_stages()
+    if explain:
+        return explain_aggregate(collection_daily_rollups, pipeline)
+    results = collection_daily_rollups.aggregate(pipeline)
+
+    return rapprochement_by_filiale_frame(results)
+
+@cached_aggregation('Error calculating sum of Montant Total de Transactions by Filiale')
+def sum_montants_by_filiale(filter_last_30_days=False, explain=False):
     """
-    Calculate the total montant de transactions for each Filiale.
+    Calculate the sum of Montant Total de Transactions for each Filiale and concatenate it with Devise,
+    from the Daily_rollups collection.
+    Optionally filter transactions to include only those from the last 30 days.
+
+    Args:
+    filter_last_30_days (bool): If True, filter transactions to include only those from the last 30 days.
+    explain (bool): If True, return the explain() summary of the query instead of its results.
 
     Returns:
-    pd.DataFrame: DataFrame containing the total montant de transactions for each Filiale.
+    pd.DataFrame: DataFrame containing the sum of Montant Total de Transactions for each Filiale, concatenated with Devise.
     """
-    try:
-        pipeline = [
-            {
-                "$project": {
-                    "FILIALE": 1,
-                    "Montant de Transactions (Couverture)": {
-                        "$replaceAll": {  # Remove commas from the montant string
-                            "input": "$Montant de Transactions (Couverture)",
-                            "find": ",",
-                            "replacement": ""
-                        }
-                    }
-                }
-            },
-            {
-                "$project": {
-                    "FILIALE": 1,
-                    "Montant de Transactions (Couverture)": {
-                        "$trim": {  # Remove any extra spaces from the montant string
-                            "input": "$Montant de Transactions (Couverture)"
-                        }
-                    }
-                }
-            },
-            {
-                "$project": {
-                    "FILIALE": 1,
-                    "Montant de Transactions (Couverture)": {  # Convert string to float
-                        "$toDouble": "$Montant de Transactions (Couverture)"
-                    }
-                }
-            },
-            {
-                "$group": {
-                    "_id": "$FILIALE",
-                    "total_transactions": { "$sum": "$Montant de Transactions (Couverture)" }  # Sum up the montants
-                }
-            },
-            {
-                "$sort": { "total_transactions": -1 }  # Sort by total transactions in descending order
-            }
-        ]
+    pipeline = montants_by_filiale_stages(filter_last_30_days)
+    if explain:
+        return explain_aggregate(collection_daily_rollups, pipeline)
+    results = collection_daily_rollups.aggregate(pipeline)
+    df_montants = amounts_from_decimal128(pd.DataFrame(list(results)))
 
-        results = collection_recon_results.aggregate(pipeline)
-        df_transactions = pd.DataFrame(list(results))
-        df_transactions.rename(columns={'_id': 'FILIALE', 'total_transactions': 'Total Transactions'}, inplace=True)
+    return df_montants
 
-        return df_transactions
 
-    except Exception as e:
-        st.write(f'Error calculating total transactions by Filiale: {str(e)}')
-        return pd.DataFrame()
 
-def count_rejects_by_filiale():
+@cached_aggregation('Error counting rejected transactions by Filiale')
+def count_rejected_by_filiale(last_30_days=False, explain=False):
     """
-    Count the number of rejected transactions grouped by Filiale.
+    Count the number of rejected transactions grouped by Filiale, from the Daily_rollups collection.
+
+    Parameters:
+    last_30_days (bool): If True, counts the number of rejected transactions in the last 30 days.
+    explain (bool): If True, return the explain() summary of the query instead of its results.
 
     Returns:
     pd.DataFrame: DataFrame containing the count of rejected transactions for each Filiale.
     """
-    try:
-        pipeline = [
-            {
-                "$group": {
-                    "_id": "$FILIALE",
-                    "rejected_count": { "$sum": 1 }  # Count the number of rejected transactions
-                }
-            },
-            {
-                "$sort": { "rejected_count": -1 }  # Sort by the number of rejected transactions in descending order
-            }
-        ]
+    pipeline = rejects_by_filiale_stages(last_30_days)
+    if explain:
+        return explain_aggregate(collection_daily_rollups, pipeline)
+    results = collection_daily_rollups.aggregate(pipeline)
+    df_rejected_counts = pd.DataFrame(list(results))
+    df_rejected_counts.rename(columns={'_id': 'FILIALE', 'rejected_count': 'Nombre de Rejets'}, inplace=True)
 
-        results = collection_results_rejects.aggregate(pipeline)
-        df_rejected_counts = pd.DataFrame(list(results))
-        df_rejected_counts.rename(columns={'_id': 'FILIALE', 'rejected_count': 'Rejected Count'}, inplace=True)
-
-        return df_rejected_counts
+    return df_rejected_counts
 
-    except Exception as e:
-        st.write(f'Error counting rejected transactions by Filiale: {str(e)}')
-        return pd.DataFrame()
-
-def total_transactions_by_filiale():
+@cached_aggregation('Error counting rejected transactions by Filiale')
+def count_rejects_by_filiale(explain=False):
     """
-    Calculate the total number of transactions for each Filiale.
+    Count the number of rejected transactions grouped by Filiale, from the Daily_rollups collection.
+
+    Parameters:
+    explain (bool): If True, return the explain() summary of the query instead of its results.
 
     Returns:
-    pd.DataFrame: DataFrame containing the total number of transactions for each Filiale.
+    pd.DataFrame: DataFrame containing the count of rejected transactions for each Filiale.
     """
-    try:
-        pipeline = [
-            {
-                "$group": {
-                    "_id": "$FILIALE",
-                    "total_transactions_count": { "$sum": "$Nbre Total De Transactions" }  # Sum of Nbre Total De Transactions
-                }
-            },
-            {
-                "$sort": { "total_transactions_count": -1 }  # Sort by the total number of transactions in descending order
-            }
-        ]
+    pipeline = rejects_by_filiale_stages()
+    if explain:
+        return explain_aggregate(collection_daily_rollups, pipeline)
+    results = collection_daily_rollups.aggregate(pipeline)
+    df_rejected_counts = pd.DataFrame(list(results))
+    df_rejected_counts.rename(columns={'_id': 'FILIALE', 'rejected_count': 'Rejected Count'}, inplace=True)
 
-        results = collection_recon_results.aggregate(pipeline)
-        df_transactions = pd.DataFrame(list(results))
-        df_transactions.rename(columns={'_id': 'FILIALE', 'total_transactions_count': 'Total Transactions Count'}, inplace=True)
+    return df_rejected_counts
 
-        return df_transactions
+@cached_aggregation('Error calculating total transactions by Filiale')
+def total_transactions_by_filiale(explain=False):
+    """
+    Calculate the total number of transactions for each Filiale, from the Daily_rollups collection.
 
-    except Exception as e:
-        st.write(f'Error calculating total transactions by Filiale: {str(e)}')
-        return pd.DataFrame()
+    Parameters:
+    explain (bool): If True, return the explain() summary of the query instead of its results.
 
+    Returns:
+    pd.DataFrame: DataFrame containing the total number of transactions for each Filiale.
+    """
+    pipeline = total_transactions_stages()
+    if explain:
+        return explain_aggregate(collection_daily_rollups, pipeline)
+    results = collection_daily_rollups.aggregate(pipeline)
+    df_transactions = pd.DataFrame(list(results))
+    df_transactions.rename(columns={'_id': 'FILIALE', 'total_transactions_count': 'Total Transactions Count'}, inplace=True)
 
+    return df_transactions
 
-def taux_de_rejets_by_filiale():
+
+def compute_taux_de_rejets(df_total_transactions, df_rejected_counts):
     """
-    Calculate the taux de rejets for each Filiale.
+    Calculate the taux de rejets for each Filiale from its transaction and reject counts.
+
+    Parameters:
+    df_total_transactions (pd.DataFrame): Output of total_transactions_by_filiale.
+    df_rejected_counts (pd.DataFrame): Output of count_rejects_by_filiale.
 
     Returns:
     pd.DataFrame: DataFrame containing the taux de rejets, number of total transactions, and number of rejected transactions for each Filiale.
     """
-    try:
-        # Get total transactions count and rejected transactions count data
-        df_total_transactions = total_transactions_by_filiale()
-        df_rejected_counts = count_rejects_by_filiale()
-
-        # Ensure columns are correctly named and contain the data we need
-        #print("Total Transactions DataFrame:")
-        #print(df_total_transactions)
-        #print("Rejected Transactions DataFrame:")
-        #print(df_rejected_counts)
+    # Merge the dataframes on 'FILIALE'
+    df_merged = pd.merge(df_total_transactions, df_rejected_counts, on='FILIALE', how='left')
 
-        # Merge the dataframes on 'FILIALE'
-        df_merged = pd.merge(df_total_transactions, df_rejected_counts, on='FILIALE', how='left')
+    # Calculate taux de rejets
+    df_merged['Taux de Rejets (%)'] = (df_merged['Rejected Count'] / df_merged['Total Transactions Count']) * 100
 
-        # Check if merge was successful
-        #print("Merged DataFrame:")
-        #print(df_merged)
+    # Convert 'Nbre de Rejets' to integers
+    df_merged['Rejected Count'] = df_merged['Rejected Count'].fillna(0).astype(int)
 
-        # Calculate taux de rejets
-        df_merged['Taux de Rejets (%)'] = (df_merged['Rejected Count'] / df_merged['Total Transactions Count']) * 100
+    # Format 'Taux de Rejets (%)' as a percentage string
+    df_merged['Taux de Rejets (%)'] = df_merged['Taux de Rejets (%)'].apply(lambda x: f'{x:.2f}%')
 
-        # Convert 'Nbre de Rejets' to integers
-        df_merged['Rejected Count'] = df_merged['Rejected Count'].fillna(0).astype(int)
+    # Rename columns for clarity
+    df_merged.rename(columns={
+        'Total Transactions Count': 'Nbre Total De Transactions',
+        'Rejected Count': 'Nbre de Rejets'
+    }, inplace=True)
 
-        # Format 'Taux de Rejets (%)' as a percentage string
-        df_merged['Taux de Rejets (%)'] = df_merged['Taux de Rejets (%)'].apply(lambda x: f'{x:.2f}%')
+    return df_merged[['FILIALE', 'Nbre Total De Transactions', 'Nbre de Rejets', 'Taux de Rejets (%)']]
 
-        # Rename columns for clarity
-        df_merged.rename(columns={
-            'Total Transactions Count': 'Nbre Total De Transactions',
-            'Rejected Count': 'Nbre de Rejets'
-        }, inplace=True)
 
-        # Print DataFrame for debugging
-        #print("DataFrame with Taux de Rejets:")
-        #print(df_merged)
-
-        return df_merged[['FILIALE', 'Nbre Total De Transactions', 'Nbre de Rejets', 'Taux de Rejets (%)']]
+@cached_aggregation('Error calculating taux de rejets by Filiale')
+def taux_de_rejets_by_filiale():
+    """
+    Calculate the taux de rejets for each Filiale.
 
-    except Exception as e:
-        st.write(f'Error calculating taux de rejets by Filiale: {str(e)}')
-        return pd.DataFrame()
+    Returns:
+    pd.DataFrame: DataFrame containing the taux de rejets, number of total transactions, and number of rejected transactions for each Filiale.
+    """
+    # Get total transactions count and rejected transactions count data
+    return compute_taux_de_rejets(total_transactions_by_filiale(), count_rejects_by_filiale())
 
-def montants_rejetes_par_filiale(filter_last_30_days=False):
+@cached_aggregation('Error calculating sum of rejected Montant Total de Transactions by Filiale')
+def montants_rejetes_par_filiale(filter_last_30_days=False, explain=False):
     """
-    Calculate the sum of Montant Total de Transactions for each Filiale and concatenate it with Devise.
+    Calculate the sum of Montant Total de Transactions for each Filiale and concatenate it with Devise,
+    from the Daily_rollups collection.
     Optionally filter transactions to include only those from the last 30 days.
 
     Args:
     filter_last_30_days (bool): If True, filter transactions to include only those from the last 30 days.
+    explain (bool): If True, return the explain() summary of the query instead of its results.
 
     Returns:
     pd.DataFrame: DataFrame containing the sum of Montant Total de Transactions for each Filiale, concatenated with Devise.
     """
-    try:
-        pipeline = []
-
-        if filter_last_30_days:
-            # Calculate the date 30 days ago from today
-            thirty_days_ago = datetime.now() - timedelta(days=30)
-            thirty_days_ago_str = thirty_days_ago.strftime('%y-%m-%d')
-            pipeline.append({
-                "$match": {
-                    "rejected_date": { "$gte": thirty_days_ago_str }
-                }
-            })
-
-        pipeline.extend([
-            {
-                "$group": {
-                    "_id": "$FILIALE",
-                    "Montant": { "$sum": "$Montant" },  # Sum up the montants
-                    "Devise": { "$first": "$Devise" }  # Get the Devise for each Filiale
-                }
-            },
-            {
-                "$project": {
-                    "_id": 0,
-                    "FILIALE": "$_id",
-                    "Montant": "$Montant",
-                    "Devise": "$Devise"
-                }
-            },
-            {
-                "$sort": { "Montant": -1 }  # Sort by total montant in descending order
-            }
-        ])
-
-        results = collection_results_rejects.aggregate(pipeline)
-        df_montants = pd.DataFrame(list(results))
-
-        return df_montants
-
-    except Exception as e:
-        st.write(f'Error calculating sum of rejected Montant Total de Transactions by Filiale: {str(e)}')
-        return pd.DataFrame()
-
-
-
+    pipeline = montants_rejetes_stages(filter_last_30_days)
+    if explain:
+        return explain_aggregate(collection_daily_rollups, pipeline)
+    results = collection_daily_rollups.aggregate(pipeline)
+    df_montants = amounts_from_decimal128(pd.DataFrame(list(results)))
 
+    return df_montants
 
 
+@dataclass
+class DashboardSnapshot:
+    """
+    Every DataFrame shown by the dashboard, with the total and last 30 days variants of the filtered ones.
+    The columns are those of the function named in the comment.
+    """
+    rapprochement_counts: pd.DataFrame              # count_rapprochement
+    rapprochement_by_filiale: pd.DataFrame          # count_rapprochement_by_filiale
+    montants_by_filiale: pd.DataFrame               # sum_montants_by_filiale
+    montants_by_filiale_30_days: pd.DataFrame       # sum_montants_by_filiale(filter_last_30_days=True)
+    rejected_by_filiale: pd.DataFrame               # count_rejected_by_filiale
+    rejected_by_filiale_30_days: pd.DataFrame       # count_rejected_by_filiale(last_30_days=True)
+    taux_de_rejets: pd.DataFrame                    # taux_de_rejets_by_filiale
+    montants_rejetes: pd.DataFrame                  # montants_rejetes_par_filiale
+    montants_rejetes_30_days: pd.DataFrame          # montants_rejetes_par_filiale(filter_last_30_days=True)
+
+
+@cached_aggregation('Error computing the dashboard', error_result=None)
+def dashboard_snapshot(explain=False):
+    """
+    Compute every dashboard metric from the Daily_rollups collection in two $facet aggregations,
+    one for the reconciliation results and one for the rejects.
 
+    Parameters:
+    explain (bool): If True, return the explain() summaries of the two aggregations instead of their results.
 
+    Returns:
+    DashboardSnapshot: The DataFrames of the dashboard, or None if the aggregations fail.
+    """
+    results_pipeline = [{
+        "$facet": {
+            "rapprochement_counts": rapprochement_counts_stages(),
+            "rapprochement_by_filiale": rapprochement_by_filiale_stages(),
+            "montants_by_filiale": montants_by_filiale_stages(),
+            "montants_by_filiale_30_days": montants_by_filiale_stages(filter_last_30_days=True),
+            "total_transactions": total_transactions_stages(),
+        }
+    }]
+    rejects_pipeline = [{
+        "$facet": {
+            "rejected_by_filiale": rejects_by_filiale_stages(),
+            "rejected_by_filiale_30_days": rejects_by_filiale_stages(last_30_days=True),
+            "montants_rejetes": montants_rejetes_stages(),
+            "montants_rejetes_30_days": montants_rejetes_stages(filter_last_30_days=True),
+        }
+    }]
+    if explain:
+        return {'results': explain_aggregate(collection_daily_rollups, results_pipeline),
+                'rejects': explain_aggregate(collection_daily_rollups, rejects_pipeline)}
+    results = next(collection_daily_rollups.aggregate(results_pipeline))
+    rejects = next(collection_daily_rollups.aggregate(rejects_pipeline))
+
+    def rejected_counts(documents, count_column):
+        df_rejected_counts = pd.DataFrame(documents)
+        df_rejected_counts.rename(columns={'_id': 'FILIALE', 'rejected_count': count_column}, inplace=True)
+        return df_rejected_counts
 
+    df_total_transactions = pd.DataFrame(results['total_transactions'])
+    df_total_transactions.rename(columns={'_id': 'FILIALE', 'total_transactions_count': 'Total Transactions Count'}, inplace=True)
+    if df_total_transactions.empty:
+        df_taux_de_rejets = pd.DataFrame()
+    else:
+        df_rejects = rejected_counts(rejects['rejected_by_filiale'], 'Rejected Count')
+        if df_rejects.empty:
+            df_rejects = pd.DataFrame(columns=['FILIALE', 'Rejected Count'])
+        df_taux_de_rejets = compute_taux_de_rejets(df_total_transactions, df_rejects)
+
+    return DashboardSnapshot(
+        rapprochement_counts=rapprochement_counts_frame(results['rapprochement_counts']),
+        rapprochement_by_filiale=rapprochement_by_filiale_frame(results['rapprochement_by_filiale']),
+        montants_by_filiale=amounts_from_decimal128(pd.DataFrame(results['montants_by_filiale'])),
+        montants_by_filiale_30_days=amounts_from_decimal128(pd.DataFrame(results['montants_by_filiale_30_days'])),
+        rejected_by_filiale=rejected_counts(rejects['rejected_by_filiale'], 'Nombre de Rejets'),
+        rejected_by_filiale_30_days=rejected_counts(rejects['rejected_by_filiale_30_days'], 'Nombre de Rejets'),
+        taux_de_rejets=df_taux_de_rejets,
+        montants_rejetes=amounts_from_decimal128(pd.DataFrame(rejects['montants_rejetes'])),
+        montants_rejetes_30_days=amounts_from_decimal128(pd.DataFrame(rejects['montants_rejetes_30_days'])),
+    )
+
+
+if __name__ == "__main__":
+    # Maintenance commands, run from the repository root so that .streamlit/secrets.toml is found
+    # (or with MONGO_SECRETS_PATH pointing to it):
+    #   python MasterCard_UseCase/database_actions.py backfill-rollups
+    parser = argparse.ArgumentParser(description="Maintenance of the reconciliation archive.")
+    parser.add_argument("command", choices=["backfill-rollups"])
+    parser.add_argument("--batch-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    if args.command == "backfill-rollups":
+        print(f"{backfill_daily_rollups(batch_size=args.batch_size)} rollup documents created")
@@ -2,11 +2,11 @@ import streamlit as st
 import plotly.graph_objects as go
 from MasterCard_UseCase.database_actions import *
 
-def pie_chart_etat_rapprochement():
+def pie_chart_etat_rapprochement(snapshot):
     st.header("	:bar_chart:  Etat de rapprochement", divider='grey')
 
     # Get the counts of each Rapprochement
-    df_counts = count_rapprochement()
+    df_counts = snapshot.rapprochement_counts
 
     if df_counts.empty:
         st.write("No data available for état de rapprochement.")
@@ -23,14 +23,16 @@ def pie_chart_etat_rapprochement():
     fig = create_interactive_pie_chart()
     st.plotly_chart(fig)
 
-def create_bar_chart_by_filiale():
+def create_bar_chart_by_filiale(df_counts):
     """
     Create a bar chart that counts the number of Rapprochement states by Filiale.
 
+    Parameters:
+    df_counts (pd.DataFrame): Rapprochement states counted by Filiale, see count_rapprochement_by_filiale.
+
     Returns:
     fig: A Plotly bar chart figure.
     """
-    df_counts = count_rapprochement_by_filiale()
 
     if df_counts.empty:
         print("No data available for état de rapprochement by Filiale.")
@@ -69,17 +71,17 @@ def create_bar_chart_by_filiale():
 
     return fig
 
-def display_bar_chart_by_filiale():
+def display_bar_chart_by_filiale(snapshot):
     st.header(":bar_chart: Etat de rapproch. par filiale", divider='grey')
 
     # Create the bar chart figure
-    fig_bar = create_bar_chart_by_filiale()
+    fig_bar = create_bar_chart_by_filiale(snapshot.rapprochement_by_filiale)
     if fig_bar is not None:
         st.plotly_chart(fig_bar)
     else:
         st.write("No bar chart available.")
 
-def display_table_montants_by_filiale():
+def display_table_montants_by_filiale(snapshot):
     st.header(":bar_chart: Montants par filiale", divider='grey')
 
     # Add a combobox for filtering options
@@ -92,7 +94,7 @@ def display_table_montants_by_filiale():
     filter_last_30_days = filter_option == 'Derniers 30 jours'
 
     # Get the DataFrame
-    df_montants = sum_montants_by_filiale(filter_last_30_days=filter_last_30_days)
+    df_montants = snapshot.montants_by_filiale_30_days if filter_last_30_days else snapshot.montants_by_filiale
 
     if df_montants.empty:
         st.write("No data available for Montant Total de Transactions by Filiale.")
@@ -105,17 +107,17 @@ def display_table_montants_by_filiale():
 
 
 
-def create_bar_chart_rejected_by_filiale(last_30_days=False):
+def create_bar_chart_rejected_by_filiale(df_rejected_counts, last_30_days=False):
     """
     Create a bar chart that shows the number of rejected transactions for each Filiale.
 
     Parameters:
-    last_30_days (bool): If True, counts the number of rejected transactions in the last 30 days.
+    df_rejected_counts (pd.DataFrame): Rejected transactions counted by Filiale, see count_rejected_by_filiale.
+    last_30_days (bool): If True, the counts are those of the last 30 days.
 
     Returns:
     fig: A Plotly bar chart figure.
     """
-    df_rejected_counts = count_rejected_by_filiale(last_30_days)
 
     if df_rejected_counts.empty:
         #print("No data available for rejected transactions by Filiale.")
@@ -164,7 +166,7 @@ def create_bar_chart_rejected_by_filiale(last_30_days=False):
     return fig
 
 
-def display_bar_chart_rejects_by_filiale():
+def display_bar_chart_rejects_by_filiale(snapshot):
     st.header(":bar_chart: Rejets par filiale", divider='grey')
 
     # Add a selectbox to choose the time range
@@ -178,9 +180,9 @@ def display_bar_chart_rejects_by_filiale():
 
     # Create the bar chart figure based on the selection
     if last_30_days:
-        fig_bar = create_bar_chart_rejected_by_filiale(last_30_days=True)
+        fig_bar = create_bar_chart_rejected_by_filiale(snapshot.rejected_by_filiale_30_days, last_30_days=True)
     else:
-        fig_bar = create_bar_chart_rejected_by_filiale(last_30_days=False)
+        fig_bar = create_bar_chart_rejected_by_filiale(snapshot.rejected_by_filiale, last_30_days=False)
 
     if fig_bar is not None:
         st.plotly_chart(fig_bar)
@@ -188,14 +190,14 @@ def display_bar_chart_rejects_by_filiale():
         st.write("No bar chart available.")
 
 
-def create_table_taux_de_rejets_by_filiale():
+def create_table_taux_de_rejets_by_filiale(snapshot):
     """
     Create a DataFrame that shows the taux de rejets for each Filiale.
 
     Returns:
     pd.DataFrame: DataFrame containing the taux de rejets for each Filiale.
     """
-    df_taux_de_rejets = taux_de_rejets_by_filiale()
+    df_taux_de_rejets = snapshot.taux_de_rejets
 
     if df_taux_de_rejets.empty:
         #print("No data available for Taux de Rejets by Filiale.")
@@ -204,11 +206,11 @@ def create_table_taux_de_rejets_by_filiale():
     # Return the DataFrame
     return df_taux_de_rejets
 
-def display_table_taux_de_rejets_by_filiale():
+def display_table_taux_de_rejets_by_filiale(snapshot):
     st.header(":bar_chart: Taux de Rejets par Filiale", divider='grey')
 
     # Get the DataFrame
-    df_taux_de_rejets = create_table_taux_de_rejets_by_filiale()
+    df_taux_de_rejets = create_table_taux_de_rejets_by_filiale(snapshot)
 
     if df_taux_de_rejets is None or df_taux_de_rejets.empty:
         st.write("No data available for Taux de Rejets by Filiale.")
@@ -217,7 +219,7 @@ def display_table_taux_de_rejets_by_filiale():
         st.table(df_taux_de_rejets)
 
 
-def display_table_rejected_montants_by_filiale():
+def display_table_rejected_montants_by_filiale(snapshot):
     st.header(":bar_chart: Montants rejetés par filiale", divider='grey')
 
     # Add a combobox for filtering options with a unique key
@@ -231,7 +233,7 @@ def display_table_rejected_montants_by_filiale():
     filter_last_30_days = filter_option == 'Derniers 30 jours'
 
     # Get the DataFrame
-    df_montants_rejetes = montants_rejetes_par_filiale(filter_last_30_days=filter_last_30_days)
+    df_montants_rejetes = snapshot.montants_rejetes_30_days if filter_last_30_days else snapshot.montants_rejetes
 
     if df_montants_rejetes.empty:
         st.write("No data available for Montant Total de Transactions by Filiale.")
@@ -253,15 +255,21 @@ def main():
     st.sidebar.page_link("pages/calendar_view.py", label="**📆 Vue Agenda**")
     st.header("Tableau de bord", divider='rainbow')
     st.write("  ")
+
+    # Every metric of the page, in two aggregations on the Daily_rollups collection
+    snapshot = dashboard_snapshot()
+    if snapshot is None:
+        return
+
     col1, col2  = st.columns(2)
     with col1:
-        pie_chart_etat_rapprochement()
+        pie_chart_etat_rapprochement(snapshot)
     with col2:
-        display_bar_chart_by_filiale()
-    display_table_montants_by_filiale()
-    display_bar_chart_rejects_by_filiale()
-    display_table_taux_de_rejets_by_filiale()
-    display_table_rejected_montants_by_filiale()
+        display_bar_chart_by_filiale(snapshot)
+    display_table_montants_by_filiale(snapshot)
+    display_bar_chart_rejects_by_filiale(snapshot)
+    display_table_taux_de_rejets_by_filiale(snapshot)
+    display_table_rejected_montants_by_filiale(snapshot)
 
 
 if __name__ == "__main__":
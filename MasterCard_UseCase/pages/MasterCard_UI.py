@@ -1,15 +1,42 @@
-#import streamlit as st
+import streamlit as st
 import plotly.graph_objects as go
 from MasterCard_UseCase.parser_TT140_MasterCard import *
 from MasterCard_UseCase.processing_bank_sources import *
 from MasterCard_UseCase.database_actions import *
+from contextlib import nullcontext
+# Same module as the one imported by the pipeline, which holds the current trace
+from pipeline_trace import tracing
+
+
+def download_file(recon  , df, file_partial_name, button_label , run_date):
+    # Styled Excel file, written in one pass
+    excel_data = write_excel_chunks([df], recon=recon)
+
+    # Define the file name
+    file_name = f"{file_partial_name}_{run_date}.xlsx"
+
+    # Create a download button for the Excel file
+    st.download_button(
+        label=button_label,
+        data=excel_data,
+        file_name=file_name,
+        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        type="primary",
+        use_container_width=True
+    )
+    return excel_data , file_name
+
 
 def upload_all_sources():
     if uploaded_mastercard_file is not None:
         try:
-            run_date, day_after = extract_date_from_mastercard_file(uploaded_mastercard_file.getvalue().decode("utf-8"))
+            # Only the leading bytes of the report are read here, before any full parse
+            preflight = preflight_tt140(uploaded_mastercard_file)
+            run_date, day_after = preflight.run_date, preflight.day_after
             st.write("**La date du rapport MasterCard est :calendar:**", run_date)
             st.write("**Vous effectuerez la réconciliation pour la date :calendar:**", day_after)
+            st.caption(f"Rapport {preflight.report_id} — {preflight.file_size / 1e6:.1f} Mo — "
+                       f"{'' if preflight.exact else '~'}{preflight.estimated_messages} messages rejetés")
         except Exception as e:
             st.error(f"Erreur lors de l'extraction de la date à partir du fichier Mastercard :{e}")
 
@@ -19,9 +46,8 @@ def upload_all_sources():
 
     try:
         if uploaded_cybersource_file:
-            cybersource_file_path = save_uploaded_file(uploaded_cybersource_file)
             validate_file_name_and_date(uploaded_cybersource_file.name, 'CYBERSOURCE', date_to_validate=day_after)
-            df_cybersource = reading_cybersource(cybersource_file_path)
+            df_cybersource = reading_cybersource(uploaded_cybersource_file)
             mastercard_transactions_cybersource = df_cybersource[df_cybersource['RESEAU'] == 'MASTERCARD INTERNATIONAL']
             total_transactions['Cybersource'] = mastercard_transactions_cybersource['NBRE_TRANSACTION'].sum()
     except Exception as e:
@@ -29,9 +55,8 @@ def upload_all_sources():
 
     try:
         if uploaded_pos_file:
-            pos_file_path = save_uploaded_file(uploaded_pos_file)
             validate_file_name_and_date(uploaded_pos_file.name, 'POS', date_to_validate=day_after)
-            df_pos = reading_pos(pos_file_path)
+            df_pos = reading_pos(uploaded_pos_file)
             mastercard_transactions_pos = df_pos[(df_pos['RESEAU'] == 'MASTERCARD INTERNATIONAL') &
                                                  (~df_pos['TYPE_TRANSACTION'].str.endswith('_MDS'))]
             total_transactions['POS'] = mastercard_transactions_pos['NBRE_TRANSACTION'].sum()
@@ -40,9 +65,8 @@ def upload_all_sources():
 
     try:
         if uploaded_sai_manuelle_file:
-            sai_manuelle_file_path = save_uploaded_file(uploaded_sai_manuelle_file)
             validate_file_name_and_date(uploaded_sai_manuelle_file.name, 'SAIS_MANU', date_to_validate=day_after)
-            df_sai_manuelle = reading_saisie_manuelle(sai_manuelle_file_path)
+            df_sai_manuelle = reading_saisie_manuelle(uploaded_sai_manuelle_file)
             mastercard_transactions_sai_manuelle = df_sai_manuelle[df_sai_manuelle['RESEAU'] == 'MASTERCARD INTERNATIONAL']
             total_transactions['Saisie Manuelle'] = mastercard_transactions_sai_manuelle['NBRE_TRANSACTION'].sum()
     except Exception as e:
@@ -79,16 +103,16 @@ def handle_recon(filtered_cybersource_df, filtered_saisie_manuelle_df, filtered_
 
 
         if uploaded_mastercard_file:
-            mastercard_file_path = save_uploaded_file(uploaded_mastercard_file)
-            nbr_total_MC, rejected_summary, rejected_df = parse_t140_MC(mastercard_file_path)
+            # Uploaded files are read from their in-memory buffer, nothing is written to /tmp
+            parsed_tt140 = parse_t140_MC(uploaded_mastercard_file)
+            nbr_total_MC = parsed_tt140.nbr_total
             col1, col2, col3 = st.columns(3)
             col1.metric("**:orange-background[Nombre total de transactions dans le fichier Mastercard] :**", value=nbr_total_MC)
 
             if uploaded_recycled_file:
-                recycled_file_path = save_uploaded_file(uploaded_recycled_file)
                 # st.write("La date du filtrage : ", filtering_date)
                 df_recycled, merged_df, total_nbre_transactions = merging_with_recycled(
-                    recycled_file_path, filtered_cybersource_df, filtered_saisie_manuelle_df, filtered_pos_df, filtering_date)
+                    uploaded_recycled_file, filtered_cybersource_df, filtered_saisie_manuelle_df, filtered_pos_df, filtering_date)
                 total_transactions['Transactions Recyclées'] = len(df_recycled)
                 bar_chart()
                 st.header(":small_blue_diamond: :blue-background[Transactions recyclées]")
@@ -113,16 +137,15 @@ def handle_recon(filtered_cybersource_df, filtered_saisie_manuelle_df, filtered_
                     st.divider()
 
                 else:
-                        st.session_state.df_non_reconciliated = handle_non_match_reconciliation(mastercard_file_path, merged_df , run_date=run_date)
-                        st.session_state.df_summary = calculate_rejected_summary(mastercard_file_path)
-                        st.session_state.df_rejections = extract_rejections(mastercard_file_path, currencies_settings, countries_settings)
+                        st.session_state.df_non_reconciliated = handle_non_match_reconciliation(parsed_tt140, merged_df , run_date=run_date)
+                        st.session_state.df_summary, st.session_state.df_rejections = rejection_outputs(parsed_tt140)
                         st.warning("Réconciliation faite avec un écart")
                         st.divider()
 
             # Always display the dataframes stored in session state
             if st.session_state.df_reconciliated is not None:
                 st.header(':small_blue_diamond: :blue-background[Résulat de la réconciliation]')
-                st.dataframe(st.session_state.df_reconciliated)
+                st.dataframe(style_amounts(st.session_state.df_reconciliated))
                 col4, col5, col6, col7= st.columns(4)
                 with col4:
                     excel_path_email_1 , file_name_1= download_file(recon=True, df=st.session_state.df_reconciliated, file_partial_name='results_recon_MC', button_label=":arrow_down: Téléchargez les résultats de réconciliation", run_date=run_date)
@@ -139,7 +162,7 @@ def handle_recon(filtered_cybersource_df, filtered_saisie_manuelle_df, filtered_
 
             if st.session_state.df_non_reconciliated is not None:
                 st.header(':small_blue_diamond: :blue-background[Résultat de la Réconciliation]')
-                st.dataframe(st.session_state.df_non_reconciliated.style.apply(highlight_non_reconciliated_row, axis=1))
+                st.dataframe(style_amounts(st.session_state.df_non_reconciliated.style.apply(highlight_non_reconciliated_row, axis=1)))
                 col4, col5, col6, col7 = st.columns(4)
                 with col4:
                     excel_path_email_1, file_name_1= download_file(recon=True, df=st.session_state.df_non_reconciliated, file_partial_name='results_recon_MC', button_label=":arrow_down: Téléchargez les résultats de réconciliation", run_date=run_date)
@@ -157,7 +180,7 @@ def handle_recon(filtered_cybersource_df, filtered_saisie_manuelle_df, filtered_
                 st.divider()
 
                 st.header(':small_blue_diamond: :blue-background[Résumé des rejets]')
-                st.dataframe(st.session_state.df_summary , use_container_width=True)
+                st.dataframe(style_amounts(st.session_state.df_summary) , use_container_width=True)
                 col7 ,col8, col9, col13 = st.columns(4)
                 with col7 :
                     excel_path_email_2 , file_name_2 = download_file(recon=False, df=st.session_state.df_summary, file_partial_name='rejected_summary_MC', button_label=":arrow_down: Téléchargez le résumé des rejets", run_date=run_date)
@@ -174,12 +197,12 @@ def handle_recon(filtered_cybersource_df, filtered_saisie_manuelle_df, filtered_
 
                 st.divider()
                 st.header(':small_blue_diamond: :blue-background[Transactions Rejetées, à recycler ] :recycle: ')
-                st.dataframe(st.session_state.df_rejections , use_container_width=True)
+                st.dataframe(style_amounts(st.session_state.df_rejections) , use_container_width=True)
                 col10 ,col11 , col12, col14 = st.columns(4)
                 with col10:
                     excel_path_email_3 , file_name_3= download_file(recon=False, df=st.session_state.df_rejections, file_partial_name='rejected_transactions_MC', button_label=":arrow_down: Téléchargez les rejets", run_date=run_date)
                 with col11:
-                    st.button(":floppy_disk: Stocker les rejets " , on_click= lambda: insert_rejected_transactions(st.session_state.df_rejections) , key= "stocker_button4",type="primary" , use_container_width=True)
+                    st.button(":floppy_disk: Stocker les rejets " , on_click= lambda: insert_rejected_transactions(st.session_state.df_rejections, run_date) , key= "stocker_button4",type="primary" , use_container_width=True)
                 with col12:
                     st.button(":email: Insérer le tableau dans un E-mail",
                               #on_click= lambda : send_excel_contents_to_outlook(excel_path_email_3, file_name_3) ,
@@ -217,6 +240,28 @@ def bar_chart():
         fig = create_interactive_bar_chart(total_transactions)
         st.plotly_chart(fig)
 
+def display_diagnostics(trace):
+    """
+    Show the timing of each stage of the pipeline in a collapsible panel, with its JSON export.
+
+    Parameters:
+        trace (PipelineTrace): Spans recorded while the page ran.
+    """
+    with st.expander(":stopwatch: **Diagnostics de performance**"):
+        if not trace.spans:
+            st.write("Aucune étape mesurée.")
+            return
+        df_spans = trace.to_frame().rename(columns={
+            'name': 'Étape', 'wall_s': 'Durée (s)', 'cpu_s': 'CPU (s)', 'rows_in': 'Lignes en entrée',
+            'rows_out': 'Lignes en sortie', 'peak_mb': 'Pic mémoire (Mo)', 'error': 'Erreur'})
+        st.dataframe(df_spans, use_container_width=True, hide_index=True)
+        st.download_button(
+            label=":arrow_down: Téléchargez les mesures (JSON)",
+            data=trace.to_json(),
+            file_name=f"diagnostics_recon_MC_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+            mime="application/json",
+        )
+
 def main():
     global uploaded_mastercard_file, uploaded_cybersource_file, uploaded_pos_file, uploaded_sai_manuelle_file, filtering_date, uploaded_recycled_file
     st.sidebar.image("assets/Logo_hps_0.png", use_column_width=True)
@@ -226,6 +271,9 @@ def main():
     st.sidebar.page_link("pages/Dashboard.py", label="  **📊 Tableau de bord**" )
     st.sidebar.page_link("pages/MasterCard_UI.py", label="**🔀 Réconciliation MasterCard**")
     st.sidebar.page_link("pages/calendar_view.py", label="**📆 Vue Agenda**")
+    diagnostics = st.sidebar.toggle("Diagnostics de performance",
+                                    help="Mesure la durée de chaque étape de la réconciliation")
+    trace_memory = diagnostics and st.sidebar.checkbox("Mesurer la mémoire", help="Ralentit le traitement")
     st.header(":credit_card: :violet[Réconciliation MasterCard ]", divider='blue')
     uploaded_mastercard_file = st.file_uploader(":arrow_down: **Chargez le fichier Mastercard**", type=["001"])
     uploaded_cybersource_file = st.file_uploader(":arrow_down: **Chargez le fichier Cybersource**", type=["csv"])
@@ -260,22 +308,26 @@ def main():
     if uploaded_mastercard_file :
         total_transactions = {'Cybersource': 0, 'POS': 0, 'Saisie Manuelle': 0 , 'Transactions Recyclées': 0 }
 
-        try:
-            run_date , day_after, df_cybersource, df_sai_manuelle, df_pos = upload_all_sources()
-        except Exception as e:
-            st.error(f"Erreur lors du chargement des sources")
-            st.write(e)
-
-        try:
-            filtered_cybersource_df, filtered_saisie_manuelle_df, filtered_pos_df = filter_sources(df_cybersource, df_sai_manuelle, df_pos)
-        except Exception as e:
-            st.error(f"Impossible de traiter les fichiers")
-            st.write(e)
-        try:
-            handle_recon(filtered_cybersource_df, filtered_saisie_manuelle_df, filtered_pos_df)
-        except Exception as e:
-            st.error(f"Impossible de continuer avec la réconciliation")
-            st.write(e)
+        # Timing of each stage of the pipeline, recorded only when the diagnostics are enabled
+        with (tracing(memory=trace_memory) if diagnostics else nullcontext()) as trace:
+            try:
+                run_date , day_after, df_cybersource, df_sai_manuelle, df_pos = upload_all_sources()
+            except Exception as e:
+                st.error(f"Erreur lors du chargement des sources")
+                st.write(e)
+
+            try:
+                filtered_cybersource_df, filtered_saisie_manuelle_df, filtered_pos_df = filter_sources(df_cybersource, df_sai_manuelle, df_pos)
+            except Exception as e:
+                st.error(f"Impossible de traiter les fichiers")
+                st.write(e)
+            try:
+                handle_recon(filtered_cybersource_df, filtered_saisie_manuelle_df, filtered_pos_df)
+            except Exception as e:
+                st.error(f"Impossible de continuer avec la réconciliation")
+                st.write(e)
+        if trace is not None:
+            display_diagnostics(trace)
 
     # Handling session state variables based on file uploads
     if not uploaded_mastercard_file and not uploaded_cybersource_file and not uploaded_pos_file and not uploaded_sai_manuelle_file:
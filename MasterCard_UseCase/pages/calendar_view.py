@@ -2,7 +2,7 @@ import streamlit as st
 from datetime import datetime, timedelta
 import pandas as pd
 from streamlit.components.v1 import html
-from MasterCard_UseCase.database_actions import search_results_by_transaction_date
+from MasterCard_UseCase.database_actions import reseaux_by_date_range
 
 # Sidebar setup
 st.sidebar.image("assets/Logo_hps_0.png", use_column_width=True)
@@ -71,39 +71,28 @@ if month != months[current_month_index] or year != st.session_state.current_year
     st.query_params['month'] = month
     st.rerun()
 
-# Function to fetch events for the current month
 # Function to fetch events for the current month
 def fetch_events(year, month):
     # Get the start and end dates of the current month
     start_date = datetime(year, month, 1)
     end_date = (start_date + timedelta(days=31)).replace(day=1)  # First day of the next month
 
-    # Fetch all dates for the specified month
-    date_range = pd.date_range(start=start_date, end=end_date - timedelta(days=1))
-
-    # Generate the list of events
-    calendar_events = []
-    for single_date in date_range:
-        # Convert to string in the format required for MongoDB
-        date_str = single_date.strftime('%Y-%m-%d')
-        df_results_recon = search_results_by_transaction_date(date_str)
-
-        if not df_results_recon.empty:
-            seen_reseaux = set()  # Track Réseau names to ensure uniqueness
-            for _, row in df_results_recon.iterrows():
-                reseau = row["Réseau"]
-                if reseau not in seen_reseaux:
-                    # Add Réseau as the event title
-                    calendar_events.append({
-                        "title": reseau,
-                        "start": f"{date_str}",
-                        "end": f"{date_str}",
-                        "backgroundColor": "#ff5f00",
-                        "borderColor": "#f79e1b",
-                        "allDay": True,
-                        "date": date_str  # Add the date for the event
-                    })
-                    seen_reseaux.add(reseau)  # Mark this Réseau as seen for the current date
+    # Fetch the distinct Réseau of every day of the month in one query
+    df_reseaux = reseaux_by_date_range(start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
+
+    # Generate the list of events, indexed by date
+    calendar_events = {}
+    for date_str, reseau in zip(df_reseaux["Date"], df_reseaux["Réseau"]):
+        # Add Réseau as the event title
+        calendar_events.setdefault(date_str, []).append({
+            "title": reseau,
+            "start": f"{date_str}",
+            "end": f"{date_str}",
+            "backgroundColor": "#ff5f00",
+            "borderColor": "#f79e1b",
+            "allDay": True,
+            "date": date_str  # Add the date for the event
+        })
     return calendar_events
 
 # Fetch the events for the selected month
@@ -129,7 +118,7 @@ def generate_calendar_body(year, month, events):
                 row.append("<td></td>")
             else:
                 day_str = f"{year}-{month:02d}-{current_day:02d}"
-                event_list = [event for event in events if event["date"] == day_str]
+                event_list = events.get(day_str, [])
                 events_html = "".join(f"<div class='event' data-date='{event['date']}'>{event['title']}</div>" for event in event_list)
                 row.append(f"<td>{current_day} {events_html}</td>")
                 current_day += 1
@@ -3,6 +3,81 @@ from datetime import datetime
 from MasterCard_UseCase.database_actions import *
 from MasterCard_UseCase.processing_bank_sources import *
 
+
+def display_history_page(kind, title, run_date, fetch_page, count, iter_chunks, file_partial_name, button_label,
+                         styled=False):
+    """
+    Display one page of the archived records of a date, with the navigation between pages
+    and the Excel export of all of them.
+
+    Parameters:
+    kind (str): Prefix of the session state and widget keys of this table.
+    title (str): Header of the table.
+    run_date (str): Searched date, in the format of the collection.
+    fetch_page (function): search_results_page or search_rejects_page.
+    count (function): count_results_by_date or count_rejects_by_date, called once per search.
+    iter_chunks (function): iter_results_by_date or iter_rejects_by_date, used by the export.
+    styled (bool): If True, highlight the NOT OK reconciliation rows, on the page and in the export.
+
+    Returns:
+    bool: False if there is no record for the date.
+    """
+    # Start of each page visited so far: the _id after which it begins
+    page_starts = st.session_state.setdefault(f'{kind}_page_starts', [None])
+    page_idx = st.session_state.setdefault(f'{kind}_page_idx', 0)
+
+    df_page, next_id = fetch_page(run_date, after_id=page_starts[page_idx])
+    if df_page.empty:
+        return False
+
+    st.header(title)
+    # Counted once per search, not at each page change
+    if st.session_state.get(f'{kind}_total') is None:
+        st.session_state[f'{kind}_total'] = count(run_date)
+    total = st.session_state[f'{kind}_total']
+    nbr_pages = max(1, -(-total // history_page_size))
+    if styled:
+        st.dataframe(style_amounts(df_page.style.apply(highlight_non_reconciliated_row, axis=1)))
+    else:
+        st.dataframe(style_amounts(df_page))
+
+    col_prev, col_page, col_next = st.columns([1, 2, 1])
+    with col_prev:
+        if st.button("◀ Précédent", key=f"{kind}_previous", disabled=page_idx == 0, use_container_width=True):
+            st.session_state[f'{kind}_page_idx'] = page_idx - 1
+            st.rerun()
+    with col_page:
+        st.write(f"Page {page_idx + 1} / {nbr_pages} — {total} enregistrements")
+    with col_next:
+        if st.button("Suivant ▶", key=f"{kind}_next", disabled=next_id is None, use_container_width=True):
+            del page_starts[page_idx + 1:]
+            page_starts.append(next_id)
+            st.session_state[f'{kind}_page_idx'] = page_idx + 1
+            st.rerun()
+
+    # The export reads the whole day from the cursor, chunk by chunk
+    if st.button(":page_facing_up: Préparer l'export Excel", key=f"{kind}_export", use_container_width=True):
+        st.session_state[f'{kind}_excel'] = write_excel_chunks(iter_chunks(run_date), recon=styled)
+    if st.session_state.get(f'{kind}_excel') is not None:
+        st.download_button(
+            label=button_label,
+            data=st.session_state[f'{kind}_excel'],
+            file_name=f"{file_partial_name}_{run_date}.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            type="primary",
+            use_container_width=True
+        )
+    return True
+
+
+def reset_history_pages():
+    for kind in ('recon', 'rejects'):
+        st.session_state[f'{kind}_page_starts'] = [None]
+        st.session_state[f'{kind}_page_idx'] = 0
+        st.session_state[f'{kind}_total'] = None
+        st.session_state[f'{kind}_excel'] = None
+
+
 def main():
     st.sidebar.image("assets/Logo_hps_0.png", use_column_width=True)
     st.sidebar.divider()
@@ -17,46 +92,33 @@ def main():
 
     # Create date input for processing date
     search_date = st.date_input("**Sélectionnez une date de processing :**", value=datetime.today(), key="search_date")
-    formatted_date = search_date.strftime('%Y-%m-%d')
-    formatted_date_rejects = search_date.strftime('%y-%m-%d')
 
-    # Search and display the results when the search button is clicked
+    # The searched date is kept in the session state, so that the page navigation reruns keep showing it
     if st.button(":mag_right: **Search**", key="search_button", type="primary", use_container_width=True):
-        df_search_recon_results = search_results_by_transaction_date(formatted_date)
-        df_search_rejects_results = search_rejects_by_transaction_date(formatted_date_rejects)
-
-        # Display reconciliation results
-        if not df_search_recon_results.empty:
-            st.header(":small_blue_diamond: :blue-background[Résultats de Réconciliation]")
-            df_search_recon_results.drop(columns=['_id'], inplace=True)
-            st.dataframe(df_search_recon_results.style.apply(highlight_non_reconciliated_row, axis=1))
-            excel_path_recon, file_name_recon = download_file(
-                recon=True,
-                df=df_search_recon_results,
-                file_partial_name='results_reconciliation',
-                button_label=":arrow_down: Téléchargez les résultats de réconciliation",
-                run_date=formatted_date
-            )
-        else:
-            st.warning("Aucun enregistrement trouvé pour la date sélectionnée.")
-
-
-        # Display rejected transactions results
-        if not df_search_rejects_results.empty:
-            st.header(":small_blue_diamond: :blue-background[Transactions Rejetées]")
-
-            df_search_rejects_results.drop(columns=['_id'], inplace=True)
-            df_search_rejects_results.drop(columns=['rejected_date'], inplace=True)
-            st.dataframe(df_search_rejects_results)
-            excel_path_rejects, file_name_rejects = download_file(
-                recon=False,
-                df=df_search_rejects_results,
-                file_partial_name='results_rejected_transactions',
-                button_label=":arrow_down: Téléchargez les transactions rejetées",
-                run_date=formatted_date_rejects
-            )
-        # else:
-        #     st.warning("Aucun enregistrement trouvé pour les transactions rejetées pour la date sélectionnée.")
+        st.session_state.history_search_date = search_date
+        reset_history_pages()
+
+    if st.session_state.get('history_search_date') is None:
+        return
+    formatted_date = st.session_state.history_search_date.strftime('%Y-%m-%d')
+    formatted_date_rejects = st.session_state.history_search_date.strftime('%y-%m-%d')
+
+    # Display reconciliation results
+    found = display_history_page(
+        'recon', ":small_blue_diamond: :blue-background[Résultats de Réconciliation]", formatted_date, search_results_page, count_results_by_date, iter_results_by_date,
+        file_partial_name='results_reconciliation',
+        button_label=":arrow_down: Téléchargez les résultats de réconciliation",
+        styled=True
+    )
+    if not found:
+        st.warning("Aucun enregistrement trouvé pour la date sélectionnée.")
+
+    # Display rejected transactions results
+    display_history_page(
+        'rejects', ":small_blue_diamond: :blue-background[Transactions Rejetées]", formatted_date_rejects, search_rejects_page, count_rejects_by_date, iter_rejects_by_date,
+        file_partial_name='results_rejected_transactions',
+        button_label=":arrow_down: Téléchargez les transactions rejetées"
+    )
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,13 +1,66 @@
 import pandas as pd
 import json
 import re
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
 from datetime import datetime , timedelta
+from pipeline_trace import count_rows, traced
 
 
 currencies_settings = 'MasterCard_UseCase/currency_codes.json'
 countries_settings = 'MasterCard_UseCase/countries_acronyms.json'
 
 
+def is_empty_source(source):
+    """
+    Tell whether no file was given: None or an empty path.
+    """
+    return source is None or (isinstance(source, (str, bytes)) and len(source) == 0)
+
+
+@contextmanager
+def open_source(source, text=False):
+    """
+    Open a file given either by its path or as an in-memory binary buffer, such as a
+    Streamlit UploadedFile. Buffers are rewound and read in place, without a temporary copy.
+
+    Parameters:
+        source (str or file-like): Path to the file, or binary buffer.
+        text (bool): If True, yield a text stream instead of a binary one.
+
+    Yields:
+        file-like: Stream positioned at the start of the file.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'r' if text else 'rb') as f:
+            yield f
+        return
+
+    source.seek(0)
+    if not text:
+        yield source
+        return
+    wrapper = io.TextIOWrapper(source)
+    try:
+        yield wrapper
+    finally:
+        # Leave the caller's buffer open
+        wrapper.detach()
+
+
+# Header line of the IP727010 report, carrying its RUN DATE
+report_header_prefix = "1IP727010-AA"
+pattern_run_date = re.compile(r"RUN DATE: (\d{2}/\d{2}/\d{2})")
+
+
 def extract_date_from_mastercard_file(file_contents):
     """
     Extract the date from the MasterCard file contents.
@@ -22,201 +75,285 @@ def extract_date_from_mastercard_file(file_contents):
         ValueError: If the date cannot be extracted from the file contents.
     """
     for line in file_contents.splitlines():
-        if line.startswith("1IP727010-AA"):
-            # Adjust the pattern to match the date format in the target line
-            date_pattern = r"RUN DATE: (\d{2}/\d{2}/\d{2})"
-            date_match = re.search(date_pattern, line)
-            if date_match:
-                # Extract and parse the date
-                run_date = datetime.strptime(date_match.group(1), "%m/%d/%y").strftime("%y-%m-%d")
-                # Convert the string to a datetime object
-                date_object = datetime.strptime(run_date, "%y-%m-%d")
-
-                # Add one day to the date
-                day_after = date_object + timedelta(days=1)
-
-                # Convert the datetime object back to a string in 'YY-MM-DD' format
-                day_after = day_after.strftime("%y-%m-%d")
-                return run_date , day_after
-            else:
-                raise ValueError(f"Could not extract date from the line: {line}")
+        if line.startswith(report_header_prefix):
+            return run_date_from_header_line(line)
     raise ValueError("Could not find the target line in the file to extract the date.")
 
-def extract_rejections(mastercard_file, currencies_settings, countries_settings):
-    if mastercard_file is None or len(mastercard_file) == 0:
-        print("Empty DataFrame or None received. Cannot proceed.")
-        return None
-    
-    df = pd.read_csv(mastercard_file, delimiter='\t', header=None)
-    text = ' '.join(df[0].astype(str))
-        
-    # Define the regular expression patterns to find all "SOURCE AMOUNT:" and "SOURCE CURRENCY:" and their following values
-    pattern_source_amount = re.compile(r"SOURCE AMOUNT:\s+(\*?\S+)")
-    pattern_source_currency = re.compile(r"SOURCE CURRENCY:\s+(\*?\S+)")
-        
-    # Find all matches of the patterns in the text
-    matches_source_amount = pattern_source_amount.findall(text)
-    matches_source_currency = pattern_source_currency.findall(text)
-    
-    # Load the JSON file containing currency codes and names
-    with open(currencies_settings, 'r') as f:
-        currencies_data = json.load(f)
-    
-    # Create a dictionary mapping currency codes to their names
-    currency_code_to_name = currencies_data
-    
-    # Map each found currency code to its name
-    mapped_currencies = {currency.strip('*'): currency_code_to_name.get(currency.strip('*'), 'Not found') for currency in matches_source_currency}
-    
-    # Create a DataFrame to store the extracted values
-    data = {
-        "Montant": matches_source_amount,
-        "Devise": [mapped_currencies.get(currency.strip('*'), 'Not found') for currency in matches_source_currency]
-    }
-    df_extracted_values = pd.DataFrame(data)
-    
-    # Load the JSON file containing country acronyms and names
-    with open(countries_settings, 'r') as f:
-        countries_data = json.load(f)
-    
-    # Initialize a list to store country names
-    country_names = []
-    
-    # Find all occurrences of "D0043"
-    occurrences_d0043 = [i for i, token in enumerate(text.split()) if token in ["D0043", "*D0043"]]
-    
-    # Iterate over the occurrences and find the element after the sixth occurrence of "D0043"
-    for index_sixth_d0043 in occurrences_d0043[5:]:
-        # Check if there is a token after the element following the sixth "D0043"
-        if index_sixth_d0043 + 2 < len(text.split()):
-            element_after_sixth_d0043 = text.split()[index_sixth_d0043 + 2]
-    
-            # Get the country name for the acronym if it exists
-            country_name = countries_data.get(element_after_sixth_d0043.strip('*'))
-    
-            # Add the country name to the list if it exists
-            if country_name:
-                country_names.append(country_name)
-    
-    # Create a DataFrame for PAYS transaction with only the country names
-    # Prefix the country names with "SG - "
-    df_pays = pd.DataFrame({'FILIALE': ["SG - " + country for country in country_names]})
-    
-    # Define a regular expression pattern to find the transaction date from "D0012 S01 240522" format
-    pattern_transaction_date = re.compile(r"D0012\s+S01\s+(\*?\d{6})")
-    
-    # Find all matches of the pattern in the text
-    matches_transaction_date = pattern_transaction_date.findall(text)
-    
-    # Convert the extracted dates to the proper format (assuming the date format is YYMMDD)
-    formatted_dates = [f"20{date[0:2]}-{date[2:4]}-{date[4:6]}" for date in matches_transaction_date]
-    
-    # Create a DataFrame to store the extracted transaction date
-    df_transaction_date = pd.DataFrame({'Date Transaction': formatted_dates})
-    
-    # Define a regular expression pattern to find all groups of "D0031 Sxx" and their values
-    pattern_arn = re.compile(r"(D0031 S\d+\s+\*?\d+)")
-    
-    # Find all matches of the pattern in the text
-    matches_arn = pattern_arn.findall(text)
-    
-    # Initialize variables
-    arns = []
-    current_arn_values = []
-    
-    # Iterate over the matches to group values for each ARN
-    for match in matches_arn:
-        # Extract the value from the match
-        value = match.split()[-1].strip('*')
-        # Check if we are starting a new group (new ARN) based on D0031 S01
-        if "D0031 S01" in match:
-            # If we have values collected for the current ARN, concatenate them and store the ARN
-            if current_arn_values:
-                arns.append(''.join(current_arn_values))
-                current_arn_values = []
-        # Add the value to the current ARN values
-        current_arn_values.append(value)
-    
-    # Don't forget to add the last collected ARN values
-    if current_arn_values:
-        arns.append(''.join(current_arn_values))
-    
-    # Create a DataFrame for ARNs de transactions
-    df_arns = pd.DataFrame({'ARN': arns})
-    
-    # Define a regular expression pattern to find all "D0038" and its following value
-    pattern_authorization = re.compile(r"D0038\s+(\*?\S+)")
-    
-    # Find all matches of the pattern in the text
-    matches_authorization = pattern_authorization.findall(text)
-    
-    # Create a DataFrame for Autorisation(s) found
-    df_authorization = pd.DataFrame({'Autorisation': [auth.strip('*') for auth in matches_authorization]})
 
-    # Regular expression pattern to match error code and description
-    pattern = r"(\d{4})\s+([A-Z0-9\s\/]+[A-Z0-9\.])"
+def run_date_from_header_line(line):
+    """
+    Read the RUN DATE of a 1IP727010-AA report header line.
 
-    # Identifier for the section containing error codes and descriptions
-    identifier = "CODE    DESCRIPTION                                                                                MESSAGE #   ELEMENT ID"
+    Parameters:
+        line (str): Header line of the MasterCard report.
 
-    # Identifier for the end of a section
-    end_identifier = "MESSAGE DETAILS"
+    Returns:
+        tuple: Run date and the day after, in the format 'YY-MM-DD'.
 
-    # Read the file
-    with open(mastercard_file, 'r') as file:
-        content = file.read()
+    Raises:
+        ValueError: If the line has no RUN DATE.
+    """
+    date_match = pattern_run_date.search(line)
+    if not date_match:
+        raise ValueError(f"Could not extract date from the line: {line}")
+    # Extract and parse the date
+    date_object = datetime.strptime(date_match.group(1), "%m/%d/%y")
+    run_date = date_object.strftime("%y-%m-%d")
 
-    # Initialize list to store descriptions
-    descriptions = []
+    # Add one day to the date, still in 'YY-MM-DD' format
+    day_after = (date_object + timedelta(days=1)).strftime("%y-%m-%d")
+    return run_date , day_after
 
-    # Find the first section containing error codes and descriptions
-    start = content.find(identifier)
-    if start == -1:
-        #print("Section containing error codes and descriptions not found in the file.")
-        return None
 
-    while start != -1:
-        # Find the end of the section
-        end = content.find(end_identifier, start)
-        if end == -1:
-            end = len(content)
+# Leading bytes read by the pre-flight scan, enough for the report header and a few hundred messages
+preflight_window_size = 256 * 1024
+
+
+@dataclass
+class TT140Preflight:
+    """
+    What the pre-flight scan of a TT140 MasterCard file learns from its leading bytes.
+
+    Attributes:
+        run_date (str): RUN DATE of the report, in the format 'YY-MM-DD'.
+        day_after (str): Day after the run date, the date of the reconciliation.
+        report_id (str): Report identifier of the header line, such as 'IP727010-AA'.
+        file_size (int): Size of the file in bytes.
+        estimated_messages (int): Number of rejected message blocks, extrapolated from the scanned window.
+        exact (bool): True if the whole file fitted in the window, so the count is exact.
+    """
+    run_date: str
+    day_after: str
+    report_id: str
+    file_size: int
+    estimated_messages: int
+    exact: bool
+
+
+def source_size(source):
+    """
+    Size in bytes of a file given by its path or as a binary buffer.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source)
+    if hasattr(source, 'size'):
+        # Streamlit UploadedFile
+        return source.size
+    position = source.tell()
+    size = source.seek(0, io.SEEK_END)
+    source.seek(position)
+    return size
+
+
+@traced
+def preflight_tt140(source, window_size=None):
+    """
+    Read only the leading bytes of a TT140 MasterCard file to get its run date, report
+    identifier and size, with a quick estimate of its number of rejected messages.
+
+    The estimate scales the message blocks found in the window to the size of the file,
+    so it is meant for display only: the counts of the reconciliation come from parse_t140_MC.
 
-        # Extract the section content
-        section_content = content[start:end]
+    Parameters:
+        source (str or file-like): Path to the MasterCard .001 file, or its binary buffer.
+        window_size (int): Number of leading bytes to read (default preflight_window_size).
 
-        # Find all matches in the section content
-        section_matches = re.findall(pattern, section_content)
+    Returns:
+        TT140Preflight: Run date, day after, report id, file size and estimated message count.
 
-        # Concatenate descriptions within the section
-        section_descriptions = " ".join(desc for code, desc in section_matches)
+    Raises:
+        ValueError: If the report header line is not found in the window.
+    """
+    window_size = window_size or preflight_window_size
+    file_size = source_size(source)
+    with open_source(source) as f:
+        window = f.read(window_size)
+    if not isinstance(source, (str, os.PathLike)):
+        source.seek(0)
+
+    exact = len(window) >= file_size
+    if not exact:
+        # Drop the line cut by the end of the window
+        window = window[:window.rfind(b"\n") + 1]
+    text = window.decode("utf-8", errors="replace")
+
+    for line in text.splitlines():
+        if line.startswith(report_header_prefix):
+            run_date, day_after = run_date_from_header_line(line)
+            report_id = line.split()[0][1:]
+            break
+    else:
+        raise ValueError(f"Could not find the target line in the first {len(window)} bytes of the file to extract the date.")
+
+    messages = text.count(identifier_error_section)
+    if not exact and window:
+        messages = round(messages * file_size / len(window))
+    return TT140Preflight(run_date, day_after, report_id, file_size, messages, exact)
+
+# Regular expression patterns applied line by line to the TT140 report
+pattern_source_amount = re.compile(r"SOURCE AMOUNT:\s+(\*?\S+)")
+pattern_source_currency = re.compile(r"SOURCE CURRENCY:\s+(\*?\S+)")
+pattern_transaction_date = re.compile(r"D0012\s+S01\s+\*?(\d{6})")
+pattern_arn = re.compile(r"D0031 S(\d+)\s+\*?(\d+)")
+pattern_authorization = re.compile(r"D0038\s+(\*?\S+)")
+pattern_error_code = re.compile(r"(\d{4})\s+([A-Z0-9\s\/]+[A-Z0-9\.])")
+
+# Identifier for the section containing error codes and descriptions (opens a rejected message)
+identifier_error_section = "CODE    DESCRIPTION                                                                                MESSAGE #   ELEMENT ID"
+# Identifier for the end of an error codes section
+end_identifier_error_section = "MESSAGE DETAILS"
+# The first D0043 occurrences of the report belong to its header, not to a rejected message
+skipped_d0043_occurrences = 5
+
+rejection_columns = ['FILIALE', 'RESEAU', 'ARN', 'Autorisation', 'Date Transaction', 'Montant', 'Devise', 'Motif']
+rejected_summary_columns = ['FILIALE', 'Nbre Total de Rejets', 'Montant de Rejets']
+
+
+def _new_rejection_record():
+    return {
+        'country': None,
+        'arn_parts': [],
+        'Autorisation': None,
+        'Date Transaction': None,
+        'Montant': None,
+        'Devise': None,
+        'motif_lines': [],
+    }
 
-        # Append to descriptions list
-        descriptions.append(section_descriptions)
 
-        # Find the next section containing error codes and descriptions
-        start = content.find(identifier, end)
+def _finalize_rejection_record(record):
+    """
+    Turn the raw values collected for one message block into a rejection row.
+    """
+    # Concatenate descriptions within the error codes section
+    section_content = ''.join(record['motif_lines'])
+    motif = " ".join(desc for code, desc in pattern_error_code.findall(section_content))
+    # Remove leading and trailing whitespace and replace multiple spaces with a single space
+    motif = re.sub(r'\s+', ' ', motif.strip())
+
+    return {
+        'FILIALE': "SG - " + record['country'] if record['country'] else None,
+        'RESEAU': "MASTERCARD INTERNATIONAL",
+        'ARN': ''.join(record['arn_parts']) or None,
+        'Autorisation': record['Autorisation'],
+        'Date Transaction': record['Date Transaction'],
+        'Montant': record['Montant'],
+        'Devise': record['Devise'],
+        'Motif': motif,
+    }
+
+
+def iter_rejections(mastercard_file, currency_code_to_name, countries_data):
+    """
+    Walk the TT140 MasterCard report once, line by line, and yield one rejection per message block.
+
+    A message block starts at the error codes section header and runs until the next one,
+    so only the block being parsed is held in memory.
+
+    Parameters:
+        mastercard_file (str or file-like): Path to the MasterCard .001 file, or its binary buffer.
+        currency_code_to_name (dict): Mapping of numeric currency codes to their names.
+        countries_data (dict): Mapping of country acronyms to country names.
+
+    Yields:
+        dict: Rejected transaction with the FILIALE, RESEAU, ARN, Autorisation,
+        Date Transaction, Montant, Devise and Motif fields.
+    """
+    record = None
+    in_error_section = False
+    d0043_count = 0
+
+    with open_source(mastercard_file, text=True) as file:
+        for line in file:
+            if in_error_section:
+                end = line.find(end_identifier_error_section)
+                if end == -1:
+                    record['motif_lines'].append(line)
+                    continue
+                record['motif_lines'].append(line[:end])
+                in_error_section = False
+
+            start = line.find(identifier_error_section)
+            if start != -1:
+                # A new message block begins: emit the previous one
+                if record is not None:
+                    yield _finalize_rejection_record(record)
+                record = _new_rejection_record()
+                end = line.find(end_identifier_error_section, start)
+                if end == -1:
+                    record['motif_lines'].append(line[start:])
+                    in_error_section = True
+                else:
+                    record['motif_lines'].append(line[start:end])
+                continue
+
+            # Country of the FILIALE: the token following "D0043 Sxx"
+            if 'D0043' in line:
+                tokens = line.split()
+                for i, token in enumerate(tokens):
+                    if token in ("D0043", "*D0043"):
+                        d0043_count += 1
+                        if record is None or d0043_count <= skipped_d0043_occurrences:
+                            continue
+                        if i + 2 < len(tokens) and record['country'] is None:
+                            record['country'] = countries_data.get(tokens[i + 2].strip('*'))
+
+            if record is None:
+                continue
+
+            match = pattern_source_amount.search(line)
+            if match:
+                record['Montant'] = match.group(1)
+            match = pattern_source_currency.search(line)
+            if match:
+                record['Devise'] = currency_code_to_name.get(match.group(1).strip('*'), 'Not found')
+            match = pattern_transaction_date.search(line)
+            if match:
+                date = match.group(1)
+                record['Date Transaction'] = f"20{date[0:2]}-{date[2:4]}-{date[4:6]}"
+            match = pattern_authorization.search(line)
+            if match:
+                record['Autorisation'] = match.group(1).strip('*')
+            # ARN values are spread over D0031 S01, S02, ... and concatenated
+            for sub_element, value in pattern_arn.findall(line):
+                if sub_element == '01':
+                    record['arn_parts'] = []
+                record['arn_parts'].append(value)
+
+    if record is not None:
+        yield _finalize_rejection_record(record)
+
+
+@traced
+def extract_rejections(mastercard_file, currencies_settings, countries_settings):
+    if is_empty_source(mastercard_file):
+        print("Empty DataFrame or None received. Cannot proceed.")
+        return None
+
+    # Load the JSON files containing currency codes and country acronyms
+    with open(currencies_settings, 'r') as f:
+        currency_code_to_name = json.load(f)
+    with open(countries_settings, 'r') as f:
+        countries_data = json.load(f)
 
-    # Create a DataFrame from the descriptions
-    df_motif = pd.DataFrame(descriptions, columns=["Motif"])
+    rejections = list(iter_rejections(mastercard_file, currency_code_to_name, countries_data))
+    if not rejections:
+        # Section containing error codes and descriptions not found in the file
+        return None
 
-    # Remove leading and trailing whitespace from each description and replace multiple spaces with a single space
-    df_motif['Motif'] = df_motif['Motif'].str.strip().replace(r'\s+', ' ', regex=True)
-    # Create the DataFrame
-    df_reseau = pd.DataFrame({"RESEAU": ["MASTERCARD INTERNATIONAL"] * len(df_extracted_values)})
-    # Concatenate all the DataFrames
-    df_rejected = pd.concat([df_pays,df_reseau,df_arns,df_authorization,df_transaction_date,df_extracted_values, df_motif], axis=1)
+    # Build the DataFrame once all the message blocks have been parsed
+    df_rejected = pd.DataFrame.from_records(rejections, columns=rejection_columns)
+    # Amounts are read as '*31,035.08': they are kept as numbers, formatted only when displayed or exported
+    df_rejected['Montant'] = pd.to_numeric(
+        df_rejected['Montant'].str.replace(r'[*/$,]', '', regex=True), errors='coerce')
 
     return df_rejected
 
-def calculate_rejected_summary(mastercard_file_path):
-        df_rejected = extract_rejections(mastercard_file_path, currencies_settings, countries_settings)
+@traced
+def calculate_rejected_summary(df_rejected):
         if df_rejected is None or df_rejected.empty:
             #print("Empty DataFrame or None received from extract_rejections. Cannot proceed.")
             return None
-        df_rejected = extract_rejections(mastercard_file_path, currencies_settings, countries_settings)
-        df_rejected['Montant'] = df_rejected['Montant'].replace(r'[/$,]', '', regex=True).astype(float)
-
-
         # Group by FILIALE and calculate the number of transactions and sum of amounts
         summary = df_rejected.groupby('FILIALE').agg(
             NbrTotalDeRejets=('Montant', 'size'),
@@ -224,7 +361,7 @@ def calculate_rejected_summary(mastercard_file_path):
         ).reset_index()
 
         # Rename columns to have spaces instead of underscores
-        summary.columns = ['FILIALE', 'Nbre Total de Rejets', 'Montant de Rejets']
+        summary.columns = rejected_summary_columns
 
         # Convert 'Nbre Total de Rejets' to integer
         summary['Nbre Total de Rejets'] = summary['Nbre Total de Rejets'].astype(int)
@@ -236,22 +373,61 @@ def calculate_rejected_summary(mastercard_file_path):
         return summary
 
 
-def extract_total_nbr_transactions_mastercard(file_path):
-    if file_path is None or len(file_path) == 0:
+# Marker of the lines holding the number of first presentments
+first_presentment_total = 'FIRST PRES.  TOTAL'
+# Headers giving the clearing cycle and the currency of the following totals
+pattern_total_cycle = re.compile(r"CYCLE:?\s+(\d+)")
+pattern_total_currency = re.compile(r"(?<!SOURCE )CURRENCY(?: CODE)?:?\s+\*?(\d{3})\b")
+
+
+@traced
+def extract_total_nbr_transactions_mastercard(file_path, with_breakdown=False):
+    """
+    Count the transactions of the MasterCard file from its FIRST PRES. TOTAL lines, in a single pass.
+
+    Parameters:
+        file_path (str or file-like): Path to the MasterCard .001 file, or its binary buffer.
+        with_breakdown (bool): If True, also return the counts per clearing cycle and currency.
+
+    Returns:
+        int: Number of transactions in the MasterCard file.
+        pd.DataFrame: Only if with_breakdown is True, the counts with the CYCLE, CUR and
+        NBRE_TRANSACTION columns. CYCLE and CUR come from the closest preceding headers
+        and are None when the report does not give them.
+    """
+    if is_empty_source(file_path):
         #print("Empty file path received. Cannot proceed.")
         return None
-    df = pd.read_csv(file_path, delimiter='\t', header=None , engine='python')
-    
-    pres_total_rows = df[df.apply(lambda row: row.astype(str).str.contains('FIRST PRES.  TOTAL').any(), axis=1)]
-    
-    def sum_values(row):
-        numbers = [int(s) for s in row.split() if s.isdigit()]
-        return sum(numbers)
-    
-    sum_of_values = pres_total_rows[0].apply(sum_values).sum()
+
+    sum_of_values = 0
+    totals = {}
+    cycle = None
+    currency = None
+    with open_source(file_path, text=True) as file:
+        for line in file:
+            if first_presentment_total in line:
+                # The counts are the integer values of the first tab separated field
+                count = sum(int(s) for s in line.split('\t')[0].split() if s.isdigit())
+                sum_of_values += count
+                totals[(cycle, currency)] = totals.get((cycle, currency), 0) + count
+                continue
+            if 'CYCLE' in line:
+                match = pattern_total_cycle.search(line)
+                if match:
+                    cycle = match.group(1)
+            if 'CURRENCY' in line:
+                match = pattern_total_currency.search(line)
+                if match:
+                    currency = match.group(1)
     #print("Number of transactions in the MasterCard file:", sum_of_values)
-    
-    return sum_of_values
+
+    if not with_breakdown:
+        return sum_of_values
+    df_totals = pd.DataFrame(
+        [(cycle, currency, count) for (cycle, currency), count in totals.items()],
+        columns=['CYCLE', 'CUR', 'NBRE_TRANSACTION']
+    )
+    return sum_of_values, df_totals
 
 # def handle_non_match_reconciliation(file_path,merged_df):
 #     if merged_df is None or merged_df.empty:
@@ -297,12 +473,277 @@ def extract_total_nbr_transactions_mastercard(file_path):
 #     df_reconciliated['Nbre Total de Rejets'] = df_reconciliated['Nbre Total de Rejets'].replace('', 0).fillna(0).astype(int)
 #     return df_reconciliated
 
+@dataclass
+class ParsedTT140:
+    """
+    Result of parsing one TT140 MasterCard file, shared by every step of a reconciliation run.
+
+    Attributes:
+        checksum (str): SHA-256 of the file contents, used as the cache key.
+        nbr_total (int): Number of transactions in the MasterCard file.
+        rejections (pd.DataFrame): Rejected transactions, or None if the file has none.
+        summary (pd.DataFrame): Rejections grouped by FILIALE, or None if the file has none.
+        totals (pd.DataFrame): Number of transactions per clearing cycle and currency.
+    """
+    checksum: str
+    nbr_total: int
+    rejections: pd.DataFrame = None
+    summary: pd.DataFrame = None
+    totals: pd.DataFrame = None
+
+
+# Parsed files of the current process, keyed by content hash
+parsed_tt140_cache = OrderedDict()
+parsed_tt140_cache_size = 8
+
+
+@traced
+def compute_file_checksum(source, chunk_size=1024 * 1024):
+    """
+    Compute the SHA-256 of a file, reading it by chunks.
+
+    Parameters:
+        source (str or file-like): Path to the file, or its binary buffer.
+        chunk_size (int): Number of bytes read at a time.
+
+    Returns:
+        str: Hexadecimal digest of the file contents.
+    """
+    sha256 = hashlib.sha256()
+    with open_source(source) as f:
+        if hasattr(f, 'getbuffer'):
+            # In-memory buffer: hash it through a memoryview, without copying it
+            with f.getbuffer() as view:
+                sha256.update(view)
+        else:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+# On-disk cache of parsed files, shared by every process and Streamlit session
+tt140_cache_dir = os.environ.get('TT140_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'tt140_cache'))
+tt140_cache_max_bytes = int(os.environ.get('TT140_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+# Bump when the parser output changes, so that older entries are no longer used
+tt140_cache_format = 2
+
+
+def tt140_cache_version():
+    """
+    Version stamp of the cache entries: changes with the parser output format and with
+    the contents of the currency and country settings used to build the rejections.
+    """
+    sha256 = hashlib.sha256(str(tt140_cache_format).encode())
+    for settings_path in (currencies_settings, countries_settings):
+        with open(settings_path, 'rb') as f:
+            sha256.update(f.read())
+    return sha256.hexdigest()
+
+
+def load_cached_tt140(checksum, version):
+    """
+    Load a parsed TT140 file from the on-disk cache.
+
+    Parameters:
+        checksum (str): SHA-256 of the file contents.
+        version (str): Expected version stamp, see tt140_cache_version.
+
+    Returns:
+        ParsedTT140: The cached result, or None on a miss or a stale entry.
+    """
+    entry_dir = os.path.join(tt140_cache_dir, checksum)
+    meta_path = os.path.join(entry_dir, 'meta.json')
+    try:
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        if meta['version'] != version:
+            # Settings or parser changed since the entry was written
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return None
+        df_rejected = None
+        if meta['has_rejections']:
+            df_rejected = pd.read_parquet(os.path.join(entry_dir, 'rejections.parquet'))
+        df_totals = pd.read_parquet(os.path.join(entry_dir, 'totals.parquet'))
+        # Mark the entry as recently used for the LRU eviction
+        os.utime(meta_path)
+    except (OSError, ValueError, KeyError, ImportError):
+        return None
+    return ParsedTT140(checksum, meta['nbr_total'], df_rejected, calculate_rejected_summary(df_rejected), df_totals)
+
+
+def store_cached_tt140(parsed, version):
+    """
+    Store a parsed TT140 file in the on-disk cache as Parquet, then evict the least recently
+    used entries beyond tt140_cache_max_bytes. Failures are ignored: the cache is optional.
+
+    Parameters:
+        parsed (ParsedTT140): Result to store.
+        version (str): Version stamp of the entry, see tt140_cache_version.
+    """
+    entry_dir = os.path.join(tt140_cache_dir, parsed.checksum)
+    try:
+        os.makedirs(tt140_cache_dir, exist_ok=True)
+        # Write in a private directory then rename it, so readers never see a partial entry
+        temp_dir = tempfile.mkdtemp(dir=tt140_cache_dir, prefix='.tmp-')
+        try:
+            if parsed.rejections is not None:
+                parsed.rejections.to_parquet(os.path.join(temp_dir, 'rejections.parquet'), index=False)
+            parsed.totals.to_parquet(os.path.join(temp_dir, 'totals.parquet'), index=False)
+            with open(os.path.join(temp_dir, 'meta.json'), 'w') as f:
+                json.dump({
+                    'version': version,
+                    'nbr_total': int(parsed.nbr_total),
+                    'has_rejections': parsed.rejections is not None,
+                }, f)
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.rename(temp_dir, entry_dir)
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    except (OSError, ValueError, ImportError):
+        return
+    evict_cached_tt140(tt140_cache_max_bytes)
+
+
+def evict_cached_tt140(max_bytes):
+    """
+    Delete the least recently used cache entries until the cache holds at most max_bytes.
+    """
+    entries = []
+    try:
+        for name in os.listdir(tt140_cache_dir):
+            entry_dir = os.path.join(tt140_cache_dir, name)
+            meta_path = os.path.join(entry_dir, 'meta.json')
+            if name.startswith('.') or not os.path.exists(meta_path):
+                continue
+            size = sum(entry.stat().st_size for entry in os.scandir(entry_dir))
+            entries.append((os.path.getmtime(meta_path), size, entry_dir))
+    except OSError:
+        return
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, entry_dir in sorted(entries):
+        if total_size <= max_bytes:
+            break
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        total_size -= size
+
+
+@traced(rows_out=lambda parsed: count_rows(parsed.rejections) if parsed is not None else None)
 def parse_t140_MC(mastercard_file_path):
-    if mastercard_file_path is None or len(mastercard_file_path) == 0:
+    """
+    Parse a TT140 MasterCard file once and return the shared result.
+
+    The same contents are only parsed once: later calls with an identical file return the
+    ParsedTT140 kept in memory, or the one stored as Parquet in the on-disk cache.
+    Its DataFrames are shared and should not be modified in place.
+
+    Parameters:
+        mastercard_file_path (str or file-like): Path to the MasterCard .001 file, or its binary buffer.
+
+    Returns:
+        ParsedTT140: Total count, rejections and summary of the file, or None if no file is given.
+    """
+    if is_empty_source(mastercard_file_path):
         #print("Empty file path received. Cannot proceed.")
-        return None, None, None
+        return None
+
+    checksum = compute_file_checksum(mastercard_file_path)
+    if checksum in parsed_tt140_cache:
+        parsed_tt140_cache.move_to_end(checksum)
+        return parsed_tt140_cache[checksum]
+
+    version = tt140_cache_version()
+    parsed = load_cached_tt140(checksum, version)
+    if parsed is None:
+        nbr_total_MC, totals_df = extract_total_nbr_transactions_mastercard(mastercard_file_path, with_breakdown=True)
+        rejeted_df = extract_rejections(mastercard_file_path, currencies_settings, countries_settings)
+        summary_df = calculate_rejected_summary(rejeted_df)
+        parsed = ParsedTT140(checksum, nbr_total_MC, rejeted_df, summary_df, totals_df)
+        store_cached_tt140(parsed, version)
+
+    parsed_tt140_cache[checksum] = parsed
+    if len(parsed_tt140_cache) > parsed_tt140_cache_size:
+        parsed_tt140_cache.popitem(last=False)
+    return parsed
+
+
+def _parse_t140_MC_timed(mastercard_file_path):
+    """
+    Worker of parse_t140_MC_batch: parse one file and measure how long it took.
+    """
+    start = time.perf_counter()
+    parsed = parse_t140_MC(mastercard_file_path)
+    return parsed, time.perf_counter() - start
+
+
+def merge_parsed_tt140(parsed_list):
+    """
+    Merge the parsed TT140 files of a batch, in the given order.
+
+    Parameters:
+        parsed_list (list): ParsedTT140 results to merge.
+
+    Returns:
+        ParsedTT140: Combined total count, rejections, summary and totals.
+    """
+    checksum = hashlib.sha256(''.join(parsed.checksum for parsed in parsed_list).encode()).hexdigest()
+    nbr_total = sum(parsed.nbr_total for parsed in parsed_list)
+
+    rejections = [parsed.rejections for parsed in parsed_list if parsed.rejections is not None]
+    df_rejected = pd.concat(rejections, ignore_index=True) if rejections else None
 
-    nbr_total_MC = extract_total_nbr_transactions_mastercard(mastercard_file_path)
-    summary_df = calculate_rejected_summary(mastercard_file_path)
-    rejeted_df = extract_rejections(mastercard_file_path, currencies_settings, countries_settings)
-    return nbr_total_MC, summary_df, rejeted_df
+    totals = [parsed.totals for parsed in parsed_list if parsed.totals is not None]
+    df_totals = None
+    if totals:
+        df_totals = pd.concat(totals, ignore_index=True).groupby(
+            ['CYCLE', 'CUR'], dropna=False, sort=True
+        )['NBRE_TRANSACTION'].sum().reset_index()
+
+    return ParsedTT140(checksum, nbr_total, df_rejected, calculate_rejected_summary(df_rejected), df_totals)
+
+
+@traced(rows_out=lambda result: count_rows(result[0].rejections) if result[0] is not None else None)
+def parse_t140_MC_batch(mastercard_file_paths, max_workers=None):
+    """
+    Parse several TT140 MasterCard files (one per clearing cycle or IP727010 run) across a process pool.
+
+    Results are merged in the order of mastercard_file_paths, whatever the order in which
+    the workers finish, so the same batch always gives the same output.
+
+    Parameters:
+        mastercard_file_paths (list): Paths to the MasterCard .001 files.
+        max_workers (int): Number of worker processes (default: number of CPUs).
+
+    Returns:
+        ParsedTT140: Merged result of all the files.
+        pd.DataFrame: Per-file timings with the Fichier, Checksum, Nbre de Rejets and Secondes columns.
+    """
+    mastercard_file_paths = list(mastercard_file_paths)
+    if not mastercard_file_paths:
+        return None, None
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = min(max_workers, len(mastercard_file_paths))
+
+    if max_workers == 1:
+        results = [_parse_t140_MC_timed(path) for path in mastercard_file_paths]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            # map keeps the input order
+            results = list(executor.map(_parse_t140_MC_timed, mastercard_file_paths))
+
+    timings = []
+    for path, (parsed, seconds) in zip(mastercard_file_paths, results):
+        # Make the results of the workers available to later parse_t140_MC calls in this process
+        parsed_tt140_cache[parsed.checksum] = parsed
+        timings.append({
+            'Fichier': path,
+            'Checksum': parsed.checksum,
+            'Nbre de Rejets': 0 if parsed.rejections is None else len(parsed.rejections),
+            'Secondes': seconds,
+        })
+    while len(parsed_tt140_cache) > parsed_tt140_cache_size:
+        parsed_tt140_cache.popitem(last=False)
+
+    merged = merge_parsed_tt140([parsed for parsed, _ in results])
+    return merged, pd.DataFrame(timings)
@@ -0,0 +1,219 @@
+"""
+Timing and memory spans of the reconciliation pipeline.
+
+The pipeline functions of parser_TT140_MasterCard and processing_bank_sources are wrapped
+with @traced. Inside a tracing() block, each call records its wall time, CPU time, rows in
+and out and, optionally, its tracemalloc peak; outside of one, the wrapper only checks a
+context variable, so the instrumentation costs nothing measurable.
+
+The trace is held in a context variable: each Streamlit session, which runs in its own
+thread, records its own spans. The memory is only measured by one trace at a time:
+tracemalloc and its peak are global to the process, so a trace started while another one
+measures the memory records the times and rows only (its memory attribute is False).
+
+    with tracing(memory=True) as trace:
+        parsed_tt140 = parse_t140_MC(mastercard_file)
+    print(trace.to_json())
+"""
+import contextvars
+import json
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from functools import wraps
+
+import pandas as pd
+
+# Trace of the current run, None when the pipeline is not being traced
+current_trace = contextvars.ContextVar('pipeline_trace', default=None)
+# Whether a trace of the process measures the memory, see tracing()
+memory_trace_lock = threading.Lock()
+memory_trace_active = False
+
+
+@dataclass
+class SpanRecord:
+    """
+    Measures of one call of a pipeline function.
+
+    Attributes:
+        name (str): Name of the stage, the function name by default.
+        depth (int): Nesting level, 0 for the calls made directly inside tracing().
+        wall_s (float): Elapsed time in seconds.
+        cpu_s (float): CPU time of the process in seconds.
+        rows_in (int): Rows of the DataFrames received, or None if it got none.
+        rows_out (int): Rows of the DataFrames returned, or None if it returned none.
+        peak_mb (float): Peak of memory allocated during the call, above what was allocated
+            when it started, in MB; None when the memory is not traced.
+        error (str): Exception raised by the call, if any.
+    """
+    name: str
+    depth: int
+    wall_s: float = 0.0
+    cpu_s: float = 0.0
+    rows_in: int = None
+    rows_out: int = None
+    peak_mb: float = None
+    error: str = None
+
+
+@dataclass
+class PipelineTrace:
+    """
+    Spans recorded by one tracing() block, in the order the calls started.
+
+    Attributes:
+        memory (bool): True if the tracemalloc peak of each span is measured.
+        spans (list): SpanRecord of each call.
+    """
+    memory: bool = False
+    spans: list = field(default_factory=list)
+    # Open spans: [record, allocated bytes at its start, highest peak seen in its nested spans]
+    stack: list = field(default_factory=list, repr=False)
+
+    def to_frame(self):
+        """
+        Spans as a DataFrame, the nested stages indented under their caller.
+        """
+        df = pd.DataFrame([asdict(span) for span in self.spans], columns=list(SpanRecord.__dataclass_fields__))
+        df['name'] = ['    ' * (depth - 1) + '↳ ' + name if depth else name for name, depth in zip(df['name'], df['depth'])]
+        return df.drop(columns='depth').astype({'rows_in': 'Int64', 'rows_out': 'Int64'})
+
+    def to_json(self):
+        """
+        Spans as a JSON document, with the total time of the top level stages.
+        """
+        return json.dumps({
+            'memory': self.memory,
+            'total_wall_s': round(sum(span.wall_s for span in self.spans if span.depth == 0), 6),
+            'spans': [asdict(span) for span in self.spans],
+        }, indent=2)
+
+
+@contextmanager
+def tracing(memory=False):
+    """
+    Record the spans of the pipeline functions called inside the block.
+
+    Parameters:
+        memory (bool): If True, also measure the tracemalloc peak of each span. Tracing the
+            allocations slows the pipeline down, so it is optional. Ignored when another
+            trace of the process already measures the memory.
+
+    Yields:
+        PipelineTrace: Trace filled as the pipeline runs.
+    """
+    global memory_trace_active
+    started_tracemalloc = False
+    if memory:
+        with memory_trace_lock:
+            # Each span resets the process-wide peak: two traces cannot both measure it
+            if memory_trace_active:
+                memory = False
+            else:
+                memory_trace_active = True
+                started_tracemalloc = not tracemalloc.is_tracing()
+                if started_tracemalloc:
+                    tracemalloc.start()
+    trace = PipelineTrace(memory=memory)
+    token = current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        current_trace.reset(token)
+        if memory:
+            with memory_trace_lock:
+                if started_tracemalloc:
+                    tracemalloc.stop()
+                memory_trace_active = False
+
+
+def count_rows(value):
+    """
+    Rows of a DataFrame or Series, or of the DataFrames of a tuple or list; None if there are none.
+    Iterators are never counted, so that they are not consumed.
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        counts = [count for count in map(count_rows, value) if count is not None]
+        return sum(counts) if counts else None
+    return None
+
+
+@contextmanager
+def span(name, rows_in=None):
+    """
+    Record a span around a block of code, when a trace is active.
+
+    Parameters:
+        name (str): Name of the stage.
+        rows_in (int): Rows received by the stage.
+
+    Yields:
+        SpanRecord: Record of the span, whose rows_out can be set by the block; None when
+        the pipeline is not being traced.
+    """
+    trace = current_trace.get()
+    if trace is None:
+        yield None
+        return
+
+    record = SpanRecord(name, len(trace.stack), rows_in=rows_in)
+    trace.spans.append(record)
+    memory = trace.memory and tracemalloc.is_tracing()
+    allocated = 0
+    if memory:
+        allocated, peak = tracemalloc.get_traced_memory()
+        if trace.stack:
+            # Keep the peak of the caller before measuring this span on its own
+            caller = trace.stack[-1]
+            caller[2] = max(caller[2], peak)
+        tracemalloc.reset_peak()
+    trace.stack.append([record, allocated, 0])
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    try:
+        yield record
+    except BaseException as e:
+        record.error = repr(e)
+        raise
+    finally:
+        record.wall_s = round(time.perf_counter() - start_wall, 6)
+        record.cpu_s = round(time.process_time() - start_cpu, 6)
+        _, allocated, nested_peak = trace.stack.pop()
+        if memory:
+            peak = max(nested_peak, tracemalloc.get_traced_memory()[1])
+            record.peak_mb = round((peak - allocated) / 1e6, 3)
+            if trace.stack:
+                caller = trace.stack[-1]
+                caller[2] = max(caller[2], peak)
+
+
+def traced(function=None, name=None, rows_out=count_rows):
+    """
+    Decorator recording a span for each call of a pipeline function, when a trace is active.
+
+    Parameters:
+        function (callable): Function to wrap, when used without arguments (@traced).
+        name (str): Name of the stage (default the function name).
+        rows_out (callable): Rows of the returned value (default count_rows).
+
+    Returns:
+        callable: Wrapped function.
+    """
+    def decorator(function):
+        stage = name or function.__name__
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if current_trace.get() is None:
+                return function(*args, **kwargs)
+            with span(stage, count_rows([*args, *kwargs.values()])) as record:
+                result = function(*args, **kwargs)
+                record.rows_out = rows_out(result)
+            return result
+        return wrapper
+
+    return decorator(function) if function is not None else decorator
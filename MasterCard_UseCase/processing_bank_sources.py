@@ -1,114 +1,173 @@
 # librairies
+import numpy as np
 import pandas as pd
 from parser_TT140_MasterCard import *
+from pipeline_trace import count_rows, traced
 import os
 import re
 import tempfile
-from openpyxl.styles import PatternFill
 import openpyxl
-from openpyxl.styles import Font, PatternFill, Alignment, numbers
-from openpyxl.worksheet.table import Table, TableStyleInfo
+from pandas.io.formats.style import Styler
 #import win32com.client as win32
-import streamlit as st
 import io
+import xlsxwriter
 
 pd.set_option('future.no_silent_downcasting', True)
 pd.options.display.float_format = '{:,.2f}'.format
 
+def sniff_delimiter(first_line, default_delimiter=','):
+    """
+    Detect the delimiter of a CSV file from its first line: `;`, `,`, or spaces.
+    """
+    if ';' in first_line:
+        return ';'
+    elif ',' in first_line:
+        return ','
+    elif ' ' in first_line:
+        return r'\s+'  # regex for one or more spaces
+    return default_delimiter
+
+
+def split_header(first_line, delimiter):
+    """
+    Split the header line of a CSV file into stripped column names.
+    """
+    if delimiter == r'\s+':
+        names = first_line.split()
+    else:
+        names = first_line.split(delimiter)
+    return [name.strip().strip('"').strip() for name in names]
+
+
+def strip_categorical(series):
+    """
+    Strip the whitespace of a categorical column by working on its categories only,
+    then merge the categories that become identical (e.g. 'SG - BENIN' and 'SG - BENIN ').
+    """
+    categories = series.cat.categories.astype(str).str.strip()
+    stripped_categories = pd.Index(categories.unique())
+    # Position of each former category among the stripped ones
+    new_codes = stripped_categories.get_indexer(categories)
+    codes = series.cat.codes.to_numpy()
+    codes = np.where(codes >= 0, new_codes[codes], -1)
+    return pd.Series(pd.Categorical.from_codes(codes, categories=stripped_categories),
+                     index=series.index, name=series.name)
+
+
 # Define the function to read CSV files with delimiters
-def read_csv_with_delimiters(file_path, default_columns=None, default_delimiter=','):
+@traced
+def read_csv_with_delimiters(file_path, default_columns=None, default_delimiter=',', schema=None):
     """
     Read a CSV file with delimiters `;`, `,`, or space.
-    
+
+    The file is opened once: the delimiter is sniffed from its first bytes, then the same
+    stream is rewound and parsed with the C engine. Uploaded files are read straight from
+    their in-memory buffer.
+
     Parameters:
-        file_path (str): The path to the CSV file.
+        file_path (str or file-like): The path to the CSV file, or its binary buffer.
         default_delimiter (str): The default delimiter to use if the file is empty.
-        
+        schema (dict): dtypes by column name. When given, column names are stripped and the
+        whitespace of the categorical columns is removed while parsing.
+
     Returns:
         pd.DataFrame: The DataFrame with the CSV content.
     """
-    try:
-        with open(file_path, 'r') as f:
-            first_line = f.readline()
-
-        # Detect delimiter
-        if ';' in first_line:
-            delimiter = ';'
-        elif ',' in first_line:
-            delimiter = ','
-        elif ' ' in first_line:
-            delimiter = r'\s+'  # regex for one or more spaces
-        else:
-            delimiter = default_delimiter
-    except FileNotFoundError:
-        delimiter = default_delimiter
+    with open_source(file_path) as f:
+        first_line = f.readline(64 * 1024).decode('utf-8', errors='replace')
+        delimiter = sniff_delimiter(first_line, default_delimiter)
+        f.seek(0)
+        try:
+            if schema is None:
+                df = pd.read_csv(f, sep=delimiter, engine='c' , thousands = ',' , decimal= ".")
+            else:
+                names = split_header(first_line, delimiter)
+                dtype = {name: schema[name] for name in names if name in schema}
+                df = pd.read_csv(f, sep=delimiter, engine='c', thousands=',', decimal=".",
+                                 header=0, names=names, dtype=dtype)
+                for col in df.columns:
+                    if isinstance(df[col].dtype, pd.CategoricalDtype):
+                        df[col] = strip_categorical(df[col])
+                    elif df[col].dtype == object:
+                        df[col] = df[col].str.strip()
+        except pd.errors.EmptyDataError:
+            df = pd.DataFrame(columns=default_columns)
 
-    try:
-        df = pd.read_csv(file_path, sep=delimiter, engine='python' , thousands = ',' , decimal= ".")
-    except pd.errors.EmptyDataError:
-        df = pd.DataFrame(columns=default_columns)
-    
     return df
 
 
-# Function to save uploaded file to a temporary location
-def save_uploaded_file(uploaded_file):
-    with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-        temp_file.write(uploaded_file.read())
-        return temp_file.name
+def source_exists(source):
+    """
+    Tell whether a source file is available: an existing path, or an in-memory buffer.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.exists(source)
+    return source is not None
 
 # standard columns for each source file
 default_columns_cybersource = ['NBRE_TRANSACTION', 'MONTANT_TOTAL', 'CUR', 'FILIALE', 'RESEAU', 'TYPE_TRANSACTION']
 default_columns_saisie_manuelle = ['NBRE_TRANSACTION', 'MONTANT_TOTAL', 'CUR', 'FILIALE', 'RESEAU']
 default_columns_pos = ['FILIALE', 'RESEAU', 'TYPE_TRANSACTION', 'DATE_TRAI', 'CUR', 'NBRE_TRANSACTION', 'MONTANT_TOTAL']
 
+# dtypes of the columns of each source file: the repeated labels are stored as categories
+schema_cybersource = {
+    'NBRE_TRANSACTION': 'Int64',
+    'MONTANT_TOTAL': 'float64',
+    'CUR': 'category',
+    'FILIALE': 'category',
+    'RESEAU': 'category',
+    'TYPE_TRANSACTION': 'category',
+}
+schema_saisie_manuelle = {
+    'NBRE_TRANSACTION': 'Int64',
+    'MONTANT_TOTAL': 'float64',
+    'CUR': 'category',
+    'FILIALE': 'category',
+    'RESEAU': 'category',
+}
+schema_pos = {
+    'FILIALE': 'category',
+    'BANQUE': 'category',
+    'RESEAU': 'category',
+    'TYPE_TRANSACTION': 'category',
+    'DATE_TRAI': 'category',
+    'CUR': 'category',
+    'NBRE_TRANSACTION': 'Int64',
+    'MONTANT_TOTAL': 'float64',
+}
+
+@traced
 def reading_cybersource(cybersource_file):
-    if os.path.exists(cybersource_file):
-        df_cybersource = read_csv_with_delimiters(cybersource_file, default_columns_cybersource)
-        df_cybersource.columns = df_cybersource.columns.str.strip()
-        df_cybersource['TYPE_TRANSACTION'] = 'ACHAT'
-        df_cybersource = df_cybersource.apply(lambda x: x.str.strip() if x.dtype == "object" else x)
-        # handle unified format of columns for merging after
-        df_cybersource['RESEAU'] = df_cybersource['RESEAU'].astype(str)
-        df_cybersource['FILIALE'] = df_cybersource['FILIALE'].astype(str)
-        df_cybersource['CUR'] = df_cybersource['CUR'].astype(str)
+    if source_exists(cybersource_file):
+        df_cybersource = read_csv_with_delimiters(cybersource_file, default_columns_cybersource, schema=schema_cybersource)
+        df_cybersource['TYPE_TRANSACTION'] = pd.Categorical(['ACHAT'] * len(df_cybersource))
         return df_cybersource
     else:
         df_cybersource = pd.DataFrame(columns=default_columns_saisie_manuelle)
         #st.write("The Saisie Manuelle file does not exist at the specified path.")
 
 # Read Saisie Manuelle file
+@traced
 def reading_saisie_manuelle(saisie_manuelle_file):
-    if os.path.exists(saisie_manuelle_file):
-        df_sai_manuelle = read_csv_with_delimiters(saisie_manuelle_file, default_columns_saisie_manuelle)
-        df_sai_manuelle.columns = df_sai_manuelle.columns.str.strip()
-        df_sai_manuelle = df_sai_manuelle.apply(lambda x: x.str.strip() if x.dtype == "object" else x)
-        # handle unified format of columns for merging after
-        df_sai_manuelle['RESEAU'] = df_sai_manuelle['RESEAU'].astype(str)
-        df_sai_manuelle['FILIALE'] = df_sai_manuelle['FILIALE'].astype(str)
-        df_sai_manuelle['CUR'] = df_sai_manuelle['CUR'].astype(str)
-        
+    if source_exists(saisie_manuelle_file):
+        df_sai_manuelle = read_csv_with_delimiters(saisie_manuelle_file, default_columns_saisie_manuelle, schema=schema_saisie_manuelle)
         return df_sai_manuelle
     else:
         df_sai_manuelle = pd.DataFrame(columns=default_columns_saisie_manuelle)
         #print("The Saisie Manuelle file does not exist at the specified path.")
 
 # Read POS file
+@traced
 def reading_pos(pos_file):
-    if os.path.exists(pos_file):
-        df_pos = read_csv_with_delimiters(pos_file, default_columns_pos)
-        df_pos.columns = df_pos.columns.str.strip()
-        df_pos = df_pos.apply(lambda x: x.str.strip() if x.dtype == "object" else x)
+    if source_exists(pos_file):
+        df_pos = read_csv_with_delimiters(pos_file, default_columns_pos, schema=schema_pos)
         df_pos.rename(columns={'BANQUE': 'FILIALE'}, inplace=True)
-        # handle unified format of columns for merging after
-        df_pos['RESEAU'] = df_pos['RESEAU'].astype(str)
-        df_pos['FILIALE'] = df_pos['FILIALE'].astype(str)
-        df_pos['CUR'] = df_pos['CUR'].astype(str)
         return df_pos
     else:
         df_pos = pd.DataFrame(columns=default_columns_pos)
         #print("The POS file does not exist at the specified path.")
 
+@traced
 def filtering_sources(df_cybersource, df_sai_manuelle, df_pos, RESEAU):
     # Filter each source to get transactions matching the RESEAU
     filtered_cybersource_df = df_cybersource[df_cybersource['RESEAU'] == RESEAU]
@@ -118,6 +177,20 @@ def filtering_sources(df_cybersource, df_sai_manuelle, df_pos, RESEAU):
     return filtered_cybersource_df, filtered_saisie_manuelle_df, filtered_pos_df
 
 
+def source_file_pattern(source):
+    """
+    Regular expression of the file names of a source, TRANSACTION_<source>_TRAITE_SG_YY-MM-DD_HHMMSS.CSV,
+    with the date captured as its first group.
+
+    Parameters:
+        source (str): The source type (CYBERSOURCE, POS, or SAIS_MANU).
+
+    Returns:
+        re.Pattern: Compiled pattern.
+    """
+    return re.compile(f"^TRANSACTION_{source}_TRAITE_SG_(\\d{{2}}-\\d{{2}}-\\d{{2}})_\\d{{6}}\\.CSV$")
+
+
 def validate_file_name_and_date(file_name, source, date_to_validate=None):
     """
     Validate the file name based on the source, the required pattern, 
@@ -134,8 +207,7 @@ def validate_file_name_and_date(file_name, source, date_to_validate=None):
     Raises:
         ValueError: If the file name is invalid or if the date does not match the expected pattern.
     """
-    pattern = f"^TRANSACTION_{source}_TRAITE_SG_\\d{{2}}-\\d{{2}}-\\d{{2}}_\\d{{6}}\\.CSV$"
-    if not re.match(pattern, file_name):
+    if not source_file_pattern(source).match(file_name):
         raise ValueError(f"Invalid file name: {file_name}. Expected pattern: TRANSACTION_{source}_TRAITE_SG_YY-MM-DD_HHMMSS.CSV")
 
     # Extract the date from the file name
@@ -151,12 +223,14 @@ def validate_file_name_and_date(file_name, source, date_to_validate=None):
     return True
 
 # Converting the excel rejects file to a df
+@traced
 def excel_to_csv_to_df(excel_file_path, sheet_name=0):
     """
-    Converts an Excel file to a CSV file and then reads it into a Pandas DataFrame.
+    Converts an Excel file to CSV and then reads it into a Pandas DataFrame.
+    The CSV round trip is done in memory, no file is written next to the Excel file.
 
     Parameters:
-        excel_file_path (str): Path to the Excel file.
+        excel_file_path (str or file-like): Path to the Excel file, or its binary buffer.
         sheet_name (str or int): Name or index of the sheet to convert (default is the first sheet).
 
     Returns:
@@ -164,16 +238,14 @@ def excel_to_csv_to_df(excel_file_path, sheet_name=0):
     """
     try:
         # Read the Excel file
-        df = pd.read_excel(excel_file_path, sheet_name=sheet_name, header=0  , engine='openpyxl')
+        with open_source(excel_file_path) as f:
+            df = pd.read_excel(f, sheet_name=sheet_name, header=0  , engine='openpyxl')
 
-        # Define the CSV file path
-        csv_file_path = excel_file_path.replace('.xlsx', '.csv')
-        
-        # Save the DataFrame to a CSV file without an index
-        df.to_csv(csv_file_path, index=False)
-        
-        # Read the CSV file into a DataFrame
-        df_csv = read_csv_with_delimiters(csv_file_path)
+        # Save the DataFrame to an in-memory CSV without an index
+        csv_buffer = io.BytesIO(df.to_csv(index=False).encode('utf-8'))
+
+        # Read the CSV into a DataFrame
+        df_csv = read_csv_with_delimiters(csv_buffer)
         return df_csv
     
     except PermissionError as p_error:
@@ -201,15 +273,53 @@ def standardize_date_format(date_column, desired_format='%Y-%m-%d'):
     return date_column
 
 
-# Function to format columns
+def amount_columns(df):
+    """
+    Names of the amount ('Montant') columns of a DataFrame.
+    """
+    return [col for col in df.columns if 'Montant' in col]
+
+
+# Function to keep the amount columns numeric
+@traced
 def format_columns(df):
-    for col in df.columns:
-        if 'Montant' in col:
-            df[col] = df[col].apply(lambda x: '{:,.2f}'.format(x) if isinstance(x, (int, float)) else x)
+    """
+    Keep every 'Montant' column as numbers: empty cells become NaN. Amounts are only
+    formatted as '1,234.56' when they are displayed (style_amounts) or exported to Excel.
+    """
+    for col in amount_columns(df):
+        df[col] = pd.to_numeric(df[col].replace('', np.nan), errors='coerce')
     return df
 
+
+def style_amounts(df):
+    """
+    Display the amount columns with thousands separators and two decimals, without changing the stored numbers.
+
+    Parameters:
+        df (pd.DataFrame or Styler): Data to display.
+
+    Returns:
+        Styler: Styler to pass to st.dataframe.
+    """
+    styler = df if isinstance(df, Styler) else df.style
+    return styler.format('{:,.2f}', subset=amount_columns(styler.data), na_rep='')
+
+def categories_to_str(df):
+    """
+    Turn the categorical columns of a source back into plain object columns, so that sources
+    with different categories can be merged and filled like plain columns. Missing values
+    stay NaN, instead of becoming the string 'nan' that would join and group as a filiale.
+    """
+    categorical_columns = df.select_dtypes('category').columns
+    return df.astype({col: object for col in categorical_columns})
+
 # Merge the dataframes on relevant common columns
+@traced(rows_out=lambda result: count_rows(result[0]))
 def merging_sources_without_recycled(filtered_cybersource_df, filtered_saisie_manuelle_df, filtered_pos_df):
+    filtered_cybersource_df = categories_to_str(filtered_cybersource_df)
+    filtered_saisie_manuelle_df = categories_to_str(filtered_saisie_manuelle_df)
+    filtered_pos_df = categories_to_str(filtered_pos_df)
 # Merge POS and Saisie Manuelle dataframes
     merged_df = pd.merge(
         filtered_pos_df,
@@ -257,6 +367,40 @@ def merging_sources_without_recycled(filtered_cybersource_df, filtered_saisie_ma
 
 
 
+@traced
+def merge_recycled_summary(df_merged, summary):
+    """
+    Add the recycled transactions summary to the merged sources, with a keyed join on FILIALE and RESEAU.
+
+    Each summary row is applied at most once, to the first merged row with the same FILIALE
+    and RESEAU: its NBRE_TRANSACTION and MONTANT_TOTAL are added to that row's values.
+    Rows with a missing FILIALE or RESEAU never match.
+
+    Parameters:
+        df_merged (pd.DataFrame): Merged sources, with FILIALE, RESEAU, NBRE_TRANSACTION and MONTANT_TOTAL columns.
+        summary (pd.DataFrame): Recycled transactions grouped by FILIALE and RESEAU (one row per pair).
+
+    Returns:
+        pd.DataFrame: Copy of df_merged with the recycled transactions added.
+    """
+    merged_df = df_merged.copy()
+    keys = merged_df[['FILIALE', 'RESEAU']]
+
+    # Recycled values of each row's (FILIALE, RESEAU), aligned on merged_df
+    recycled = keys.merge(summary[['FILIALE', 'RESEAU', 'NBRE_TRANSACTION', 'MONTANT_TOTAL']],
+                          on=['FILIALE', 'RESEAU'], how='left')
+    recycled.index = merged_df.index
+
+    # Only the first row of each pair receives the recycled values
+    first_match = ~keys.duplicated() & keys.notna().all(axis=1) & recycled['NBRE_TRANSACTION'].notna()
+    if first_match.any():
+        for col in ['NBRE_TRANSACTION', 'MONTANT_TOTAL']:
+            merged_df.loc[first_match, col] = merged_df.loc[first_match, col] + recycled.loc[first_match, col]
+
+    return merged_df
+
+
+@traced(rows_out=lambda result: count_rows(result[1]))
 def merging_with_recycled(recycled_rejected_file, filtered_cybersource_df, filtered_saisie_manuelle_df, filtered_pos_df, filtering_date):
     # Merging the initial data sources
     df_merged, _ = merging_sources_without_recycled(filtered_cybersource_df, filtered_saisie_manuelle_df, filtered_pos_df)
@@ -282,29 +426,8 @@ def merging_with_recycled(recycled_rejected_file, filtered_cybersource_df, filte
         MONTANT_TOTAL=('Montant', 'sum')
     ).reset_index()
 
-    # Custom merge function to ensure merge only happens once for each FILIALE and RESEAU
-    def custom_merge(df_merged, summary):
-        merged_rows = []
-        for idx, row in df_merged.iterrows():
-            filiale = row['FILIALE']
-            reseau = row['RESEAU']
-
-            # Find matching row in summary
-            match = summary[(summary['FILIALE'] == filiale) & (summary['RESEAU'] == reseau)]
-            if not match.empty:
-                # Merge and append the first matching row, then drop it from summary to ensure it only merges once
-                summary = summary.drop(match.index)
-                merged_row = row.copy()
-                merged_row['NBRE_TRANSACTION'] = row['NBRE_TRANSACTION'] + match.iloc[0]['NBRE_TRANSACTION']
-                merged_row['MONTANT_TOTAL'] = row['MONTANT_TOTAL'] + match.iloc[0]['MONTANT_TOTAL']
-                merged_rows.append(merged_row)
-            else:
-                merged_rows.append(row)
-
-        return pd.DataFrame(merged_rows)
-
-    # Apply the custom merge function
-    merged_df = custom_merge(df_merged, summary)
+    # Add each recycled group to the first matching row of the merged sources
+    merged_df = merge_recycled_summary(df_merged, summary)
 
     # Fill NaN values with 0
     merged_df.fillna(0, inplace=True)
@@ -315,6 +438,7 @@ def merging_with_recycled(recycled_rejected_file, filtered_cybersource_df, filte
     return df_recycled, merged_df, total_nbre_transactions
 
 
+@traced
 def populating_table_reconcialited(merged_df):
     # Columns to be included in the reconciliated DataFrame
     new_columns = [
@@ -346,6 +470,7 @@ def populating_table_reconcialited(merged_df):
     merged_df = merged_df[new_columns]
     return merged_df
 
+@traced
 def handle_exact_match_csv(merged_df , run_date):
     populating_table_reconcialited(merged_df)
     df_reconciliated = merged_df.copy()
@@ -359,11 +484,14 @@ def handle_exact_match_csv(merged_df , run_date):
     #df_reconciliated.to_csv('reconciliated.csv', index=False)
     return df_reconciliated
 
-def handle_non_match_reconciliation(file_path,merged_df , run_date):
+@traced
+def handle_non_match_reconciliation(parsed_tt140, merged_df , run_date):
     populating_table_reconcialited(merged_df)
     df_reconciliated = merged_df.copy()
-    # Load the rejected summary data
-    df_rejected_summary = calculate_rejected_summary(file_path)
+    # Rejected summary data of the already parsed MasterCard file, empty when it has no rejections
+    df_rejected_summary = parsed_tt140.summary
+    if df_rejected_summary is None:
+        df_rejected_summary = pd.DataFrame(columns=rejected_summary_columns)
 
     # Ensure the relevant columns exist in the reconciliated DataFrame
     if 'FILIALE' not in df_reconciliated.columns:
@@ -373,29 +501,23 @@ def handle_non_match_reconciliation(file_path,merged_df , run_date):
     if 'Rapprochement' not in df_reconciliated.columns:
         df_reconciliated['Rapprochement'] = 'ok'
 
-    # Create a set of FILIALEs with issues from the rejected summary
-    filiales_with_issues = set(df_rejected_summary['FILIALE'])
-
-    # Update the reconciliated DataFrame
-    df_reconciliated['Rapprochement'] = df_reconciliated['FILIALE'].apply(
-        lambda x: 'NOT OK' if x in filiales_with_issues else 'OK'
+    # FILIALEs with issues from the rejected summary are not reconciled
+    df_reconciliated['Rapprochement'] = np.where(
+        df_reconciliated['FILIALE'].isin(df_rejected_summary['FILIALE']), 'NOT OK', 'OK'
     )
 
-    # Update Nbre Total de Rejets and Montant de Rejets based on the rejected summary data
-    for index, row in df_rejected_summary.iterrows():
-        filiale = row['FILIALE']
-        nbr_rejets = row['Nbre Total de Rejets']
-        montant_rejets = row['Montant de Rejets']
+    # Attach Nbre Total de Rejets and Montant de Rejets of each FILIALE from the rejected summary
+    rejected_by_filiale = df_rejected_summary.set_index('FILIALE')
+    nbr_rejets = df_reconciliated['FILIALE'].map(rejected_by_filiale['Nbre Total de Rejets'])
+    montant_rejets = df_reconciliated['FILIALE'].map(rejected_by_filiale['Montant de Rejets'])
+    matched = nbr_rejets.notna()
 
-        # Find the matching row in the reconciliated DataFrame
-        match_idx = df_reconciliated[df_reconciliated['FILIALE'] == filiale].index
-
-        if not match_idx.empty:
-            # Update the matching row
-            df_reconciliated.loc[match_idx, 'Nbre Total de Rejets'] = nbr_rejets
-            df_reconciliated.loc[match_idx, 'Montant de Rejets'] = montant_rejets
-            df_reconciliated['Montant de Transactions (Couverture)'] = df_reconciliated['Montant Total de Transactions']
-            df_reconciliated['Nbre de Transactions (Couverture)'] = df_reconciliated['Nbre Total De Transactions']
+    if matched.any():
+        df_reconciliated.loc[matched, 'Nbre Total de Rejets'] = nbr_rejets[matched]
+        df_reconciliated.loc[matched, 'Montant de Rejets'] = montant_rejets[matched]
+    # The coverage of the sources is filled even when no FILIALE has rejections
+    df_reconciliated['Montant de Transactions (Couverture)'] = df_reconciliated['Montant Total de Transactions']
+    df_reconciliated['Nbre de Transactions (Couverture)'] = df_reconciliated['Nbre Total De Transactions']
 
     # Fill NaN values in 'Nbre Total de Rejets' with 0 before converting to integer type
     df_reconciliated['Nbre Total de Rejets'] = df_reconciliated['Nbre Total de Rejets'].replace('', 0).fillna(0).astype(int)
@@ -406,172 +528,152 @@ def handle_non_match_reconciliation(file_path,merged_df , run_date):
     #Save the updated DataFrame to a CSV file
     #df_reconciliated.to_csv('reconciliated.csv', index=False)
     return df_reconciliated
+
+
+def rejection_outputs(parsed_tt140):
+    """
+    Rejection summary and rejected transactions to display and export after a reconciliation
+    with a difference.
+
+    When the totals differ but the report has no rejection, both are returned empty, so that
+    the rows reconciled by handle_non_match_reconciliation are shown with empty rejection tables.
+
+    Parameters:
+        parsed_tt140 (ParsedTT140): Parsed MasterCard file.
+
+    Returns:
+        tuple: Summary DataFrame and copy of the rejections DataFrame.
+    """
+    if parsed_tt140.rejections is None:
+        return pd.DataFrame(columns=rejected_summary_columns), pd.DataFrame(columns=rejection_columns)
+    return parsed_tt140.summary, parsed_tt140.rejections.copy()
+
+
 def handling_recycled(recycled_path, filtering_date):
 
     df_recyc = excel_to_csv_to_df(recycled_path)
-    df_recyc['Date Retraitement'] = standardize_date_format(df_recycled['Date Retraitement'])
+    df_recyc['Date Retraitement'] = standardize_date_format(df_recyc['Date Retraitement'])
     # Filtering recycled data based on the date
     df_recyc = df_recyc[df_recyc['Date Retraitement'] == filtering_date.strftime('%Y-%m-%d')]
     df_recyc.rename(columns={'BANQUE': 'FILIALE'}, inplace=True)
     df_recyc.drop_duplicates(subset=['FILIALE', 'RESEAU', 'ARN', 'Autorisation', 'Date Transaction', 'Montant', 'Devise'], inplace=True)
     total_transactions_recycled = len(df_recyc)
-    st.write("debugging vvv")
-    st.dataframe(df_recyc)
     return total_transactions_recycled
-def blue_style_and_save_to_excel(df):
+def highlight_non_reconciliated_row(row):
+    return [f'background-color: #ffab77; font-weight: bold;'
+        if row['Rapprochement'] == 'NOT OK' else '' for _ in row]
+
+
+df_reconciliated = None
+
+# Styles of the Excel exports
+excel_header_format = {'bold': True, 'font_color': '#FFFFFF', 'bg_color': '#4F81BD',
+                       'align': 'center', 'valign': 'vcenter'}
+excel_amount_format = {'num_format': '#,##0.00'}
+excel_not_ok_format = {'bold': True, 'font_color': '#FFFFFF', 'bg_color': '#E26B0A'}
+
+
+@traced
+def write_excel_chunks(chunks, recon=False):
     """
-    Styles a DataFrame and saves it to an Excel file with a predefined style.
+    Write a table into an Excel file in a single pass: header style, filter on the header,
+    '#,##0.00' format on the 'Montant' columns and widths fitted to the content.
+
+    The workbook is written in xlsxwriter constant_memory mode: each row is flushed to a
+    temporary file as soon as the next one starts, and the chunks are consumed one after the
+    other, so an export streamed from a database cursor holds one chunk at a time. Only the
+    compressed file is returned in memory. This mode does not support Excel tables, so the
+    header style and the filter are set by hand.
 
     Parameters:
-    - df (pd.DataFrame): The DataFrame to be styled and saved.
+    - chunks (iterable of pd.DataFrame): Parts of the table. The columns of the first chunk are
+      written; a column missing from a later chunk is left empty, and extra columns are dropped.
+    - recon (bool): If True, the 'Rapprochement' column is bold and the 'NOT OK' rows are highlighted.
 
     Returns:
-    - str: Path to the saved Excel file.
+    - io.BytesIO: The Excel file, or None if there was no chunk.
     """
-    # Define the path for the output Excel file
-    excel_path = './styled_data.xlsx'
+    buffer = io.BytesIO()
+    # Strings are written as they are, even when they look like formulas, urls or numbers
+    workbook = xlsxwriter.Workbook(buffer, {'constant_memory': True, 'strings_to_formulas': False,
+                                            'strings_to_urls': False, 'strings_to_numbers': False,
+                                            'default_date_format': 'yyyy-mm-dd hh:mm:ss'})
+    sheet = workbook.add_worksheet('Sheet1')
+    header_format = workbook.add_format(excel_header_format)
+    amount_format = workbook.add_format(excel_amount_format)
+    bold_format = workbook.add_format({'bold': True})
+    not_ok_format = workbook.add_format(excel_not_ok_format)
+    not_ok_amount_format = workbook.add_format({**excel_not_ok_format, **excel_amount_format})
+
+    columns = None
+    row_idx = 0
+    for chunk in chunks:
+        if columns is None:
+            columns = list(chunk.columns)
+            amount_flags = ['Montant' in str(column) for column in columns]
+            highlight = recon and 'Rapprochement' in columns
+            # Format of each cell of a row, set cell by cell since rows are flushed as they are written
+            row_formats = [amount_format if is_amount else bold_format if highlight and column == 'Rapprochement'
+                           else None for column, is_amount in zip(columns, amount_flags)]
+            not_ok_formats = [not_ok_amount_format if is_amount else not_ok_format for is_amount in amount_flags]
+            widths = [len(str(column)) for column in columns]
+            sheet.write_row(0, 0, [str(column) for column in columns], header_format)
+            row_idx = 1
+
+        chunk = chunk.reindex(columns=columns)
+        for col_idx in range(len(columns)):
+            if not chunk.empty:
+                widths[col_idx] = max(widths[col_idx], chunk.iloc[:, col_idx].astype(str).str.len().max())
+
+        # Missing values are written as empty cells
+        values = chunk.astype(object).where(chunk.notna(), None)
+        if highlight:
+            not_ok_rows = (chunk['Rapprochement'] == 'NOT OK').to_numpy()
+        else:
+            not_ok_rows = np.zeros(len(chunk), dtype=bool)
 
-    # Save DataFrame to an Excel file
-    df.to_excel(excel_path, index=False)
+        for row, is_not_ok in zip(values.itertuples(index=False), not_ok_rows):
+            formats = not_ok_formats if is_not_ok else row_formats
+            for col_idx, value in enumerate(row):
+                sheet.write(row_idx, col_idx, value, formats[col_idx])
+            row_idx += 1
 
-    # Load the workbook and select the active worksheet
-    workbook = openpyxl.load_workbook(excel_path)
-    sheet = workbook.active
+    if columns is None:
+        workbook.close()
+        return None
 
-    # Define the table style
-    style = TableStyleInfo(
-        name="TableStyleMedium9",
-        showFirstColumn=False,
-        showLastColumn=False,
-        showRowStripes=False,
-        showColumnStripes=True
-    )
+    # The column widths and the filter are written with the sheet when the workbook is closed
+    for col_idx in range(len(columns)):
+        sheet.set_column(col_idx, col_idx, widths[col_idx] + 2)
+    sheet.autofilter(0, 0, max(row_idx - 1, 1), len(columns) - 1)
 
-    # Add the table to the worksheet
-    tab = Table(displayName="Table1", ref=sheet.dimensions)
-    tab.tableStyleInfo = style
-    sheet.add_table(tab)
-    # Define the number format for thousands and decimal separators
-    number_format = numbers.FORMAT_NUMBER_COMMA_SEPARATED1
-
-    # Apply additional styling
-    # Set column widths based on content length and apply number format
-    for col in sheet.columns:
-        max_length = 0
-        column = col[0].column_letter
-        for cell in col:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-            # Apply number format to columns containing 'Montant'
-            if 'Montant' in df.columns[col[0].column - 1]:
-                cell.number_format = number_format
-        adjusted_width = (max_length + 2)
-        sheet.column_dimensions[column].width = adjusted_width
-        
-    # Set the header style
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill("solid", fgColor="4F81BD")
-    for cell in sheet[1]:
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = Alignment(horizontal="center", vertical="center")
-
-    # Save the styled workbook
-    workbook.save(excel_path)
+    workbook.close()
+    buffer.seek(0)
+    return buffer
 
-    return excel_path
 
-def styling_and_saving_reconciliated(excel_path):
+def save_excel_locally(excel_data, file_name):
     """
-    Styles specific cells in an existing Excel file based on 'Rapprochement' column values.
+    Save an Excel file built by write_excel_chunks to the temporary directory, under its
+    original name, so that it can be attached to an e-mail.
 
     Parameters:
-    - excel_path (str): Path to the Excel file to be styled.
+    - excel_data (io.BytesIO): The Excel file, as returned by write_excel_chunks.
+    - file_name (str): Name of the saved file.
 
     Returns:
-    - str: Path to the styled Excel file.
+    - str: Path of the saved file.
     """
-    # Reopen the workbook with openpyxl to apply styles
-    workbook = openpyxl.load_workbook(excel_path)
-    sheet = workbook['Sheet1']
-
-    # Load DataFrame from the Excel file
-    df = pd.read_excel(excel_path, sheet_name='Sheet1')
-    
-    # Apply styles to specific cells
-    for row_idx, row in df.iterrows():
-        for col_idx in range(len(row)):
-            cell = sheet.cell(row=row_idx + 2, column=col_idx + 1)  # +2 to account for header and 1-based index
-            # Apply bold font to 'Rapprochement' column cells
-            if col_idx == row.index.get_loc('Rapprochement'):
-                cell.font = Font(bold=True)
-            # Apply red background for 'not ok' and white text color
-            if row['Rapprochement'] == 'NOT OK':
-                cell.fill = PatternFill(start_color='ffe26b0a', end_color='ffe26b0a', fill_type="solid")  # Red
-                cell.font = Font(bold=True ,color="FFFFFF")  # Set text color to white
-
-    # Save the styled workbook
-    workbook.save(excel_path)
-    return excel_path
-
-            
-def highlight_non_reconciliated_row(row):
-    return [f'background-color: #ffab77; font-weight: bold;'
-        if row['Rapprochement'] == 'NOT OK' else '' for _ in row]
+    file_path = os.path.join(tempfile.gettempdir(), file_name)
+    with open(file_path, 'wb') as f:
+        f.write(excel_data.getbuffer())
+    return file_path
 
 
-df_reconciliated = None
-
-def download_file(recon  , df, file_partial_name, button_label , run_date):
-    # Assuming styling_and_saving_reconciliated is a defined function that processes the DataFrame
-    excel_path1 = blue_style_and_save_to_excel(df)
-    
-    if recon : 
-        excel_path2 = styling_and_saving_reconciliated(excel_path1)
-    else:
-        excel_path2 = excel_path1
-    
-    with open(excel_path2, 'rb') as f:
-        excel_data = io.BytesIO(f.read())
-
-    
-    with open(excel_path2, 'rb') as f:
-        excel_data = io.BytesIO(f.read())
-
-    # Define the file name
-    file_name = f"{file_partial_name}_{run_date}.xlsx"
-
-    # Create a download button for the Excel file
-    st.download_button(
-        label=button_label,
-        data=excel_data,
-        file_name=file_name,
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        type="primary",
-        use_container_width=True
-    )
-    return excel_path2 , file_name
-import tempfile
-def save_excel_locally(excel_path , file_name):
-    wb = openpyxl.load_workbook(excel_path)
-
-
-    
-    # Save the workbook locally with original file name
-    temp_dir = tempfile.gettempdir()  # Get the temporary directory
-    file_path = os.path.join(temp_dir, file_name)  # Define the file path
-    
-    wb.save(file_path)  # Save the workbook
-    
-    return file_path  # Return the file path
-
-# def send_excel_contents_to_outlook(excel_path , file_name):
+# def send_excel_contents_to_outlook(excel_data , file_name):
 #     try:
 #         # Save Excel file locally
-#         excel_file_path = save_excel_locally(excel_path , file_name)
+#         excel_file_path = save_excel_locally(excel_data , file_name)
 #
 #         # Connect to Outlook
 #         outlook = win32.Dispatch("Outlook.Application")
@@ -0,0 +1,302 @@
+"""
+Reconciliation of one business day without Streamlit: the same pipeline as the
+MasterCard_UI page (parse_t140_MC, reading_*, filtering_sources, merging_*,
+handle_*_reconciliation), driven by file paths, for nightly batch runs.
+
+Run from the repository root, so that the currency and country settings are found:
+    python MasterCard_UseCase/reconciliation_engine.py \\
+        --mastercard TT140.001 \\
+        --cybersource TRANSACTION_CYBERSOURCE_TRAITE_SG_24-05-23_010203.CSV \\
+        --pos TRANSACTION_POS_TRAITE_SG_24-05-23_010203.CSV \\
+        --saisie-manuelle TRANSACTION_SAIS_MANU_TRAITE_SG_24-05-23_010203.CSV \\
+        --output-dir results --format parquet excel --archive
+"""
+import argparse
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import date, datetime
+
+import pandas as pd
+from processing_bank_sources import *
+
+# Network reconciled by the engine, as in the MasterCard_UI page
+reseau_mastercard = 'MASTERCARD INTERNATIONAL'
+
+# File names of the outputs, the same as the downloads of the MasterCard_UI page
+output_partial_names = {
+    'reconciliation': 'results_recon_MC',
+    'summary': 'rejected_summary_MC',
+    'rejections': 'rejected_transactions_MC',
+}
+output_formats = ('parquet', 'excel')
+
+
+@dataclass
+class ReconciliationInputs:
+    """
+    Files of one reconciliation, given by their paths (or binary buffers).
+
+    Attributes:
+        mastercard (str or list): TT140 MasterCard .001 file, or list of the .001 files of the
+            day (one per clearing cycle), parsed and merged with parse_t140_MC_batch.
+        cybersource (str): Cybersource CSV file, or None.
+        pos (str): POS CSV file, or None.
+        saisie_manuelle (str): Saisie Manuelle CSV file, or None.
+        recycled (str): Excel file of the recycled transactions, or None.
+        filtering_date (date): Date Retraitement of the recycled transactions to keep (default today).
+        file_names (dict): Names to validate for the CSV sources, by source, when they are given
+            as buffers; by default the base name of each path is validated.
+    """
+    mastercard: str
+    cybersource: str = None
+    pos: str = None
+    saisie_manuelle: str = None
+    recycled: str = None
+    filtering_date: date = None
+    file_names: dict = field(default_factory=dict)
+
+
+@dataclass
+class ReconciliationResult:
+    """
+    Outcome of the reconciliation of one business day.
+
+    Attributes:
+        day (str): Business date of the reconciliation, in the format 'YY-MM-DD'.
+        run_date (str): RUN DATE of the MasterCard report, in the format 'YY-MM-DD'.
+        nbr_total_mastercard (int): Number of transactions in the MasterCard file.
+        total_nbre_transactions (int): Number of transactions in the other sources.
+        total_transactions (dict): Number of MasterCard transactions of each source.
+        reconciliation (pd.DataFrame): Reconciliation results.
+        summary (pd.DataFrame): Rejections grouped by FILIALE, or None if both sides match
+            (empty if they differ but the report has no rejection).
+        rejections (pd.DataFrame): Rejected transactions, or None if both sides match
+            (empty if they differ but the report has no rejection).
+        recycled (pd.DataFrame): Recycled transactions added to the sources, or None.
+        elapsed (float): Duration of the reconciliation in seconds.
+    """
+    day: str
+    run_date: str
+    nbr_total_mastercard: int
+    total_nbre_transactions: int
+    total_transactions: dict
+    reconciliation: pd.DataFrame
+    summary: pd.DataFrame = None
+    rejections: pd.DataFrame = None
+    recycled: pd.DataFrame = None
+    elapsed: float = 0.0
+
+    @property
+    def matched(self):
+        """
+        True if the MasterCard file and the other sources have the same number of transactions.
+        """
+        return self.nbr_total_mastercard == self.total_nbre_transactions
+
+
+# Source files: reader, validate_file_name_and_date source name and columns of an absent source
+csv_sources = {
+    'cybersource': (reading_cybersource, 'CYBERSOURCE', default_columns_cybersource),
+    'pos': (reading_pos, 'POS', default_columns_pos),
+    'saisie_manuelle': (reading_saisie_manuelle, 'SAIS_MANU', default_columns_saisie_manuelle),
+}
+
+
+def read_csv_source(inputs, source, day):
+    """
+    Validate the name of one CSV source against the reconciliation day and read it.
+
+    Parameters:
+        inputs (ReconciliationInputs): Files of the reconciliation.
+        source (str): Key of csv_sources.
+        day (str): Business date of the reconciliation, in the format 'YY-MM-DD'.
+
+    Returns:
+        pd.DataFrame: Contents of the source, or an empty DataFrame if it is not given.
+
+    Raises:
+        ValueError: If the file name does not match the source pattern or the day.
+    """
+    reader, source_name, default_columns = csv_sources[source]
+    path = getattr(inputs, source)
+    if path is None:
+        return pd.DataFrame(columns=default_columns)
+    file_name = inputs.file_names.get(source) or os.path.basename(path)
+    validate_file_name_and_date(file_name, source_name, date_to_validate=day)
+    return reader(path)
+
+
+def parse_mastercard_reports(mastercard_files, parse_workers=None):
+    """
+    Parse the MasterCard reports of one business day, merging them when there are several.
+
+    Parameters:
+        mastercard_files (list): MasterCard .001 files of the day.
+        parse_workers (int): Worker processes of parse_t140_MC_batch (default: number of CPUs).
+
+    Returns:
+        ParsedTT140: Total count, rejections and summary of all the reports.
+
+    Raises:
+        ValueError: If the same report is given twice, which would count its transactions twice.
+    """
+    if len(mastercard_files) == 1:
+        return parse_t140_MC(mastercard_files[0])
+    parsed_tt140, timings = parse_t140_MC_batch(mastercard_files, max_workers=parse_workers)
+    duplicated = timings[timings['Checksum'].duplicated(keep=False)]
+    if not duplicated.empty:
+        raise ValueError(f"The MasterCard reports {', '.join(map(str, duplicated['Fichier']))} have the same contents.")
+    return parsed_tt140
+
+
+def reconcile(day, inputs, parse_workers=None):
+    """
+    Reconcile the MasterCard file(s) of one business day with the POS, Cybersource and
+    Saisie Manuelle sources, and the recycled transactions if given.
+
+    Nothing is displayed, stored or written: see write_reconciliation_outputs and
+    archive_reconciliation for the outputs.
+
+    Parameters:
+        day (str): Business date of the reconciliation, in the format 'YY-MM-DD', the day after
+            the RUN DATE of the MasterCard report. If None, it is read from the report.
+        inputs (ReconciliationInputs): Files of the reconciliation.
+        parse_workers (int): Worker processes parsing the MasterCard reports, when there are several.
+
+    Returns:
+        ReconciliationResult: Counts and DataFrames of the reconciliation.
+
+    Raises:
+        ValueError: If a report does not belong to the day, the same report is given twice,
+            or a source file name is invalid.
+    """
+    start = time.perf_counter()
+    mastercard_files = list(inputs.mastercard) if isinstance(inputs.mastercard, (list, tuple)) else [inputs.mastercard]
+    for preflight in map(preflight_tt140, mastercard_files):
+        if day is None:
+            day = preflight.day_after
+        elif day != preflight.day_after:
+            raise ValueError(f"The MasterCard report of {preflight.run_date} is not the one of the "
+                             f"reconciliation of {day} (expected {preflight.day_after}).")
+    run_date = preflight.run_date
+
+    df_cybersource = read_csv_source(inputs, 'cybersource', day)
+    df_pos = read_csv_source(inputs, 'pos', day)
+    df_sai_manuelle = read_csv_source(inputs, 'saisie_manuelle', day)
+    filtered_cybersource_df, filtered_saisie_manuelle_df, filtered_pos_df = filtering_sources(
+        df_cybersource, df_sai_manuelle, df_pos, reseau_mastercard)
+    total_transactions = {
+        'Cybersource': int(filtered_cybersource_df['NBRE_TRANSACTION'].sum()),
+        'POS': int(filtered_pos_df['NBRE_TRANSACTION'].sum()),
+        'Saisie Manuelle': int(filtered_saisie_manuelle_df['NBRE_TRANSACTION'].sum()),
+        'Transactions Recyclées': 0,
+    }
+
+    df_recycled = None
+    if inputs.recycled is not None:
+        filtering_date = inputs.filtering_date or date.today()
+        df_recycled, merged_df, total_nbre_transactions = merging_with_recycled(
+            inputs.recycled, filtered_cybersource_df, filtered_saisie_manuelle_df, filtered_pos_df, filtering_date)
+        total_transactions['Transactions Recyclées'] = len(df_recycled)
+    else:
+        merged_df, total_nbre_transactions = merging_sources_without_recycled(
+            filtered_cybersource_df, filtered_saisie_manuelle_df, filtered_pos_df)
+
+    parsed_tt140 = parse_mastercard_reports(mastercard_files, parse_workers)
+    result = ReconciliationResult(day, run_date, int(parsed_tt140.nbr_total), int(total_nbre_transactions),
+                                  total_transactions, None, recycled=df_recycled)
+    if result.matched:
+        result.reconciliation = handle_exact_match_csv(merged_df, run_date=run_date)
+    else:
+        result.reconciliation = handle_non_match_reconciliation(parsed_tt140, merged_df, run_date=run_date)
+        result.summary, result.rejections = rejection_outputs(parsed_tt140)
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def write_reconciliation_outputs(result, output_dir, formats=output_formats):
+    """
+    Write the reconciliation results, and the rejections if any, to a directory.
+
+    The Excel files are styled as the downloads of the MasterCard_UI page and have the same names.
+
+    Parameters:
+        result (ReconciliationResult): Outcome of reconcile.
+        output_dir (str): Directory of the files, created if needed.
+        formats (tuple): Formats to write, among 'parquet' and 'excel'.
+
+    Returns:
+        list: Paths of the written files.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    outputs = {'reconciliation': result.reconciliation, 'summary': result.summary, 'rejections': result.rejections}
+    paths = []
+    for name, df in outputs.items():
+        if df is None:
+            continue
+        stem = os.path.join(output_dir, f"{output_partial_names[name]}_{result.run_date}")
+        if 'parquet' in formats:
+            # Object columns may mix '' with numbers: they are stored as strings
+            df.astype({col: str for col in df.select_dtypes('object').columns}).to_parquet(f"{stem}.parquet", index=False)
+            paths.append(f"{stem}.parquet")
+        if 'excel' in formats:
+            with open(f"{stem}.xlsx", 'wb') as f:
+                f.write(write_excel_chunks([df], recon=name == 'reconciliation').getbuffer())
+            paths.append(f"{stem}.xlsx")
+    return paths
+
+
+def archive_reconciliation(result):
+    """
+    Store the reconciliation results and the rejections in MongoDB, as the Stocker buttons
+    of the MasterCard_UI page do. The upserts are idempotent, so a day can be archived again.
+
+    Parameters:
+        result (ReconciliationResult): Outcome of reconcile.
+
+    Returns:
+        list: Messages of the stored collections.
+    """
+    # Imported here so that runs without --archive need no database settings
+    from database_actions import insert_reconciliated_data, insert_rejected_transactions
+
+    messages = [insert_reconciliated_data(result.reconciliation)]
+    if result.rejections is not None:
+        messages.append(insert_rejected_transactions(result.rejections, result.run_date))
+    return messages
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mastercard", required=True, nargs='+',
+                        help="TT140 MasterCard .001 file, or the .001 files of each clearing cycle of the day")
+    parser.add_argument("--cybersource", help="Cybersource CSV file")
+    parser.add_argument("--pos", help="POS CSV file")
+    parser.add_argument("--saisie-manuelle", help="Saisie Manuelle CSV file")
+    parser.add_argument("--recycled", help="Excel file of the recycled transactions")
+    parser.add_argument("--filtering-date", type=lambda value: datetime.strptime(value, '%Y-%m-%d').date(),
+                        help="Date Retraitement of the recycled transactions, YYYY-MM-DD (default today)")
+    parser.add_argument("--day", help="Business date of the reconciliation, YY-MM-DD (default: day after the RUN DATE)")
+    parser.add_argument("--output-dir", default=".", help="Directory of the result files")
+    parser.add_argument("--format", nargs='*', choices=output_formats, default=['excel'],
+                        help="Formats of the result files (none to skip them)")
+    parser.add_argument("--archive", action='store_true', help="Store the results and rejections in MongoDB")
+    args = parser.parse_args(argv)
+
+    inputs = ReconciliationInputs(args.mastercard, args.cybersource, args.pos, args.saisie_manuelle,
+                                  args.recycled, args.filtering_date)
+    result = reconcile(args.day, inputs)
+    print(f"Reconciliation of {result.day} (MasterCard report of {result.run_date}): "
+          f"{'no difference' if result.matched else 'difference'}, {result.nbr_total_mastercard} MasterCard "
+          f"transactions against {result.total_nbre_transactions} in the other sources, {result.elapsed:.2f} s")
+    for path in write_reconciliation_outputs(result, args.output_dir, args.format):
+        print(f"Written {path}")
+    if args.archive:
+        for message in archive_reconciliation(result):
+            print(message)
+    return result
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+"""
+Spool directory ingestion: the daily files are dropped in a directory instead of being
+uploaded through the MasterCard_UI page, and each business day is reconciled as soon as
+its set of files is complete.
+
+Files are recognized by the patterns of validate_file_name_and_date for the CSV sources,
+and by the RUN DATE of their header for the MasterCard .001 report. Once a day has been
+reconciled, its files are moved to done/<day>/, or to failed/<day>/ with an error.log.
+A file that arrives for a day already in done/<day>/, such as the report of a later
+clearing cycle, reconciles the day again with the files kept there.
+Several days, such as the backlog after a holiday, are reconciled in parallel by a
+bounded pool of worker processes.
+
+Run from the repository root:
+    python MasterCard_UseCase/spool_watcher.py /data/spool --output-dir /data/results --archive
+    python MasterCard_UseCase/spool_watcher.py /data/spool --once    # reconcile the complete days and exit
+"""
+import argparse
+import os
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from reconciliation_engine import *
+
+# Sources of a day, with the validate_file_name_and_date name of the CSV sources
+spool_csv_sources = {
+    'cybersource': 'CYBERSOURCE',
+    'pos': 'POS',
+    'saisie_manuelle': 'SAIS_MANU',
+}
+spool_required_sources = ('mastercard', 'cybersource', 'pos', 'saisie_manuelle')
+mastercard_extension = '.001'
+
+# Files modified less than this many seconds ago may still be being copied
+spool_settle_seconds = 5
+spool_poll_interval = 30
+spool_done_dir = 'done'
+spool_failed_dir = 'failed'
+# Crashes of a worker process on the same day before its files are moved to failed/
+spool_max_worker_failures = 2
+
+# Business day of each MasterCard report, keyed by (path, size, mtime), so headers are read once.
+# scan_spool drops the entries of the files that left the spool or changed.
+mastercard_days = {}
+
+
+def classify_spool_file(path):
+    """
+    Find the source and business day of a file of the spool directory.
+
+    Parameters:
+        path (str): Path of the file.
+
+    Returns:
+        tuple: Source (a key of spool_csv_sources, or 'mastercard') and business day 'YY-MM-DD',
+        or None if the file is not a reconciliation source.
+
+    Raises:
+        ValueError: If a MasterCard report has no readable RUN DATE.
+    """
+    file_name = os.path.basename(path)
+    for source, source_name in spool_csv_sources.items():
+        match = source_file_pattern(source_name).match(file_name)
+        if match:
+            return source, match.group(1)
+
+    if file_name.lower().endswith(mastercard_extension):
+        stat = os.stat(path)
+        key = (path, stat.st_size, stat.st_mtime)
+        if key not in mastercard_days:
+            mastercard_days[key] = preflight_tt140(path).day_after
+        return 'mastercard', mastercard_days[key]
+    return None
+
+
+def done_day_sources(spool_dir, day):
+    """
+    Group the files of a day already reconciled, kept in done/<day>/, by source.
+    Every .001 file of the directory is a MasterCard report of the day.
+
+    Returns:
+        dict: Source -> sorted list of paths, empty if the day was not reconciled.
+    """
+    done_dir = os.path.join(spool_dir, spool_done_dir, day)
+    if not os.path.isdir(done_dir):
+        return {}
+    sources = {}
+    for entry in os.scandir(done_dir):
+        source = next((source for source, source_name in spool_csv_sources.items()
+                       if source_file_pattern(source_name).match(entry.name)), None)
+        if source is None and entry.name.lower().endswith(mastercard_extension):
+            source = 'mastercard'
+        if source is not None:
+            sources.setdefault(source, []).append(entry.path)
+    for paths in sources.values():
+        paths.sort()
+    return sources
+
+
+def scan_spool(spool_dir, settle_seconds=spool_settle_seconds):
+    """
+    Group the settled files of the spool directory by business day and source.
+
+    When a CSV source was dropped several times for the same day, the last file name (the
+    latest HHMMSS) is the one reconciled. Every MasterCard report of the day is reconciled,
+    one per clearing cycle.
+
+    A day already reconciled is completed with its files of done/<day>/: a report of a
+    later clearing cycle is reconciled with the reports and CSV files of the earlier run,
+    and a CSV file dropped again replaces the one of the earlier run.
+
+    Parameters:
+        spool_dir (str): Spool directory.
+        settle_seconds (float): Minimum age of a file, so that files still being copied are skipped.
+
+    Returns:
+        tuple: Dict of day -> source -> sorted list of paths, and dict of unreadable path -> error message.
+    """
+    days = {}
+    unreadable = {}
+    present = set()
+    now = time.time()
+    for entry in os.scandir(spool_dir):
+        if not entry.is_file():
+            continue
+        stat = entry.stat()
+        present.add((entry.path, stat.st_size, stat.st_mtime))
+        if now - stat.st_mtime < settle_seconds:
+            continue
+        try:
+            classified = classify_spool_file(entry.path)
+        except (OSError, ValueError) as e:
+            unreadable[entry.path] = str(e)
+            continue
+        if classified is None:
+            continue
+        source, day = classified
+        days.setdefault(day, {}).setdefault(source, []).append(entry.path)
+    for day, sources in days.items():
+        for source, done_paths in done_day_sources(spool_dir, day).items():
+            if source == 'mastercard':
+                # A report dropped again under the same name replaces the one of the earlier run
+                spool_names = {os.path.basename(path) for path in sources.get(source, [])}
+                sources.setdefault(source, []).extend(path for path in done_paths
+                                                      if os.path.basename(path) not in spool_names)
+            elif source not in sources:
+                sources[source] = done_paths
+        for source, paths in sources.items():
+            paths.sort(key=os.path.basename)
+    for key in mastercard_days.keys() - present:
+        del mastercard_days[key]
+    return days, unreadable
+
+
+def move_spool_files(paths, target_dir):
+    """
+    Move files to a done/ or failed/ directory, replacing any previous file of the same name.
+
+    Returns:
+        list: New paths of the files.
+    """
+    os.makedirs(target_dir, exist_ok=True)
+    moved = []
+    for path in paths:
+        target = os.path.join(target_dir, os.path.basename(path))
+        if os.path.exists(path):
+            os.replace(path, target)
+        moved.append(target)
+    return moved
+
+
+def reconcile_spool_day(day, sources, spool_dir, output_dir, formats=output_formats, archive=False):
+    """
+    Reconcile one business day of the spool directory, write its outputs and move its files
+    to done/<day>/, or to failed/<day>/ with the error in error.log. Runs in a worker process.
+
+    Parameters:
+        day (str): Business day 'YY-MM-DD'.
+        sources (dict): Source -> list of paths, as returned by scan_spool.
+        spool_dir (str): Spool directory.
+        output_dir (str): Directory of the outputs, written in <output_dir>/<day>/.
+        formats (tuple): Formats of the outputs, see write_reconciliation_outputs.
+        archive (bool): If True, store the results and rejections in MongoDB.
+
+    Returns:
+        tuple: True if the day was reconciled, and a message for the log.
+    """
+    paths = [path for source_paths in sources.values() for path in source_paths]
+    try:
+        # The reports of every clearing cycle are merged; for the CSV sources, the last drop replaces the others
+        inputs = ReconciliationInputs(**{source: source_paths if source == 'mastercard' else source_paths[-1]
+                                         for source, source_paths in sources.items()})
+        # Days are already reconciled in parallel: the reports of a day are parsed in its worker
+        result = reconcile(day, inputs, parse_workers=1)
+        written = write_reconciliation_outputs(result, os.path.join(output_dir, day), formats)
+        messages = archive_reconciliation(result) if archive else []
+    except Exception:
+        failed_dir = os.path.join(spool_dir, spool_failed_dir, day)
+        move_spool_files(paths, failed_dir)
+        with open(os.path.join(failed_dir, 'error.log'), 'a') as f:
+            f.write(traceback.format_exc())
+        return False, f"{day}: failed, see {failed_dir}"
+
+    move_spool_files(paths, os.path.join(spool_dir, spool_done_dir, day))
+    return True, (f"{day}: {'no difference' if result.matched else 'difference'}, "
+                  f"{result.nbr_total_mastercard} against {result.total_nbre_transactions} transactions, "
+                  f"{len(written)} files written{', ' if messages else ''}{', '.join(messages)} ({result.elapsed:.2f} s)")
+
+
+def fail_spool_day(day, sources, spool_dir, message):
+    """
+    Move the files of a day whose worker process failed to failed/<day>/, with the message in error.log.
+
+    Returns:
+        str: Directory of the moved files.
+    """
+    failed_dir = os.path.join(spool_dir, spool_failed_dir, day)
+    move_spool_files([path for source_paths in sources.values() for path in source_paths], failed_dir)
+    with open(os.path.join(failed_dir, 'error.log'), 'a') as f:
+        f.write(message + '\n')
+    return failed_dir
+
+
+def watch_spool(spool_dir, output_dir, formats=output_formats, archive=False, max_workers=2,
+                poll_interval=spool_poll_interval, settle_seconds=spool_settle_seconds,
+                required_sources=spool_required_sources, once=False,
+                max_worker_failures=spool_max_worker_failures):
+    """
+    Watch a spool directory and reconcile each business day once its set of files is complete.
+
+    At most max_workers days are reconciled at the same time; the other complete days wait
+    for a free worker, oldest day first.
+
+    The errors of a reconciliation are handled by reconcile_spool_day. If the worker process
+    itself fails (killed, out of memory), the day is retried at the next scan, and its files
+    are moved to failed/<day>/ after max_worker_failures failures. A process that dies breaks
+    the whole pool: the pool is then replaced, and every day it was running counts one failure.
+
+    Parameters:
+        spool_dir (str): Spool directory, where the files are dropped.
+        output_dir (str): Directory of the outputs.
+        formats (tuple): Formats of the outputs, see write_reconciliation_outputs.
+        archive (bool): If True, store the results and rejections in MongoDB.
+        max_workers (int): Number of days reconciled in parallel.
+        poll_interval (float): Seconds between two scans of the spool directory.
+        settle_seconds (float): Minimum age of a file before it is picked up.
+        required_sources (tuple): Sources that make a day complete, the MasterCard report being always required.
+        once (bool): If True, return when no complete day is left instead of watching forever.
+        max_worker_failures (int): Failures of the worker process on a day before its files are moved to failed/.
+
+    Returns:
+        dict: Day -> (reconciled, message) of the days processed, when once is True.
+    """
+    # The MasterCard report is always needed
+    required_sources = set(required_sources) | {'mastercard'}
+    processed = {}
+    in_flight = {}
+    worker_failures = {}
+    executor = ProcessPoolExecutor(max_workers=max_workers)
+    try:
+        while True:
+            done = [future for future in in_flight if future.done()]
+            broken = any(isinstance(future.exception(), BrokenProcessPool) for future in done)
+            if broken:
+                # Every day running in a broken pool fails with it: collect them all before replacing it
+                wait(in_flight)
+                done = list(in_flight)
+            for future in done:
+                day, sources = in_flight.pop(future)
+                try:
+                    processed[day] = future.result()
+                    worker_failures.pop(day, None)
+                except Exception as e:
+                    worker_failures[day] = worker_failures.get(day, 0) + 1
+                    if worker_failures[day] >= max_worker_failures:
+                        failed_dir = fail_spool_day(day, sources, spool_dir,
+                                                    f"Worker process failed {worker_failures[day]} times: {e!r}")
+                        processed[day] = (False, f"{day}: worker failed ({e}), moved to {failed_dir}")
+                    else:
+                        # The files stay in the spool and the day is retried at the next scan
+                        processed[day] = (False, f"{day}: worker failed ({e}), retried at the next scan")
+                print(processed[day][1], flush=True)
+            if broken:
+                executor.shutdown(wait=False)
+                executor = ProcessPoolExecutor(max_workers=max_workers)
+
+            days, unreadable = scan_spool(spool_dir, settle_seconds)
+            for path, error in unreadable.items():
+                print(f"{os.path.basename(path)}: unreadable, moved to {spool_failed_dir}/ ({error})", flush=True)
+                move_spool_files([path], os.path.join(spool_dir, spool_failed_dir))
+
+            busy_days = {day for day, _ in in_flight.values()}
+            ready = [day for day in sorted(days)
+                     if day not in busy_days and all(source in days[day] for source in required_sources)]
+            for day in ready[:max_workers - len(in_flight)]:
+                try:
+                    future = executor.submit(reconcile_spool_day, day, days[day], spool_dir, output_dir,
+                                             formats, archive)
+                except BrokenProcessPool:
+                    # A worker died since the check above: the pool is replaced at the next iteration
+                    break
+                in_flight[future] = (day, days[day])
+
+            # Every day either leaves the spool or reaches max_worker_failures, so --once always returns
+            if once and not in_flight:
+                return processed
+            if in_flight:
+                # Wake up as soon as a worker is free
+                wait(in_flight, timeout=poll_interval, return_when=FIRST_COMPLETED)
+            else:
+                time.sleep(poll_interval)
+    finally:
+        executor.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("spool_dir", help="Directory where the daily files are dropped")
+    parser.add_argument("--output-dir", default="results", help="Directory of the result files, one folder per day")
+    parser.add_argument("--format", nargs='*', choices=output_formats, default=['excel'],
+                        help="Formats of the result files (none to skip them)")
+    parser.add_argument("--archive", action='store_true', help="Store the results and rejections in MongoDB")
+    parser.add_argument("--workers", type=int, default=2, help="Number of days reconciled in parallel")
+    parser.add_argument("--interval", type=float, default=spool_poll_interval, help="Seconds between two scans")
+    parser.add_argument("--settle", type=float, default=spool_settle_seconds,
+                        help="Minimum age in seconds of a file before it is picked up")
+    parser.add_argument("--required", nargs='+', choices=spool_required_sources, default=list(spool_required_sources),
+                        help="Sources that make a day complete")
+    parser.add_argument("--once", action='store_true', help="Reconcile the complete days and exit")
+    args = parser.parse_args(argv)
+
+    watch_spool(args.spool_dir, args.output_dir, args.format, args.archive, args.workers, args.interval,
+                args.settle, tuple(args.required), args.once)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Benchmark and regression check of the Excel export of download_file.
+
+The former export (to_excel, reload with openpyxl to add the table and restyle every
+cell, reload again with read_excel to highlight the NOT OK rows) is kept below as the
+reference: the benchmark first checks that write_excel_chunks gives the same cell values,
+number formats and highlighting, then times both.
+
+Run from the repository root:
+    python benchmarks/bench_excel_export.py
+    python benchmarks/bench_excel_export.py --rows 100000 --legacy-rows 0
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'MasterCard_UseCase')))
+
+import numpy as np
+import openpyxl
+import pandas as pd
+from openpyxl.styles import Alignment, Font, PatternFill, numbers
+from openpyxl.worksheet.table import Table, TableStyleInfo
+from processing_bank_sources import write_excel_chunks
+
+
+def legacy_export(df, recon=True):
+    """
+    Former implementation: blue_style_and_save_to_excel then styling_and_saving_reconciliated,
+    written to a temporary file and read back into memory.
+    """
+    excel_path = io.BytesIO()
+    df.to_excel(excel_path, index=False)
+    excel_path.seek(0)
+    workbook = openpyxl.load_workbook(excel_path)
+    sheet = workbook.active
+    tab = Table(displayName="Table1", ref=sheet.dimensions)
+    tab.tableStyleInfo = TableStyleInfo(name="TableStyleMedium9", showFirstColumn=False, showLastColumn=False,
+                                        showRowStripes=False, showColumnStripes=True)
+    sheet.add_table(tab)
+    for col in sheet.columns:
+        max_length = 0
+        column = col[0].column_letter
+        for cell in col:
+            max_length = max(max_length, len(str(cell.value)))
+            if 'Montant' in df.columns[col[0].column - 1]:
+                cell.number_format = numbers.FORMAT_NUMBER_COMMA_SEPARATED1
+        sheet.column_dimensions[column].width = max_length + 2
+    for cell in sheet[1]:
+        cell.font = Font(bold=True, color="FFFFFF")
+        cell.fill = PatternFill("solid", fgColor="4F81BD")
+        cell.alignment = Alignment(horizontal="center", vertical="center")
+    styled = io.BytesIO()
+    workbook.save(styled)
+
+    if recon:
+        styled.seek(0)
+        workbook = openpyxl.load_workbook(styled)
+        sheet = workbook['Sheet1']
+        styled.seek(0)
+        df_read = pd.read_excel(styled, sheet_name='Sheet1')
+        for row_idx, row in df_read.iterrows():
+            for col_idx in range(len(row)):
+                cell = sheet.cell(row=row_idx + 2, column=col_idx + 1)
+                if col_idx == row.index.get_loc('Rapprochement'):
+                    cell.font = Font(bold=True)
+                if row['Rapprochement'] == 'NOT OK':
+                    cell.fill = PatternFill(start_color='ffe26b0a', end_color='ffe26b0a', fill_type="solid")
+                    cell.font = Font(bold=True, color="FFFFFF")
+        styled = io.BytesIO()
+        workbook.save(styled)
+    styled.seek(0)
+    return styled
+
+
+def make_reconciliation(n_rows, seed=0):
+    """
+    Reconciliation results as handle_non_match_reconciliation returns them, half of them NOT OK.
+    """
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'FILIALE': np.array(['SG - MAROC', 'SG - TCHAD', 'SG - BENIN'], dtype=object)[rng.integers(0, 3, n_rows)],
+        'Réseau': 'MASTERCARD INTERNATIONAL',
+        'Type': 'ACHAT',
+        'Date': '2024-05-22',
+        'Devise': 'MAD',
+        'Nbre Total De Transactions': rng.integers(1, 1000, n_rows),
+        'Montant Total de Transactions': rng.integers(100, 10_000_000, n_rows) / 100,
+        'Rapprochement': np.array(['OK', 'NOT OK'], dtype=object)[rng.integers(0, 2, n_rows)],
+        'Nbre Total de Rejets': rng.integers(0, 5, n_rows),
+        'Montant de Rejets': rng.integers(0, 100_000, n_rows) / 100,
+    })
+
+
+def check_same_workbook(result, expected):
+    """
+    Compare the cell values, number formats and NOT OK fill of two exports.
+    """
+    pd.testing.assert_frame_equal(pd.read_excel(result), pd.read_excel(expected), check_dtype=False)
+    result.seek(0)
+    expected.seek(0)
+    sheet = openpyxl.load_workbook(result)['Sheet1']
+    sheet_expected = openpyxl.load_workbook(expected)['Sheet1']
+    # The legacy export is an Excel table: write_excel_chunks sets a filter on the same range
+    assert sheet.auto_filter.ref == list(sheet_expected.tables.values())[0].ref
+    for cell, cell_expected in zip(sheet[1], sheet_expected[1]):
+        assert cell.font.b and cell.fill.fgColor.rgb[-6:] == cell_expected.fill.fgColor.rgb[-6:], cell.coordinate
+    for row, row_expected in zip(sheet.iter_rows(min_row=2), sheet_expected.iter_rows(min_row=2)):
+        for cell, cell_expected in zip(row, row_expected):
+            assert cell.number_format == cell_expected.number_format, cell.coordinate
+            assert cell.font.b == cell_expected.font.b, cell.coordinate
+            assert cell.fill.fgColor.rgb[-6:].upper() == cell_expected.fill.fgColor.rgb[-6:].upper(), cell.coordinate
+    result.seek(0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100_000, help="Rows of the exported reconciliation")
+    parser.add_argument('--legacy-rows', type=int, default=5_000,
+                        help="Rows of the comparison with the former export (0 to skip it)")
+    args = parser.parse_args()
+
+    df = make_reconciliation(args.rows)
+    start = time.perf_counter()
+    excel_data = write_excel_chunks([df], recon=True)
+    single_pass = time.perf_counter() - start
+    print(f"write_excel_chunks: {single_pass:.2f} s ({args.rows} rows, {excel_data.getbuffer().nbytes / 1e6:.1f} MB)")
+
+    if args.legacy_rows:
+        df = make_reconciliation(args.legacy_rows)
+        start = time.perf_counter()
+        result = write_excel_chunks([df], recon=True)
+        single_pass = time.perf_counter() - start
+        start = time.perf_counter()
+        expected = legacy_export(df)
+        legacy = time.perf_counter() - start
+        check_same_workbook(result, expected)
+        print(f"legacy export ({args.legacy_rows} rows): {legacy:.2f} s against {single_pass:.2f} s, "
+              f"same cells, x{legacy / single_pass:.0f}")
+
+
+if __name__ == "__main__":
+    main()
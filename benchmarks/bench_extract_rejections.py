@@ -0,0 +1,76 @@
+"""
+Scaling benchmark of extract_rejections on synthetic TT140 reports.
+
+Run from the repository root:
+    python benchmarks/bench_extract_rejections.py
+    python benchmarks/bench_extract_rejections.py --sizes 100 1000 10000 --compare-legacy
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'MasterCard_UseCase')))
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+import json
+from parser_TT140_MasterCard import extract_rejections
+from synthetic_data import write_tt140_report
+
+settings_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'MasterCard_UseCase'))
+currencies_settings = os.path.join(settings_dir, 'currency_codes.json')
+countries_settings = os.path.join(settings_dir, 'countries_acronyms.json')
+
+
+def legacy_country_lookup(mastercard_file):
+    """
+    D0043 country lookup as it was before the streaming parser: the whole report is
+    re-tokenized twice for every rejected transaction.
+    """
+    with open(countries_settings, 'r') as f:
+        countries_data = json.load(f)
+    with open(mastercard_file, 'r') as f:
+        text = ' '.join(line.rstrip('\n') for line in f if line.strip())
+    country_names = []
+    occurrences_d0043 = [i for i, token in enumerate(text.split()) if token in ["D0043", "*D0043"]]
+    for index_sixth_d0043 in occurrences_d0043[5:]:
+        if index_sixth_d0043 + 2 < len(text.split()):
+            country_name = countries_data.get(text.split()[index_sixth_d0043 + 2].strip('*'))
+            if country_name:
+                country_names.append(country_name)
+    return country_names
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 10_000, 100_000],
+                        help="Number of rejected messages of each synthetic report")
+    parser.add_argument('--compare-legacy', action='store_true',
+                        help="Also time the former D0043 lookup (only for reports up to 1k rejections, it is quadratic)")
+    args = parser.parse_args()
+
+    print(f"{'rejections':>10} {'size (MB)':>10} {'seconds':>10} {'us/reject':>10} {'legacy (s)':>11}")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for size in args.sizes:
+            report_path = os.path.join(temp_dir, f"TT140_{size}.001")
+            write_tt140_report(report_path, size)
+            file_size = os.path.getsize(report_path) / (1024 * 1024)
+
+            start = time.perf_counter()
+            df_rejected = extract_rejections(report_path, currencies_settings, countries_settings)
+            elapsed = time.perf_counter() - start
+            assert len(df_rejected) == size
+
+            legacy = ''
+            if args.compare_legacy and size <= 1_000:
+                start = time.perf_counter()
+                legacy_country_lookup(report_path)
+                legacy = f"{time.perf_counter() - start:.3f}"
+
+            print(f"{size:>10} {file_size:>10.1f} {elapsed:>10.3f} {elapsed / size * 1e6:>10.1f} {legacy:>11}")
+            os.remove(report_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Benchmark of merge_recycled_summary against the former row-by-row merge of the recycled transactions.
+
+The former implementation is kept below as the reference: the benchmark first checks that
+both give the same output, then times them.
+
+Run from the repository root:
+    python benchmarks/bench_merge_recycled.py
+    python benchmarks/bench_merge_recycled.py --rows 5000 --groups 500
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'MasterCard_UseCase')))
+
+import numpy as np
+import pandas as pd
+from processing_bank_sources import merge_recycled_summary
+
+
+def legacy_custom_merge(df_merged, summary):
+    """
+    Former merge of merging_with_recycled: iterrows over the merged sources, with a
+    boolean scan and a drop of the summary for every row.
+    """
+    merged_rows = []
+    for idx, row in df_merged.iterrows():
+        filiale = row['FILIALE']
+        reseau = row['RESEAU']
+        match = summary[(summary['FILIALE'] == filiale) & (summary['RESEAU'] == reseau)]
+        if not match.empty:
+            summary = summary.drop(match.index)
+            merged_row = row.copy()
+            merged_row['NBRE_TRANSACTION'] = row['NBRE_TRANSACTION'] + match.iloc[0]['NBRE_TRANSACTION']
+            merged_row['MONTANT_TOTAL'] = row['MONTANT_TOTAL'] + match.iloc[0]['MONTANT_TOTAL']
+            merged_rows.append(merged_row)
+        else:
+            merged_rows.append(row)
+    return pd.DataFrame(merged_rows)
+
+
+def make_inputs(n_rows, n_groups, seed=0):
+    """
+    Merged sources with n_rows rows and a recycled summary with n_groups (FILIALE, RESEAU) pairs.
+    Pairs repeat across merged rows, some summary pairs match no row and some keys are missing.
+    """
+    rng = np.random.default_rng(seed)
+    filiales = np.array([f"SG - FILIALE {i:05d}" for i in range(max(n_groups, 1))], dtype=object)
+    reseaux = np.array(["MASTERCARD INTERNATIONAL", "VISA INTERNATIONAL"], dtype=object)
+
+    df_merged = pd.DataFrame({
+        'FILIALE': filiales[rng.integers(0, len(filiales), n_rows)],
+        'RESEAU': reseaux[rng.integers(0, len(reseaux), n_rows)],
+        'TYPE_TRANSACTION': np.array(["ACHAT", "RETRAIT"], dtype=object)[rng.integers(0, 2, n_rows)],
+        'CUR': '952',
+        'NBRE_TRANSACTION': rng.integers(1, 1000, n_rows),
+        'MONTANT_TOTAL': rng.integers(100, 10_000_000, n_rows) / 100,
+    })
+    df_merged.loc[rng.choice(n_rows, size=max(n_rows // 100, 1), replace=False), 'FILIALE'] = np.nan
+
+    # Distinct (FILIALE, RESEAU) pairs, as produced by the groupby of merging_with_recycled
+    pairs = rng.choice(len(filiales) * len(reseaux), size=n_groups, replace=False)
+    summary = pd.DataFrame({
+        'FILIALE': filiales[pairs // len(reseaux)],
+        'RESEAU': reseaux[pairs % len(reseaux)],
+    })
+    summary['NBRE_TRANSACTION'] = rng.integers(1, 50, len(summary))
+    summary['MONTANT_TOTAL'] = rng.integers(100, 1_000_000, len(summary)) / 100
+    return df_merged, summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=50_000, help="Rows of the merged sources")
+    parser.add_argument('--groups', type=int, default=5_000, help="Recycled (FILIALE, RESEAU) groups")
+    parser.add_argument('--skip-legacy', action='store_true', help="Only time merge_recycled_summary")
+    args = parser.parse_args()
+
+    df_merged, summary = make_inputs(args.rows, args.groups)
+
+    start = time.perf_counter()
+    result = merge_recycled_summary(df_merged, summary).fillna(0)
+    vectorized = time.perf_counter() - start
+    print(f"merge_recycled_summary: {vectorized:.3f} s ({args.rows} rows x {len(summary)} groups)")
+
+    if not args.skip_legacy:
+        start = time.perf_counter()
+        expected = legacy_custom_merge(df_merged, summary).fillna(0)
+        legacy = time.perf_counter() - start
+        pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+        print(f"legacy iterrows merge:  {legacy:.3f} s, same output, x{legacy / vectorized:.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Benchmark and regression check of handle_non_match_reconciliation.
+
+The former back-fill of the rejections (one boolean scan and two .loc writes per FILIALE of
+the rejected summary) is kept below as the reference: the benchmark first checks that the
+current function gives the same output, then times both.
+
+Run from the repository root:
+    python benchmarks/bench_non_match_reconciliation.py
+    python benchmarks/bench_non_match_reconciliation.py --rows 200000 --filiales 2000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'MasterCard_UseCase')))
+
+import numpy as np
+import pandas as pd
+from parser_TT140_MasterCard import ParsedTT140
+from processing_bank_sources import (format_columns, handle_non_match_reconciliation,
+                                     populating_table_reconcialited)
+
+
+def legacy_handle_non_match_reconciliation(parsed_tt140, merged_df, run_date):
+    """
+    Former implementation: Rapprochement mapped with a Python lambda, and the rejections
+    attached with a loop over the rows of the rejected summary.
+    """
+    populating_table_reconcialited(merged_df)
+    df_reconciliated = merged_df.copy()
+    df_rejected_summary = parsed_tt140.summary
+    if 'Rapprochement' not in df_reconciliated.columns:
+        df_reconciliated['Rapprochement'] = 'ok'
+    filiales_with_issues = set(df_rejected_summary['FILIALE'])
+    df_reconciliated['Rapprochement'] = df_reconciliated['FILIALE'].apply(
+        lambda x: 'NOT OK' if x in filiales_with_issues else 'OK'
+    )
+    for index, row in df_rejected_summary.iterrows():
+        match_idx = df_reconciliated[df_reconciliated['FILIALE'] == row['FILIALE']].index
+        if not match_idx.empty:
+            df_reconciliated.loc[match_idx, 'Nbre Total de Rejets'] = row['Nbre Total de Rejets']
+            df_reconciliated.loc[match_idx, 'Montant de Rejets'] = row['Montant de Rejets']
+            df_reconciliated['Montant de Transactions (Couverture)'] = df_reconciliated['Montant Total de Transactions']
+            df_reconciliated['Nbre de Transactions (Couverture)'] = df_reconciliated['Nbre Total De Transactions']
+    df_reconciliated['Nbre Total de Rejets'] = df_reconciliated['Nbre Total de Rejets'].replace('', 0).fillna(0).astype(int)
+    df_reconciliated['Date'] = pd.to_datetime(run_date, format='%y-%m-%d').strftime('%Y-%m-%d')
+    return format_columns(df_reconciliated)
+
+
+def make_inputs(n_rows, n_filiales, seed=0):
+    """
+    Merged sources over n_filiales FILIALEs, and a rejected summary covering half of them
+    plus FILIALEs absent from the sources.
+    """
+    rng = np.random.default_rng(seed)
+    filiales = np.array([f"SG - FILIALE {i:05d}" for i in range(n_filiales)], dtype=object)
+    merged_df = pd.DataFrame({
+        'FILIALE': filiales[rng.integers(0, n_filiales, n_rows)],
+        'RESEAU': 'MASTERCARD INTERNATIONAL',
+        'TYPE_TRANSACTION': np.array(["ACHAT", "RETRAIT"], dtype=object)[rng.integers(0, 2, n_rows)],
+        'DATE_TRAI': '2024-05-23',
+        'CUR': '952',
+        'NBRE_TRANSACTION': rng.integers(1, 1000, n_rows),
+        'MONTANT_TOTAL': rng.integers(100, 10_000_000, n_rows) / 100,
+    })
+    rejected_filiales = np.concatenate([filiales[::2], [f"SG - ABSENTE {i}" for i in range(3)]])
+    summary = pd.DataFrame({
+        'FILIALE': rejected_filiales,
+        'Nbre Total de Rejets': rng.integers(1, 100, len(rejected_filiales)),
+        'Montant de Rejets': rng.integers(100, 1_000_000, len(rejected_filiales)) / 100,
+    })
+    return merged_df, ParsedTT140('', 0, summary=summary)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=50_000, help="Rows of the merged sources")
+    parser.add_argument('--filiales', type=int, default=1_000, help="Distinct FILIALEs")
+    parser.add_argument('--skip-legacy', action='store_true', help="Only time handle_non_match_reconciliation")
+    args = parser.parse_args()
+
+    merged_df, parsed_tt140 = make_inputs(args.rows, args.filiales)
+
+    start = time.perf_counter()
+    result = handle_non_match_reconciliation(parsed_tt140, merged_df.copy(), run_date='24-05-22')
+    vectorized = time.perf_counter() - start
+    print(f"handle_non_match_reconciliation: {vectorized:.3f} s ({args.rows} rows, {args.filiales} filiales)")
+
+    if not args.skip_legacy:
+        start = time.perf_counter()
+        expected = legacy_handle_non_match_reconciliation(parsed_tt140, merged_df.copy(), run_date='24-05-22')
+        legacy = time.perf_counter() - start
+        pd.testing.assert_frame_equal(result, expected)
+        print(f"legacy loop:                     {legacy:.3f} s, same output, x{legacy / vectorized:.0f}")
+
+
+if __name__ == "__main__":
+    main()
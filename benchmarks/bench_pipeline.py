@@ -0,0 +1,255 @@
+"""
+Benchmark of each stage of the reconciliation pipeline on synthetic files: parse, read,
+filter, merge, reconcile, export and archive.
+
+Every stage is timed over several runs (wall and CPU time, best run kept), then run once
+more under tracemalloc for its peak of allocated memory. The results are written to a
+JSON file stamped with the commit, so that two commits can be compared with --baseline.
+Everything runs offline: the archive stage is skipped unless --mongo-uri points to a
+MongoDB server, such as a local mongod, where a throwaway database is used.
+
+Run from the repository root:
+    python benchmarks/bench_pipeline.py --rejects 10000 --recycled-rows 5000
+    python benchmarks/bench_pipeline.py --output after.json --baseline before.json
+    python benchmarks/bench_pipeline.py --mongo-uri mongodb://localhost:27017
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'MasterCard_UseCase')))
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+# The on-disk cache of parse_t140_MC lives in a private directory, emptied before each parse
+tt140_cache_dir = tempfile.mkdtemp(prefix='bench_tt140_cache_')
+os.environ['TT140_CACHE_DIR'] = tt140_cache_dir
+
+import pandas as pd
+import parser_TT140_MasterCard
+from processing_bank_sources import *
+from synthetic_data import default_currencies, default_filiales, write_reconciliation_day
+
+stages = ['parse', 'read', 'filter', 'merge', 'reconcile', 'export', 'archive']
+benchmark_database = 'Results_benchmark'
+
+
+def measure(function, repeat):
+    """
+    Time a function over repeat runs, then measure its allocation peak in one more run.
+
+    Returns:
+        tuple: Result of the last run, and dict of the best wall time, its CPU time,
+        the wall times of every run and the peak of allocated memory in MB.
+    """
+    runs = []
+    for _ in range(repeat):
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        result = function()
+        runs.append((time.perf_counter() - start_wall, time.process_time() - start_cpu))
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    wall, cpu = min(runs)
+    return result, {
+        'wall_s': round(wall, 4),
+        'cpu_s': round(cpu, 4),
+        'wall_s_runs': [round(run_wall, 4) for run_wall, _ in runs],
+        'peak_mb': round(peak / 1e6, 2),
+    }
+
+
+def fresh_parse(mastercard_file):
+    """
+    parse_t140_MC without its in-memory and on-disk caches, so that every run parses the file.
+    """
+    parser_TT140_MasterCard.parsed_tt140_cache.clear()
+    shutil.rmtree(tt140_cache_dir, ignore_errors=True)
+    return parse_t140_MC(mastercard_file)
+
+
+def archive_stage(mongo_uri):
+    """
+    Point database_actions to a throwaway database of the given server, and return a
+    function that empties it then archives a reconciliation as archive_reconciliation does.
+    """
+    secrets_path = os.path.join(tempfile.mkdtemp(prefix='bench_mongo_'), 'secrets.toml')
+    with open(secrets_path, 'w') as f:
+        f.write(f'[mongo]\nurl = "{mongo_uri}"\n')
+    os.environ['MONGO_SECRETS_PATH'] = secrets_path
+    import database_actions
+    database_actions.mongo_database = benchmark_database
+
+    def archive(df_reconciliated, df_rejections, run_date):
+        database_actions.get_client().drop_database(benchmark_database)
+        # The indexes were dropped with the database: recreate them, as at the first access of a process
+        database_actions.indexes_created = None
+        database_actions.ensure_indexes()
+        database_actions.insert_reconciliated_data(df_reconciliated)
+        database_actions.insert_rejected_transactions(df_rejections, run_date)
+
+    return archive, lambda: database_actions.get_client().drop_database(benchmark_database)
+
+
+def git_commit():
+    """
+    Commit of the working tree, with a '+' when it has uncommitted changes, or None outside git.
+    """
+    repository = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=repository,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=repository,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('+' if dirty else '')
+
+
+def run_benchmark(paths, repeat, mongo_uri=None):
+    """
+    Run every stage of the pipeline on the files of one day.
+
+    Parameters:
+        paths (dict): Files of the day, see synthetic_data.write_reconciliation_day.
+        repeat (int): Timed runs of each stage.
+        mongo_uri (str): MongoDB server of the archive stage, or None to skip it.
+
+    Returns:
+        dict: Measures of each stage, with the number of rows it received and produced.
+    """
+    results = {}
+    filtering_date = datetime.strptime(paths['day'], '%y-%m-%d').date()
+    run_date = preflight_tt140(paths['mastercard']).run_date
+
+    parsed_tt140, results['parse'] = measure(lambda: fresh_parse(paths['mastercard']), repeat)
+    results['parse'].update(rows_in=preflight_tt140(paths['mastercard']).estimated_messages,
+                            rows_out=len(parsed_tt140.rejections))
+
+    def read():
+        return (reading_cybersource(paths['cybersource']), reading_saisie_manuelle(paths['saisie_manuelle']),
+                reading_pos(paths['pos']))
+    (df_cybersource, df_sai_manuelle, df_pos), results['read'] = measure(read, repeat)
+    sources_rows = len(df_cybersource) + len(df_sai_manuelle) + len(df_pos)
+    results['read'].update(rows_in=sources_rows, rows_out=sources_rows)
+
+    filtered, results['filter'] = measure(
+        lambda: filtering_sources(df_cybersource, df_sai_manuelle, df_pos, 'MASTERCARD INTERNATIONAL'), repeat)
+    results['filter'].update(rows_in=sources_rows, rows_out=sum(len(df) for df in filtered))
+
+    if 'recycled' in paths:
+        (df_recycled, merged_df, _), results['merge'] = measure(
+            lambda: merging_with_recycled(paths['recycled'], *filtered, filtering_date), repeat)
+        results['merge']['recycled_rows'] = len(df_recycled)
+    else:
+        (merged_df, _), results['merge'] = measure(lambda: merging_sources_without_recycled(*filtered), repeat)
+    results['merge'].update(rows_in=sum(len(df) for df in filtered), rows_out=len(merged_df))
+
+    # The handle_* functions rename the columns of merged_df in place
+    df_reconciliated, results['reconcile'] = measure(
+        lambda: handle_non_match_reconciliation(parsed_tt140, merged_df.copy(), run_date=run_date), repeat)
+    results['reconcile'].update(rows_in=len(merged_df), rows_out=len(df_reconciliated))
+
+    df_rejections = parsed_tt140.rejections
+    _, results['export'] = measure(lambda: (write_excel_chunks([df_reconciliated], recon=True),
+                                            write_excel_chunks([parsed_tt140.summary]),
+                                            write_excel_chunks([df_rejections])), repeat)
+    exported_rows = len(df_reconciliated) + len(parsed_tt140.summary) + len(df_rejections)
+    results['export'].update(rows_in=exported_rows, rows_out=exported_rows)
+
+    if mongo_uri:
+        archive, drop = archive_stage(mongo_uri)
+        try:
+            _, results['archive'] = measure(lambda: archive(df_reconciliated, df_rejections, run_date), repeat)
+        finally:
+            drop()
+        results['archive'].update(rows_in=len(df_reconciliated) + len(df_rejections),
+                                  rows_out=len(df_reconciliated) + len(df_rejections))
+    return results
+
+
+def print_results(results, baseline=None):
+    """
+    Print the measures of each stage, with the ratio to the baseline wall time if given.
+    """
+    print(f"{'stage':<10} {'wall s':>9} {'cpu s':>9} {'peak MB':>9} {'rows in':>9} {'rows out':>9}"
+          + (f" {'vs base':>9}" if baseline else ""))
+    for stage in stages:
+        if stage not in results:
+            print(f"{stage:<10} {'skipped':>9}")
+            continue
+        measures = results[stage]
+        line = (f"{stage:<10} {measures['wall_s']:>9.3f} {measures['cpu_s']:>9.3f} {measures['peak_mb']:>9.1f} "
+                f"{measures['rows_in']:>9} {measures['rows_out']:>9}")
+        if baseline and stage in baseline and measures['wall_s']:
+            line += f" {baseline[stage]['wall_s'] / measures['wall_s']:>8.2f}x"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rejects', type=int, default=10_000, help="Rejected messages of the TT140 report")
+    parser.add_argument('--transactions', type=int, help="MasterCard transactions (default 10 x rejects)")
+    parser.add_argument('--filiales', nargs='+', default=default_filiales, help="Country acronyms of the filiales")
+    parser.add_argument('--currencies', nargs='+', default=default_currencies, help="Numeric currency codes")
+    parser.add_argument('--recycled-rows', type=int, default=2_000, help="Rows of the recycled transactions file")
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs of each stage")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mongo-uri', help="MongoDB server of the archive stage (skipped by default)")
+    parser.add_argument('--output', help="JSON file of the results (default bench_pipeline_<commit>.json)")
+    parser.add_argument('--baseline', help="JSON file of a previous run, to compare the wall times")
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix='bench_pipeline_')
+    try:
+        paths = write_reconciliation_day(data_dir, args.rejects, args.transactions, args.filiales, args.currencies,
+                                         args.recycled_rows, seed=args.seed)
+        file_sizes = {name: os.path.getsize(path) for name, path in paths.items() if name != 'day'}
+        results = run_benchmark(paths, args.repeat, args.mongo_uri)
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+        shutil.rmtree(tt140_cache_dir, ignore_errors=True)
+
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'parameters': {
+            'rejects': args.rejects,
+            'transactions': args.transactions or 10 * args.rejects,
+            'filiales': args.filiales,
+            'currencies': args.currencies,
+            'recycled_rows': args.recycled_rows,
+            'repeat': args.repeat,
+            'seed': args.seed,
+        },
+        'file_sizes': file_sizes,
+        'stages': results,
+    }
+    output = args.output or f"bench_pipeline_{(commit or 'local').rstrip('+')}.json"
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['stages']
+    print_results(results, baseline)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
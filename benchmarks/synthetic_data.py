@@ -0,0 +1,312 @@
+"""
+Synthetic input files for the reconciliation benchmarks.
+
+Everything is generated offline from a seeded random generator, so two runs with the same
+parameters produce the same contents (byte-identical, except for the timestamps of the
+Excel file of the recycled transactions).
+
+Run from the repository root to write the files of one day:
+    python benchmarks/synthetic_data.py /tmp/day --rejects 10000 --recycled-rows 2000
+"""
+import argparse
+import json
+import os
+import random
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+# Country acronyms of the filiales, as listed in countries_acronyms.json
+default_filiales = ["CIV", "SEN", "CMR", "BEN", "MDG", "BFA", "TCD", "COG", "GIN", "GNQ"]
+# Numeric currency codes, as listed in currency_codes.json
+default_currencies = ["952", "950", "978", "840"]
+
+countries_settings = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'MasterCard_UseCase', 'countries_acronyms.json')
+reseaux = ["MASTERCARD INTERNATIONAL", "VISA INTERNATIONAL"]
+# Transaction types of the POS file; the _MDS ones are left out of the MasterCard count
+pos_transaction_types = ["ACHAT", "RETRAIT", "ACHAT_MDS"]
+
+error_codes = [
+    ("2001", "INVALID ACQUIRER REFERENCE DATA"),
+    ("2702", "AMOUNT OUT OF RANGE"),
+    ("2004", "INVALID CARD ACCEPTOR COUNTRY CODE"),
+    ("2286", "TRANSACTION DATE TOO OLD"),
+]
+
+identifier_error_section = "CODE    DESCRIPTION                                                                                MESSAGE #   ELEMENT ID"
+
+
+def _tt140_message(rnd, message_number, filiales, currencies, run_date):
+    """
+    Lines of one rejected message block of an IP727010 report.
+    """
+    lines = [f" {identifier_error_section}"]
+    for code, description in rnd.sample(error_codes, rnd.randint(1, 2)):
+        lines.append(f" {code}    {description:<85} {message_number:08d}    D0031")
+    lines.append(" MESSAGE DETAILS")
+    amount = rnd.randint(100, 5_000_000) / 100
+    lines.append(f" D0004       SOURCE AMOUNT:  {amount:,.2f}    SOURCE CURRENCY: {rnd.choice(currencies)}")
+    transaction_date = run_date - timedelta(days=rnd.randint(0, 5))
+    lines.append(f" D0012 S01 {transaction_date.strftime('%y%m%d')}")
+    arn_parts = ["7", f"{rnd.randint(0, 999999):06d}", f"{rnd.randint(0, 9999):04d}",
+                 f"{rnd.randint(0, 99999999999):011d}", f"{rnd.randint(0, 9)}"]
+    lines.extend(f" D0031 S{i:02d} {part}" for i, part in enumerate(arn_parts, start=1))
+    lines.append(f" D0038 {rnd.randint(0, 999999):06d}")
+    lines.append(f" D0043 S01 SHOP {message_number}")
+    lines.append(" D0043 S05 CITY")
+    lines.append(f" D0043 S06 {rnd.choice(filiales)}")
+    return lines
+
+
+def write_tt140_report(path, n_rejects, n_transactions=None, filiales=None, currencies=None,
+                       cycles=2, run_date=datetime(2024, 5, 22), seed=0):
+    """
+    Write a synthetic TT140 IP727010 MasterCard report.
+
+    Parameters:
+        path (str): Path of the .001 file to write.
+        n_rejects (int): Number of rejected message blocks.
+        n_transactions (int): Number of first presentments spread over the totals (default 10 x n_rejects).
+        filiales (list): Country acronyms used for the D0043 S06 element.
+        currencies (list): Numeric currency codes used for SOURCE CURRENCY and the totals.
+        cycles (int): Number of clearing cycles in the totals section.
+        run_date (datetime): RUN DATE written in the report header.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        int: Number of transactions written in the FIRST PRES. TOTAL lines.
+    """
+    rnd = random.Random(seed)
+    filiales = filiales or default_filiales
+    currencies = currencies or default_currencies
+    if n_transactions is None:
+        n_transactions = 10 * n_rejects
+
+    header = f"1IP727010-AA               MASTERCARD WORLDWIDE                 RUN DATE: {run_date.strftime('%m/%d/%y')}   PAGE {{page}}"
+    with open(path, 'w') as f:
+        f.write(header.format(page=1) + "\n")
+        f.write("                            FIRST PRESENTMENT REJECTED MESSAGES\n")
+        # Element legend printed once at the top of the report
+        for sub_element in range(1, 6):
+            f.write(f" LEGEND  D0043 S{sub_element:02d}  CARD ACCEPTOR NAME/LOCATION\n")
+
+        for message_number in range(1, n_rejects + 1):
+            if message_number % 50 == 0:
+                f.write(header.format(page=message_number // 50 + 1) + "\n")
+            f.write("\n".join(_tt140_message(rnd, message_number, filiales, currencies, run_date)) + "\n")
+
+        # Totals section: one FIRST PRES. TOTAL line per clearing cycle and currency
+        groups = [(cycle, currency) for cycle in range(1, cycles + 1) for currency in currencies]
+        counts = [n_transactions // len(groups)] * len(groups)
+        counts[0] += n_transactions - sum(counts)
+        for (cycle, currency), count in zip(groups, counts):
+            f.write(f" CLEARING CYCLE: {cycle:02d}    CURRENCY CODE: {currency}\n")
+            f.write(f"    FIRST PRES.  TOTAL        {count}        {count * 1234.5:,.2f}\n")
+    return n_transactions
+
+
+def filiale_names(filiales):
+    """
+    FILIALE labels of the source files ('SG - BENIN') of the given country acronyms, as the
+    parser derives them from the D0043 S06 element.
+    """
+    with open(countries_settings) as f:
+        countries = json.load(f)
+    return [f"SG - {countries[acronym]}" for acronym in filiales]
+
+
+def _source_rows(rnd, filiales, currencies, transaction_types, n_transactions):
+    """
+    One aggregated row per filiale, network, transaction type and currency, with the
+    MasterCard transactions spread over the MasterCard rows so that they sum to n_transactions.
+    """
+    rows = [(filiale, reseau, transaction_type, currency)
+            for filiale in filiale_names(filiales) for reseau in reseaux
+            for transaction_type in transaction_types for currency in currencies]
+    counted = [i for i, row in enumerate(rows)
+               if row[1] == reseaux[0] and not row[2].endswith('_MDS')]
+    counts = [rnd.randint(1, 500) for _ in rows]
+    share, remainder = divmod(n_transactions, len(counted))
+    for position, i in enumerate(counted):
+        counts[i] = share + (position < remainder)
+    return [(*row, count, rnd.randint(100, 100_000_000) / 100) for row, count in zip(rows, counts)]
+
+
+def write_pos_csv(path, n_transactions, filiales=None, currencies=None, day=datetime(2024, 5, 23), seed=1):
+    """
+    Write a synthetic POS file: ';' separated, padded labels and thousands separators, as exported.
+
+    Parameters:
+        path (str): Path of the CSV file to write.
+        n_transactions (int): Number of MasterCard transactions of the file (without the _MDS ones).
+        filiales (list): Country acronyms of the filiales.
+        currencies (list): Numeric currency codes.
+        day (datetime): DATE_TRAI of the rows.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        int: Number of rows written.
+    """
+    rnd = random.Random(seed)
+    rows = _source_rows(rnd, filiales or default_filiales, currencies or default_currencies,
+                        pos_transaction_types, n_transactions)
+    with open(path, 'w') as f:
+        f.write("BANQUE ;RESEAU; TYPE_TRANSACTION;DATE_TRAI;CUR;NBRE_TRANSACTION;MONTANT_TOTAL\n")
+        for filiale, reseau, transaction_type, currency, count, amount in rows:
+            f.write(f"{filiale} ; {reseau} ;{transaction_type};{day.strftime('%Y-%m-%d')}; {currency} ;{count};{amount:,.2f}\n")
+    return len(rows)
+
+
+def write_cybersource_csv(path, n_transactions, filiales=None, currencies=None, seed=2):
+    """
+    Write a synthetic Cybersource file: ',' separated, with quoted amounts.
+
+    Parameters and Returns: see write_pos_csv.
+    """
+    rnd = random.Random(seed)
+    rows = _source_rows(rnd, filiales or default_filiales, currencies or default_currencies, ["ACHAT"], n_transactions)
+    with open(path, 'w') as f:
+        f.write("NBRE_TRANSACTION,MONTANT_TOTAL,CUR,FILIALE,RESEAU\n")
+        for filiale, reseau, _, currency, count, amount in rows:
+            f.write(f'{count},"{amount:,.2f}",{currency},{filiale} ,{reseau}\n')
+    return len(rows)
+
+
+def write_saisie_manuelle_csv(path, n_transactions, filiales=None, currencies=None, seed=3):
+    """
+    Write a synthetic Saisie Manuelle file: ';' separated.
+
+    Parameters and Returns: see write_pos_csv.
+    """
+    rnd = random.Random(seed)
+    rows = _source_rows(rnd, filiales or default_filiales, currencies or default_currencies, ["ACHAT"], n_transactions)
+    with open(path, 'w') as f:
+        f.write("NBRE_TRANSACTION;MONTANT_TOTAL;CUR;FILIALE;RESEAU\n")
+        for filiale, reseau, _, currency, count, amount in rows:
+            f.write(f"{count};{amount:,.2f};{currency};{filiale};{reseau}\n")
+    return len(rows)
+
+
+def write_recycled_excel(path, n_rows, filiales=None, currencies=None, filtering_date=datetime(2024, 5, 23),
+                         seed=4):
+    """
+    Write a synthetic Excel file of recycled transactions, with the columns of
+    assets/template_rejets_recyclées.xlsx. About half of the rows are retreated on
+    filtering_date, some of them twice, the others on the previous days.
+
+    Parameters:
+        path (str): Path of the .xlsx file to write.
+        n_rows (int): Number of rows.
+        filiales (list): Country acronyms of the filiales.
+        currencies (list): Numeric currency codes.
+        filtering_date (datetime): Date Retraitement of the recycled transactions to keep.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        int: Number of rows written.
+    """
+    rnd = random.Random(seed)
+    names = filiale_names(filiales or default_filiales)
+    currencies = currencies or default_currencies
+    rows = []
+    for i in range(n_rows):
+        if rows and rnd.random() < 0.05:
+            # Row recycled twice, dropped as a duplicate
+            rows.append(dict(rows[-1]))
+            continue
+        retreated = filtering_date - timedelta(days=0 if rnd.random() < 0.5 else rnd.randint(1, 5))
+        rows.append({
+            # Labels as typed in the spreadsheet, normalized by merging_with_recycled
+            'BANQUE': rnd.choice(names).replace('SG - ', rnd.choice(['SG - ', 'SG-'])).replace(' D IVOIRE', " D'IVOIRE"),
+            'RESEAU': reseaux[0],
+            'ARN': f"7{rnd.randint(0, 10 ** 22 - 1):022d}",
+            'Autorisation': f"{rnd.randint(0, 999999):06d}",
+            'Date Transaction': (retreated - timedelta(days=rnd.randint(1, 10))).strftime('%Y-%m-%d'),
+            'Montant': rnd.randint(100, 5_000_000) / 100,
+            'Devise': rnd.choice(currencies),
+            'Date Traitement': (retreated - timedelta(days=1)).strftime('%Y-%m-%d'),
+            'Date Retraitement': retreated,
+            'Motif': rnd.choice(error_codes)[1],
+        })
+    pd.DataFrame(rows, columns=['BANQUE', 'RESEAU', 'ARN', 'Autorisation', 'Date Transaction', 'Montant', 'Devise',
+                                'Date Traitement', 'Date Retraitement', 'Motif']).to_excel(path, index=False)
+    return n_rows
+
+
+def write_reconciliation_day(directory, n_rejects, n_transactions=None, filiales=None, currencies=None,
+                             n_recycled=0, matched=False, run_date=datetime(2024, 5, 22), seed=0):
+    """
+    Write the files of one reconciliation day: the TT140 report and the POS, Cybersource
+    and Saisie Manuelle files, named as validate_file_name_and_date expects, and optionally
+    the recycled transactions.
+
+    Parameters:
+        directory (str): Directory of the files, created if needed.
+        n_rejects (int): Number of rejected messages of the TT140 report.
+        n_transactions (int): Number of MasterCard transactions of the report (default 10 x n_rejects).
+        filiales (list): Country acronyms of the filiales.
+        currencies (list): Numeric currency codes.
+        n_recycled (int): Number of rows of the recycled transactions file (0 for no file).
+        matched (bool): If True, the sources hold as many transactions as the report, so the
+            reconciliation has no difference; otherwise they miss the rejected ones.
+        run_date (datetime): RUN DATE of the report; the business day is the day after.
+        seed (int): Seed of the random generators.
+
+    Returns:
+        dict: Paths of the files, keyed as the fields of reconciliation_engine.ReconciliationInputs,
+        and the business 'day' ('YY-MM-DD').
+    """
+    os.makedirs(directory, exist_ok=True)
+    day = run_date + timedelta(days=1)
+    if n_transactions is None:
+        n_transactions = 10 * n_rejects
+    sources_total = n_transactions if matched else n_transactions - n_rejects
+    # Split of the transactions between the three sources. merging_sources_without_recycled
+    # joins each Saisie Manuelle row to every POS row of the same FILIALE, RESEAU and CUR,
+    # so its transactions are counted once per MasterCard POS transaction type.
+    pos_types = len([transaction_type for transaction_type in pos_transaction_types
+                     if not transaction_type.endswith('_MDS')])
+    n_pos = sources_total * 7 // 10
+    n_saisie_manuelle = sources_total // 10 // pos_types
+    n_cybersource = sources_total - n_pos - pos_types * n_saisie_manuelle
+
+    def source_path(source):
+        return os.path.join(directory, f"TRANSACTION_{source}_TRAITE_SG_{day.strftime('%y-%m-%d')}_010203.CSV")
+
+    paths = {
+        'day': day.strftime('%y-%m-%d'),
+        'mastercard': os.path.join(directory, f"TT140_{run_date.strftime('%y%m%d')}.001"),
+        'cybersource': source_path('CYBERSOURCE'),
+        'pos': source_path('POS'),
+        'saisie_manuelle': source_path('SAIS_MANU'),
+    }
+    write_tt140_report(paths['mastercard'], n_rejects, n_transactions, filiales, currencies, run_date=run_date, seed=seed)
+    write_pos_csv(paths['pos'], n_pos, filiales, currencies, day, seed=seed + 1)
+    write_cybersource_csv(paths['cybersource'], n_cybersource, filiales, currencies, seed=seed + 2)
+    write_saisie_manuelle_csv(paths['saisie_manuelle'], n_saisie_manuelle, filiales, currencies, seed=seed + 3)
+    if n_recycled:
+        paths['recycled'] = os.path.join(directory, 'rejets_recycles.xlsx')
+        write_recycled_excel(paths['recycled'], n_recycled, filiales, currencies, day, seed=seed + 4)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory", help="Directory of the files")
+    parser.add_argument("--rejects", type=int, default=1000, help="Rejected messages of the TT140 report")
+    parser.add_argument("--transactions", type=int, help="MasterCard transactions (default 10 x rejects)")
+    parser.add_argument("--filiales", nargs='+', default=default_filiales, help="Country acronyms of the filiales")
+    parser.add_argument("--currencies", nargs='+', default=default_currencies, help="Numeric currency codes")
+    parser.add_argument("--recycled-rows", type=int, default=0, help="Rows of the recycled transactions file")
+    parser.add_argument("--matched", action='store_true', help="Sources without difference with the report")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    paths = write_reconciliation_day(args.directory, args.rejects, args.transactions, args.filiales, args.currencies,
+                                     args.recycled_rows, args.matched, seed=args.seed)
+    for name, path in paths.items():
+        print(f"{name}: {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules of the app import each other by their plain names, as when Streamlit runs it
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'MasterCard_UseCase')))
@@ -0,0 +1,31 @@
+import pandas as pd
+
+import database_actions
+from database_actions import cached_aggregation, invalidate_aggregation_cache
+
+
+def test_cached_aggregation_does_not_cache_failures():
+    calls = []
+
+    @cached_aggregation('Error counting')
+    def aggregation():
+        calls.append(len(calls))
+        if len(calls) == 1:
+            raise ConnectionError('server unreachable')
+        return pd.DataFrame({'FILIALE': ['SG - BENIN'], 'count': [3]})
+
+    invalidate_aggregation_cache()
+    assert aggregation().empty
+    assert aggregation()['count'].tolist() == [3]
+    # The successful result is served from the cache
+    assert aggregation()['count'].tolist() == [3]
+    assert len(calls) == 2
+
+
+def test_cached_aggregation_error_result():
+    @cached_aggregation('Error computing', error_result=None)
+    def snapshot():
+        raise ConnectionError('server unreachable')
+
+    assert snapshot() is None
+    assert not any(key[0] == 'snapshot' for key in database_actions.aggregation_cache)
@@ -0,0 +1,30 @@
+import pandas as pd
+
+from parser_TT140_MasterCard import calculate_rejected_summary, parse_t140_MC_batch, rejection_columns
+from pipeline_trace import tracing
+
+
+def test_calculate_rejected_summary_sums_numeric_amounts():
+    df_rejected = pd.DataFrame([
+        ['SG - BENIN', 'MASTERCARD INTERNATIONAL', '1', '10', '2024-05-19', 31035.08, 'XOF', 'motif'],
+        ['SG - BENIN', 'MASTERCARD INTERNATIONAL', '2', '11', '2024-05-19', 0.92, 'XOF', 'motif'],
+        ['SG - TCHAD', 'MASTERCARD INTERNATIONAL', '3', '12', '2024-05-19', 12.5, 'XAF', 'motif'],
+    ], columns=rejection_columns)
+
+    summary = calculate_rejected_summary(df_rejected)
+
+    assert summary['FILIALE'].tolist() == ['SG - BENIN', 'SG - TCHAD']
+    assert summary['Nbre Total de Rejets'].tolist() == [2, 1]
+    assert summary['Montant de Rejets'].tolist() == [31036.0, 12.5]
+
+
+def test_calculate_rejected_summary_without_rejections():
+    assert calculate_rejected_summary(None) is None
+    assert calculate_rejected_summary(pd.DataFrame(columns=rejection_columns)) is None
+
+
+def test_parse_t140_MC_batch_traces_an_empty_batch():
+    with tracing() as trace:
+        assert parse_t140_MC_batch([]) == (None, None)
+
+    assert [(span.name, span.rows_out, span.error) for span in trace.spans] == [('parse_t140_MC_batch', None, None)]
@@ -0,0 +1,32 @@
+import threading
+import tracemalloc
+
+from pipeline_trace import span, tracing
+
+
+def test_only_one_trace_measures_the_memory():
+    in_first, second_done = threading.Event(), threading.Event()
+    traces = {}
+
+    def run(name, started, wait_for):
+        with tracing(memory=True) as trace:
+            traces[name] = trace
+            started.set()
+            wait_for.wait(5)
+            with span('stage'):
+                bytearray(10 ** 6)
+
+    first = threading.Thread(target=run, args=('first', in_first, second_done))
+    first.start()
+    in_first.wait(5)
+    run('second', threading.Event(), in_first)
+    # The second trace ended without stopping the tracemalloc of the first one
+    assert tracemalloc.is_tracing()
+    second_done.set()
+    first.join(5)
+
+    assert traces['first'].memory and traces['first'].spans[0].peak_mb >= 1
+    assert not traces['second'].memory and traces['second'].spans[0].peak_mb is None
+    assert not tracemalloc.is_tracing()
+    with tracing(memory=True) as trace:
+        assert trace.memory
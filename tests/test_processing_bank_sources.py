@@ -0,0 +1,150 @@
+import numpy as np
+import openpyxl
+import pandas as pd
+import pytest
+
+from parser_TT140_MasterCard import ParsedTT140, rejected_summary_columns, rejection_columns
+from processing_bank_sources import (categories_to_str, handle_non_match_reconciliation, merge_recycled_summary,
+                                     rejection_outputs, save_excel_locally, write_excel_chunks)
+
+
+def test_categories_to_str_keeps_missing_values():
+    df = pd.DataFrame({
+        'FILIALE': pd.Categorical(['SG - BENIN', None, 'SG - TCHAD']),
+        'NBRE_TRANSACTION': [1, 2, 3],
+    })
+    result = categories_to_str(df)
+    assert result['FILIALE'].dtype == object
+    assert result['FILIALE'].tolist()[0::2] == ['SG - BENIN', 'SG - TCHAD']
+    assert result['FILIALE'].isna().tolist() == [False, True, False]
+    assert 'nan' not in result['FILIALE'].tolist()
+
+
+def test_merge_recycled_summary_adds_each_pair_once():
+    df_merged = pd.DataFrame({
+        'FILIALE': ['SG - BENIN', 'SG - BENIN', 'SG - TCHAD', np.nan, 'SG - CONGO'],
+        'RESEAU': ['MASTERCARD INTERNATIONAL'] * 4 + ['VISA INTERNATIONAL'],
+        'NBRE_TRANSACTION': [10, 20, 5, 7, 3],
+        'MONTANT_TOTAL': [100.0, 200.0, 50.0, 70.0, 30.0],
+    })
+    summary = pd.DataFrame({
+        'FILIALE': ['SG - BENIN', 'SG - TCHAD', np.nan, 'SG - CONGO', 'SG - SENEGAL'],
+        'RESEAU': ['MASTERCARD INTERNATIONAL'] * 3 + ['MASTERCARD INTERNATIONAL', 'MASTERCARD INTERNATIONAL'],
+        'NBRE_TRANSACTION': [2, 1, 4, 9, 6],
+        'MONTANT_TOTAL': [12.5, 3.0, 40.0, 90.0, 60.0],
+    })
+
+    result = merge_recycled_summary(df_merged, summary)
+
+    expected = df_merged.copy()
+    # Only the first (SG - BENIN, MASTERCARD) row is incremented
+    expected.loc[0, ['NBRE_TRANSACTION', 'MONTANT_TOTAL']] = [12, 112.5]
+    expected.loc[2, ['NBRE_TRANSACTION', 'MONTANT_TOTAL']] = [6, 53.0]
+    # The NaN FILIALE never matches, SG - CONGO is on another network and SG - SENEGAL has no row
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+    # The input is left untouched
+    assert df_merged['NBRE_TRANSACTION'].tolist() == [10, 20, 5, 7, 3]
+
+
+def test_merge_recycled_summary_without_match():
+    df_merged = pd.DataFrame({
+        'FILIALE': ['SG - BENIN'], 'RESEAU': ['MASTERCARD INTERNATIONAL'],
+        'NBRE_TRANSACTION': [10], 'MONTANT_TOTAL': [100.0],
+    })
+    summary = pd.DataFrame(columns=['FILIALE', 'RESEAU', 'NBRE_TRANSACTION', 'MONTANT_TOTAL'])
+    pd.testing.assert_frame_equal(merge_recycled_summary(df_merged, summary), df_merged, check_dtype=False)
+
+
+def merged_sources():
+    return pd.DataFrame({
+        'FILIALE': ['SG - BENIN', 'SG - BENIN', 'SG - TCHAD'],
+        'RESEAU': ['MASTERCARD INTERNATIONAL'] * 3,
+        'TYPE_TRANSACTION': ['ACHAT', 'RETRAIT', 'ACHAT'],
+        'DATE_TRAI': ['2024-05-23'] * 3,
+        'CUR': ['XOF', 'XOF', 'XAF'],
+        'NBRE_TRANSACTION': [10, 4, 6],
+        'MONTANT_TOTAL': [1000.0, 400.0, 600.0],
+    })
+
+
+def test_handle_non_match_reconciliation_marks_rejected_filiales():
+    summary = pd.DataFrame({
+        'FILIALE': ['SG - BENIN', 'SG - SENEGAL'],
+        'Nbre Total de Rejets': [3, 1],
+        'Montant de Rejets': [31035.08, 12.5],
+    })
+    parsed = ParsedTT140('checksum', 17, pd.DataFrame(), summary)
+
+    result = handle_non_match_reconciliation(parsed, merged_sources(), run_date='24-05-22')
+
+    assert result['Rapprochement'].tolist() == ['NOT OK', 'NOT OK', 'OK']
+    assert result['Nbre Total de Rejets'].tolist() == [3, 3, 0]
+    assert result['Montant de Rejets'].tolist()[:2] == [31035.08, 31035.08]
+    assert np.isnan(result['Montant de Rejets'].iloc[2])
+    assert result['Nbre de Transactions (Couverture)'].tolist() == [10, 4, 6]
+    assert result['Date'].unique().tolist() == ['2024-05-22']
+
+
+@pytest.mark.parametrize('summary', [
+    None,
+    pd.DataFrame({'FILIALE': ['SG - SENEGAL'], 'Nbre Total de Rejets': [1], 'Montant de Rejets': [12.5]}),
+], ids=['no rejection', 'no filiale match'])
+def test_handle_non_match_reconciliation_without_matching_rejections(summary):
+    parsed = ParsedTT140('checksum', 21, pd.DataFrame(), summary)
+
+    result = handle_non_match_reconciliation(parsed, merged_sources(), run_date='24-05-22')
+
+    assert result['Rapprochement'].tolist() == ['OK', 'OK', 'OK']
+    assert result['Nbre Total de Rejets'].tolist() == [0, 0, 0]
+    assert result['Montant de Rejets'].isna().all()
+    assert result['Montant Total de Transactions'].tolist() == [1000.0, 400.0, 600.0]
+
+
+def test_handle_non_match_reconciliation_fills_the_coverage_without_rejections():
+    parsed = ParsedTT140('checksum', 21, None, None)
+
+    result = handle_non_match_reconciliation(parsed, merged_sources(), run_date='24-05-22')
+
+    assert result['Nbre de Transactions (Couverture)'].tolist() == [10, 4, 6]
+    assert result['Montant de Transactions (Couverture)'].tolist() == [1000.0, 400.0, 600.0]
+
+
+def test_rejection_outputs_without_rejections():
+    summary, rejections = rejection_outputs(ParsedTT140('checksum', 21, None, None))
+
+    assert summary.empty and list(summary.columns) == rejected_summary_columns
+    assert rejections.empty and list(rejections.columns) == rejection_columns
+
+def test_write_excel_chunks_aligns_chunks_on_the_first_columns():
+    chunks = [
+        pd.DataFrame({'FILIALE': ['SG - BENIN'], 'Rapprochement': ['NOT OK'], 'Montant de Rejets': [1234.5]}),
+        # Missing Montant de Rejets, extra column, other order
+        pd.DataFrame({'Rapprochement': ['OK'], 'FILIALE': ['SG - TCHAD'], 'Extra': [1]}),
+    ]
+
+    excel_data = write_excel_chunks(iter(chunks), recon=True)
+
+    sheet = openpyxl.load_workbook(excel_data)['Sheet1']
+    assert [[cell.value for cell in row] for row in sheet.iter_rows()] == [
+        ['FILIALE', 'Rapprochement', 'Montant de Rejets'],
+        ['SG - BENIN', 'NOT OK', 1234.5],
+        ['SG - TCHAD', 'OK', None],
+    ]
+    assert sheet.auto_filter.ref == 'A1:C3'
+    assert sheet['C2'].number_format == '#,##0.00'
+    assert sheet['A2'].fill.fgColor.rgb.endswith('E26B0A')
+    assert sheet['B3'].font.b and not sheet['A3'].font.b
+
+
+def test_write_excel_chunks_without_chunks():
+    assert write_excel_chunks(iter([])) is None
+
+
+def test_save_excel_locally_writes_the_buffer(tmp_path, monkeypatch):
+    monkeypatch.setattr('tempfile.tempdir', str(tmp_path))
+    excel_data = write_excel_chunks([pd.DataFrame({'FILIALE': ['SG - BENIN'], 'Montant de Rejets': [12.5]})])
+
+    file_path = save_excel_locally(excel_data, 'rejected_summary_MC_24-05-22.xlsx')
+
+    assert file_path == str(tmp_path / 'rejected_summary_MC_24-05-22.xlsx')
+    assert pd.read_excel(file_path)['Montant de Rejets'].tolist() == [12.5]
@@ -0,0 +1,28 @@
+import os
+
+import openpyxl
+from streamlit.testing.v1 import AppTest
+
+repository = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def history_page_script(repository):
+    import sys
+    import pandas as pd
+    sys.path.insert(0, repository)
+    from MasterCard_UseCase.pages.results_recon import display_history_page
+
+    df = pd.DataFrame({'FILIALE': ['SG - BENIN', 'SG - TCHAD'], 'Rapprochement': ['NOT OK', 'OK']})
+    display_history_page('recon', 'Résultats', '2024-05-23', lambda run_date, after_id: (df, None),
+                         lambda run_date: len(df), lambda run_date: iter([df]),
+                         file_partial_name='results_reconciliation', button_label='Télécharger', styled=True)
+
+
+def test_history_export_keeps_the_not_ok_formatting():
+    at = AppTest.from_function(history_page_script, args=(repository,)).run(timeout=30)
+    at.button(key='recon_export').click().run(timeout=30)
+
+    assert not at.exception
+    sheet = openpyxl.load_workbook(at.session_state['recon_excel'])['Sheet1']
+    assert sheet['A2'].fill.fgColor.rgb.endswith('E26B0A')
+    assert sheet['B2'].font.b and not sheet['A3'].font.b
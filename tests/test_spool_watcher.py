@@ -0,0 +1,34 @@
+import os
+import re
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'benchmarks')))
+
+from spool_watcher import watch_spool
+from synthetic_data import write_reconciliation_day, write_tt140_report
+
+
+def mastercard_total(message):
+    return int(re.search(r'(\d+) against', message).group(1))
+
+
+def test_late_clearing_cycle_reconciles_the_day_again(tmp_path):
+    spool_dir, output_dir = str(tmp_path / 'spool'), str(tmp_path / 'results')
+    paths = write_reconciliation_day(spool_dir, n_rejects=20, run_date=datetime(2024, 5, 22))
+    day = paths['day']
+    first = watch_spool(spool_dir, output_dir, formats=(), max_workers=1, poll_interval=0.1,
+                        settle_seconds=0, once=True)
+    assert first[day][0]
+
+    # Report of a later clearing cycle of the same day, dropped after the day was reconciled
+    write_tt140_report(os.path.join(spool_dir, 'TT140_240522_2.001'), n_rejects=5, run_date=datetime(2024, 5, 22), seed=1)
+    second = watch_spool(spool_dir, output_dir, formats=(), max_workers=1, poll_interval=0.1,
+                         settle_seconds=0, once=True)
+
+    assert second[day][0], second[day][1]
+    assert mastercard_total(second[day][1]) > mastercard_total(first[day][1])
+    sources = ('mastercard', 'cybersource', 'pos', 'saisie_manuelle')
+    assert sorted(os.listdir(os.path.join(spool_dir, 'done', day))) == sorted(
+        [os.path.basename(paths[source]) for source in sources] + ['TT140_240522_2.001'])
+    assert not [entry for entry in os.scandir(spool_dir) if entry.is_file()]